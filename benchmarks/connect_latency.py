@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Connect-to-first-status latency benchmark, requires a real pad.
+Compares the fast connect (FE01/FE02 resolved by UUID) with the full GATT enumeration.
+
+python benchmarks/connect_latency.py -a <address> -n 5
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from ph4_walkingpad.pad import Controller, Scanner
+
+logger = logging.getLogger(__name__)
+
+
+async def measure(address, fast_connect, read_chars=False, timeout=10.0):
+    ctler = Controller(address=address, do_read_chars=read_chars, fast_connect=fast_connect)
+    ctler.log_messages_info = False
+    try:
+        await ctler.run()
+        await ctler.ask_stats()
+        deadline = time.time() + timeout
+        while ctler.first_status_latency is None and time.time() < deadline:
+            await asyncio.sleep(0.01)
+        return ctler.connect_latency, ctler.first_status_latency
+    finally:
+        await ctler.disconnect()
+
+
+def summary(name, vals):
+    vals = [x for x in vals if x is not None]
+    if not vals:
+        return "%-6s: no data" % name
+    return "%-6s: n=%d, min=%.3f s, median=%.3f s, max=%.3f s" % (
+        name,
+        len(vals),
+        min(vals),
+        statistics.median(vals),
+        max(vals),
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Connect to first status latency benchmark")
+    parser.add_argument("-a", "--address", dest="address", help="Pad address, scanned if not given")
+    parser.add_argument("-n", dest="rounds", type=int, default=3, help="Number of rounds per mode")
+    parser.add_argument("--read-chars", dest="read_chars", action="store_true", help="Read chars in full mode")
+    parser.add_argument("--pause", dest="pause", type=float, default=2.0, help="Pause between rounds, seconds")
+    args = parser.parse_args()
+
+    address = args.address
+    if not address:
+        scanner = Scanner()
+        await scanner.scan()
+        if not scanner.walking_belt_candidates:
+            raise ValueError("No pad found")
+        address = scanner.walking_belt_candidates[0]
+
+    results = {"fast": [], "full": []}
+    for _ in range(args.rounds):
+        for mode in results:
+            res = await measure(address, mode == "fast", read_chars=args.read_chars)
+            results[mode].append(res)
+            print("%-4s connect: %.3f s, first status: %s" % (mode, res[0] or 0, res[1]))
+            await asyncio.sleep(args.pause)
+
+    for mode, res in results.items():
+        print(summary(mode, [x[1] for x in res]))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
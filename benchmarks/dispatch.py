@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Command dispatch latency, the time from submitting a command coroutine in the shell to its first instruction.
+`threads` mimics the former setup, commands submitted to a worker loop thread via run_coroutine_threadsafe,
+`runtime` spawns them as tasks of the single-loop Runtime. A background task simulates status traffic.
+
+python benchmarks/dispatch.py -n 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from ph4_walkingpad.runtime import Runtime
+
+
+async def command(start, lat):
+    lat.append(time.perf_counter() - start)
+
+
+async def traffic(stop: threading.Event):
+    while not stop.is_set():
+        await asyncio.sleep(0.001)
+
+
+def report(name, lat):
+    lat = sorted(x * 1e6 for x in lat)
+    print(
+        "%-8s: median %7.1f us, p99 %7.1f us, max %8.1f us"
+        % (name, statistics.median(lat), lat[int(len(lat) * 0.99)], lat[-1])
+    )
+
+
+async def bench_threads(num):
+    worker_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=worker_loop.run_forever, daemon=True)
+    thread.start()
+    stop = threading.Event()
+    traffic_fut = asyncio.run_coroutine_threadsafe(traffic(stop), worker_loop)
+
+    lat = []
+    for _ in range(num):
+        fut = asyncio.run_coroutine_threadsafe(command(time.perf_counter(), lat), worker_loop)
+        await asyncio.wrap_future(fut)
+    stop.set()
+    await asyncio.wrap_future(traffic_fut)
+    worker_loop.call_soon_threadsafe(worker_loop.stop)
+    thread.join()
+    return lat
+
+
+async def bench_runtime(num):
+    runtime = Runtime()
+
+    async def main():
+        stop = threading.Event()
+        runtime.spawn(traffic(stop))
+        lat = []
+        for _ in range(num):
+            await runtime.spawn(command(time.perf_counter(), lat))
+        stop.set()
+        return lat
+
+    return await runtime.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command dispatch latency")
+    parser.add_argument("-n", dest="num", type=int, default=2000, help="Number of commands")
+    args = parser.parse_args()
+
+    report("threads", asyncio.run(bench_threads(args.num)))
+    report("runtime", asyncio.run(bench_runtime(args.num)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup import-time benchmark of the CLI entry points, uses `python -X importtime`.
+Each mode imports what its code path needs, the `eager` mode loads all heavy dependencies as the old entry point did.
+
+python benchmarks/startup.py -n 5
+"""
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+HEAVY = ("bleak", "requests", "blessed", "ph4acmd2", "aioconsole", "coloredlogs")
+
+# Imported by the interpreter itself
+IGNORED = ("site", "encodings", "_frozen_importlib_external", "zipimport", "codecs", "io", "abc")
+
+MODES = {
+    "cal": "import ph4_walkingpad.cal",
+    "scan": "import ph4_walkingpad.cli, ph4_walkingpad.pad, bleak",
+    "no-bt": "import ph4_walkingpad.cli, ph4_walkingpad.main",
+    "eager": "import ph4_walkingpad.main, " + ", ".join(HEAVY),
+}
+
+
+def import_time(code):
+    """Total import time in ms and the loaded heavy modules, interpreter startup imports (site) excluded"""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    total, loaded = 0, set()
+    for line in res.stderr.splitlines():
+        mt = re.match(r"^import time:\s+\d+\s+\|\s+(\d+)\s+\|( *)(\S+)", line)
+        if not mt:
+            continue
+        if len(mt.group(2)) == 1 and mt.group(3) not in IGNORED:
+            total += int(mt.group(1))
+        if mt.group(3) in HEAVY:
+            loaded.add(mt.group(3))
+    return total / 1000.0, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup import time")
+    parser.add_argument("-n", dest="num", type=int, default=5, help="Number of runs per mode")
+    parser.add_argument("modes", nargs="*", default=list(MODES.keys()), help="Modes to measure")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        times, loaded = [], []
+        for _ in range(args.num):
+            tm, loaded = import_time(MODES[mode])
+            times.append(tm)
+        print(
+            "%-6s: median %7.1f ms, min %7.1f ms, heavy: %s"
+            % (mode, statistics.median(times), min(times), ", ".join(loaded) or "-")
+        )
+
+
+if __name__ == "__main__":
+    main()
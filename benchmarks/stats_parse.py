@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stats file parsing benchmark, time per line and memory per loaded record.
+Lines follow the schema written by the controller (WalkingPadControl.on_status).
+  json: json.loads with a dict projection, baseline of the load mode
+  load: StatsLineParser with the projection the shell loads the stats file with on startup
+  dict: json.loads, full dicts, baseline of the full mode
+  full: StatsLineParser without a projection, full records
+
+python benchmarks/stats_parse.py -n 100000
+"""
+
+import argparse
+import binascii
+import json
+import time
+import tracemalloc
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.records import ANALYSIS_FIELDS, StatsLineParser
+
+
+def stats_lines(num):
+    """Stats file lines as written by the controller"""
+    ret = []
+    for i in range(num):
+        js = {
+            "time": i,
+            "dist": i // 3,
+            "steps": i * 2,
+            "speed": 30 + i % 20,
+            "app_speed": 60,
+            "belt_state": 1,
+            "controller_button": 0,
+            "manual_mode": 1,
+            "raw": binascii.hexlify(bytes(range(i % 200, i % 200 + 19))).decode("utf8"),
+            "rec_time": 1600000000.0 + i * 0.75,
+            "pid": "alice",
+            "dev": "AA:BB:CC:00:11:22",
+            "ccal": 0.081,
+            "ccal_net": 0.063,
+            "ccal_sum": round(i * 0.081, 3),
+            "ccal_net_sum": round(i * 0.063, 3),
+        }
+        ret.append(json.dumps(js))
+    return ret
+
+
+def parsers():
+    fields = StatsAnalysis(fields=ANALYSIS_FIELDS).projection()
+
+    def json_projection(line):
+        js = json.loads(line)
+        return {k: js.get(k) for k in fields}
+
+    return {
+        "json": json_projection,
+        "load": StatsLineParser(fields, records=True).parse,
+        "dict": json.loads,
+        "full": StatsLineParser(None, records=True).parse,
+    }
+
+
+def measure(parse, lines, runs):
+    """Best time per line in microseconds, traced memory per record in bytes"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        for line in lines:
+            parse(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    recs = [parse(line) for line in lines]
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del recs
+    return best / len(lines) * 1e6, size / len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stats file parsing time and memory")
+    parser.add_argument("-n", dest="num", type=int, default=50000, help="Number of lines")
+    parser.add_argument("-r", dest="runs", type=int, default=3, help="Number of runs, best is reported")
+    parser.add_argument("modes", nargs="*", default=list(parsers().keys()), help="Modes to measure")
+    args = parser.parse_args()
+
+    lines = stats_lines(args.num)
+    modes = parsers()
+    for mode in args.modes:
+        tm, size = measure(modes[mode], lines, args.runs)
+        print("%-4s: %6.2f us/line, %6.0f B/record" % (mode, tm, size))
+
+
+if __name__ == "__main__":
+    main()
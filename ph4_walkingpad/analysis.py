@@ -1,141 +1,321 @@
+import heapq
 import json
 import logging
-
-from ph4_walkingpad.profile import Profile, calories_rmrcb_minute, calories_walk2_minute
-from ph4_walkingpad.reader import reverse_file
+from collections import OrderedDict
+from typing import Optional
+
+from ph4_walkingpad.profile import (
+    CALORIE_MODELS,
+    Profile,
+    calories_rmrcb_minute,
+    model_walk2,
+)
+from ph4_walkingpad.reader import reverse_lines_offsets
+from ph4_walkingpad.records import (
+    MARK_FIELDS,
+    OWNER_FIELDS,
+    SegmentRecords,
+    StatsLineParser,
+)
+from ph4_walkingpad.resample import resample
 
 logger = logging.getLogger(__name__)
 
 
+class MarginAnalyzer:
+    """
+    Incremental walk margin detection, records are fed one by one in the reversed order (newest first).
+    feed() returns margins of a finished walk - records of speed changes, annotated with segment
+    time, distance and steps. With collect_details, margins also hold detail records of the segment,
+    loaded lazily by `details_loader(lo, hi)` if records carry stats file offsets.
+    """
+
+    def __init__(self, collect_details=False, details_loader=None):
+        self.collect_details = collect_details
+        self.details_loader = details_loader
+        self.last_rec = None
+        self.last_rec_diff = None
+        self.in_record = False
+        self.margins = []
+        self.sub_records = []
+        # Segment details are loaded lazily from the stats file if records carry line offsets
+        self.sub_start, self.sub_count = None, 0
+
+    def feed(self, js):
+        margins = self.margins
+        if js["speed"] != 0:
+            self.in_record = True
+
+        if not self.last_rec_diff or not self.in_record:
+            self.last_rec_diff = js
+            self.last_rec = js
+            self.sub_records = []
+            self.sub_start, self.sub_count = None, 0
+            if not self.in_record:
+                self.margins = [js]
+            else:
+                margins.append(js)
+            return None
+
+        last_rec, last_rec_diff = self.last_rec, self.last_rec_diff
+        time_diff = last_rec["time"] - js["time"]
+        steps_diff = last_rec["steps"] - js["steps"]
+        dist_diff = last_rec["dist"] - js["dist"]
+        rtime_diff = last_rec["rec_time"] - js["rec_time"]
+        time_to_rtime = abs(time_diff - rtime_diff)
+        js["_ldiff"] = (time_diff, steps_diff, dist_diff, rtime_diff, time_to_rtime)
+
+        breaking = time_diff < 0 or steps_diff < 0 or dist_diff < 0 or rtime_diff < 0 or time_to_rtime > 5 * 60
+        stats_changed = False
+        done = None
+
+        lazy = self.details_loader is not None and getattr(js, "offset", None) is not None
+        if self.in_record and self.collect_details:
+            if not lazy:
+                self.sub_records.append(js.copy())
+            elif self.sub_start is None:
+                self.sub_start, self.sub_count = js.offset, 1
+            else:
+                self.sub_count += 1
+
+        if breaking:
+            if margins:
+                mm = margins[-1]
+                mm["_breaking"] = breaking
+
+        if (self.in_record or not breaking) and (
+            last_rec_diff["speed"] != js["speed"]
+            or (breaking and last_rec_diff["speed"] != 0)
+            or (js["speed"] == 0 and js["time"] == 0)
+        ):
+            js["_breaking"] = breaking
+            js_src = js if not breaking else last_rec
+            if margins:
+                mm = margins[-1]
+                mm["_segment_time"] = last_rec_diff["time"] - js_src["time"]
+                mm["_segment_rtime"] = last_rec_diff["rec_time"] - js_src["rec_time"]
+                mm["_segment_dist"] = last_rec_diff["dist"] - js_src["dist"]
+                mm["_segment_steps"] = last_rec_diff["steps"] - js_src["steps"]
+                if self.collect_details and lazy and self.sub_start is not None:
+                    mm["_records"] = SegmentRecords(self.details_loader, js.offset, self.sub_start, self.sub_count - 1)
+                    self.sub_start, self.sub_count = js.offset, 1
+                elif self.collect_details:
+                    mm["_records"] = self.sub_records[:-1]
+                    self.sub_records = [js.copy()]
+
+            margins.append(js)
+            stats_changed = True
+            self.last_rec_diff = js
+
+        if (stats_changed and js["speed"] == 0 and js["time"] == 0) or breaking:
+            if margins:
+                done = margins
+
+            self.margins = [js]
+            self.in_record = False
+            self.last_rec_diff = js
+
+        # last inst.
+        self.last_rec = js
+        return done
+
+
 class StatsAnalysis:
-    def __init__(self, profile=None, profile_file=None, stats_file=None):
+    def __init__(
+        self,
+        profile=None,
+        profile_file=None,
+        stats_file=None,
+        cal_model=model_walk2,
+        fields=None,
+        resample_step=None,
+    ):
         self.profile_file = profile_file
         self.stats_file = stats_file
         self.profile = profile
+        self.cal_model = cal_model
+        self.fields = fields  # projection of the loaded records, e.g. ANALYSIS_FIELDS, None for full records
+        self.parser: Optional[StatsLineParser] = None
+        self.details_cache: OrderedDict[tuple, list] = OrderedDict()  # LRU of loaded segment detail records
+        self.details_cache_size = 16
+        self.profiles = {}  # pid -> Profile, for logs shared by several persons
+        self.missing_profiles: set = set()  # pids without a loaded profile, warned about
+        self.resample_step = resample_step  # seconds, rebuilds a uniform timeline of the records if set
 
         self.last_record = None
         self.loaded_margins = []
 
     def load_profile(self):
-        self.profile = Profile(age=30, male=True, weight=80, height=180)  # some random average person
-        if self.profile_file:
-            with open(self.profile_file, "r") as fh:
-                dt = json.load(fh)
-                self.profile = Profile.from_data(dt)
+        self.profile = None
+        if not self.profile_file:
+            logger.warning("No profile file given, calories are not computed")
+            return
+        with open(self.profile_file, "r") as fh:
+            dt = json.load(fh)
+            self.profile = Profile.from_data(dt)
 
     def load_stats(self, limit=None, collect_details=False):
         for margins in self.parse_stats(limit, collect_details=collect_details):
             self.loaded_margins.append(margins)
 
+    def load_profiles(self, profile_files):
+        """Loads profiles of all persons sharing the stats files, each file is read once. Keyed by profile id."""
+        for fname in profile_files:
+            with open(fname, "r") as fh:
+                profile = Profile.from_data(json.load(fh))
+            self.profiles[profile.pid] = profile
+        return self.profiles
+
+    def get_profile(self, pid=None):
+        """Profile of the record owner. With several persons loaded, unknown owners get none instead of a fallback."""
+        if pid is None or not self.profiles:
+            return self.profile
+        profile = self.profiles.get(pid)
+        if profile is None and pid not in self.missing_profiles:
+            self.missing_profiles.add(pid)
+            logger.warning("No profile of %s loaded, calories of the records are skipped" % (pid,))
+        return profile
+
     def feed_records(self):
         """Feed records from stats file in reversed order, one record per entry"""
         if not self.stats_file:
             return
-
-        with open(self.stats_file) as fh:
-            reader = reverse_file(fh)
-            for line in reader:
-                if line is None:
-                    return
-                if not line:
+        yield from self.feed_file(self.stats_file)
+
+    def projection(self):
+        """
+        Loaded fields, record owners are always included for per-person profiles, walk markers to tell
+        ingested pad history apart. None for full records.
+        """
+        if not self.fields:
+            return None
+        return tuple(self.fields) + tuple(x for x in OWNER_FIELDS + MARK_FIELDS if x not in self.fields)
+
+    def feed_file(self, fname, fields=None, offsets=True):
+        """Records of the stats file in reversed order, with line offsets"""
+        self.parser = parser = StatsLineParser(fields or self.projection(), records=True)
+        with open(fname, "rb") as fh:
+            for offset, line in reverse_lines_offsets(fh):
+                if not line or line.isspace():
                     continue
 
-                try:
-                    js = json.loads(line)
-                except Exception:
-                    continue
+                js = parser.parse(line.decode("utf8"))
+                if js is not None:
+                    if offsets:
+                        js.offset = offset
+                    yield js
+
+        if parser.num_failed:
+            logger.info("Invalid lines in the stats file %s: %d" % (fname, parser.num_failed))
+
+    def merge_records(self, stats_files):
+        """
+        Records of several stats files merged by rec_time, newest first.
+        Streaming k-way merge, only one pending record per file is held in memory.
+        """
+        feeds = [self.feed_file(fname, offsets=False) for fname in stats_files]
+        return heapq.merge(*feeds, key=lambda x: x["rec_time"] or 0, reverse=True)
+
+    def parse_stats_merged(self, stats_files, partition="pid", limit=None, collect_details=False):
+        """
+        Walks from several stats files, partitioned by the record owner field (pid or dev), in a single pass.
+        Yields (partition key, margins), limit is per partition.
+        """
+        analyzers = {}
+        num_done = {}
+        for js in self.merge_records(stats_files):
+            key = js.get(partition) if partition else None
+            analyzer = analyzers.get(key)
+            if analyzer is None:
+                analyzer = analyzers[key] = MarginAnalyzer(collect_details)
+                num_done[key] = 0
+            elif limit and num_done[key] >= limit:
+                continue
 
-                yield js
+            margins = analyzer.feed(js)
+            if margins:
+                num_done[key] += 1
+                yield key, margins
 
     def analyze_records_margins(self, records, limit=None, collect_details=False):
         # Load margins - boundary speed changes. In order to determine segments of the same speed.
-        last_rec = None
-        last_rec_diff = None
-        in_record = False
+        analyzer = MarginAnalyzer(collect_details, self.load_details)
         num_done = 0
-        margins = []
-        sub_records = []
-
         for js in records:
             if not self.last_record:
                 self.last_record = js
 
-            if js["speed"] != 0:
-                in_record = True
-
-            if not last_rec_diff or not in_record:
-                last_rec_diff = js
-                last_rec = js
-                sub_records = []
-                if not in_record:
-                    margins = [js]
-                else:
-                    margins.append(js)
-                continue
+            margins = analyzer.feed(js)
+            if margins:
+                yield margins
+                num_done += 1
+                if limit and num_done >= limit:
+                    return
 
+    def load_details(self, lo, hi):
+        """Stats records with line offsets in (lo, hi], newest first, as collected by collect_details. LRU cached."""
+        key = (lo, hi)
+        recs = self.details_cache.get(key)
+        if recs is not None:
+            self.details_cache.move_to_end(key)
+            return recs
+
+        recs = self.read_details(lo, hi)
+        self.details_cache[key] = recs
+        while len(self.details_cache) > self.details_cache_size:
+            self.details_cache.popitem(last=False)
+        return recs
+
+    def read_details(self, lo, hi):
+        parser = StatsLineParser(self.projection(), records=True)
+        recs = []
+        newer = None  # record following the range, for the diff of the newest record
+        with open(self.stats_file, "rb") as fh:
+            fh.seek(lo)
+            fh.readline()  # boundary record, belongs to the older segment
+            while True:
+                offset = fh.tell()
+                line = fh.readline()
+                if not line:
+                    break
+                if line.isspace():
+                    continue
+
+                js = parser.parse(line.decode("utf8"))
+                if js is None:
+                    continue
+                js.offset = offset
+                if offset > hi:
+                    newer = js
+                    break
+                recs.append(js)
+
+        recs.reverse()
+        for idx, js in enumerate(recs):
+            last_rec = recs[idx - 1] if idx else newer
+            if last_rec is None:
+                continue
             time_diff = last_rec["time"] - js["time"]
             steps_diff = last_rec["steps"] - js["steps"]
             dist_diff = last_rec["dist"] - js["dist"]
             rtime_diff = last_rec["rec_time"] - js["rec_time"]
-            time_to_rtime = abs(time_diff - rtime_diff)
-            js["_ldiff"] = [time_diff, steps_diff, dist_diff, rtime_diff, time_to_rtime]
-
-            breaking = time_diff < 0 or steps_diff < 0 or dist_diff < 0 or rtime_diff < 0 or time_to_rtime > 5 * 60
-            stats_changed = False
-
-            if in_record and collect_details:
-                sub_records.append(dict(js))
-
-            if breaking:
-                if margins:
-                    mm = margins[-1]
-                    mm["_breaking"] = breaking
-
-            if (in_record or not breaking) and (
-                last_rec_diff["speed"] != js["speed"]
-                or (breaking and last_rec_diff["speed"] != 0)
-                or (js["speed"] == 0 and js["time"] == 0)
-            ):
-                js["_breaking"] = breaking
-                js_src = js if not breaking else last_rec
-                if margins:
-                    mm = margins[-1]
-                    mm["_segment_time"] = last_rec_diff["time"] - js_src["time"]
-                    mm["_segment_rtime"] = last_rec_diff["rec_time"] - js_src["rec_time"]
-                    mm["_segment_dist"] = last_rec_diff["dist"] - js_src["dist"]
-                    mm["_segment_steps"] = last_rec_diff["steps"] - js_src["steps"]
-                    if collect_details:
-                        mm["_records"] = sub_records[:-1]
-                        sub_records = [dict(js)]
-
-                margins.append(js)
-                stats_changed = True
-                last_rec_diff = js
-
-            if (stats_changed and js["speed"] == 0 and js["time"] == 0) or breaking:
-                # print("done", breaking, time_to_rtime, time_diff, steps_diff, dist_diff, rtime_diff, js)
-                # logger.info(json.dumps(margins, indent=2))
-                if margins:
-                    yield margins
-                    num_done += 1
-                    if limit and num_done >= limit:
-                        return
-
-                margins = [js]
-                in_record = False
-                last_rec_diff = js
-
-            # last inst.
-            last_rec = js
+            js["_ldiff"] = (time_diff, steps_diff, dist_diff, rtime_diff, abs(time_diff - rtime_diff))
+        if recs and recs[0].get("_ldiff"):
+            dt = recs[0]["_ldiff"]
+            recs[0]["_breaking"] = min(dt[:4]) < 0 or dt[4] > 5 * 60
+        return recs
 
     def parse_stats(self, limit=None, collect_details=False):
         gen = self.feed_records()
+        if self.resample_step:
+            # Resampled records have no stats file offsets, details are collected by copying
+            gen = resample(gen, self.resample_step, reverse=True)
         return self.analyze_records_margins(gen, limit, collect_details=collect_details)
 
     def comp_calories(self, margins):
         # logger.debug(json.dumps(margins, indent=2))
-        # Calories segment computation
-        if not self.profile:
+        # Calories segment computation, each record with its owner profile if known
+        if not self.profile and not self.profiles:
             logger.debug("No profile loaded")
             return
 
@@ -145,12 +325,16 @@ class StatsAnalysis:
             if "_segment_time" not in exp:
                 continue
 
+            profile = self.get_profile(exp.get("pid"))
+            if not profile:
+                continue
+
             el_time = exp["_segment_time"]
             speed = exp["speed"] / 10.0
 
-            ccal = (el_time / 60) * calories_walk2_minute(speed, self.profile.weight, 0.00)
+            ccal = (el_time / 60) * self.cal_model(speed, profile)
             ccal_net = ccal - (el_time / 60) * calories_rmrcb_minute(
-                self.profile.weight, self.profile.height, self.profile.age, self.profile.male
+                profile.weight, profile.height, profile.age, profile.male
             )
 
             logger.info(
@@ -167,12 +351,75 @@ class StatsAnalysis:
         )
         return calorie_acc, calorie_acc_net
 
-    def load_last_stats(self, count=1):
-        self.load_stats(count)
+    def load_last_stats(self, count=1, collect_details=False):
+        self.load_stats(count, collect_details=collect_details)
         if self.loaded_margins:
-            logger.debug("Loaded margins: %s" % (json.dumps(self.loaded_margins[0], indent=2),))
+            logger.debug(
+                "Loaded margins: %s" % (json.dumps(self.remove_records(self.loaded_margins[:1])[0], indent=2),)
+            )
             return self.comp_calories(self.loaded_margins[0])
 
+    def walk_record(self, margins):
+        """Summary of a walk for upload: cal_acc (net), timex (start), dur, dist, steps"""
+        mm = [x for x in margins if "_segment_dist" in x and x["_segment_dist"] > 0]
+        if not mm:
+            return 0, 0, 0, 0, 0
+
+        oldest = min(mm, key=lambda x: x["rec_time"])
+        newest = min(mm, key=lambda x: -x["rec_time"])
+
+        cal_acc = 0
+        for r in mm:
+            profile = self.get_profile(r.get("pid"))
+            if not profile:
+                continue
+            el_time = r["_segment_rtime"]
+            ccal = (el_time / 60) * self.cal_model(r["speed"] / 10.0, profile)
+            ccal_net = ccal - (el_time / 60) * calories_rmrcb_minute(
+                profile.weight, profile.height, profile.age, profile.male
+            )
+            cal_acc += ccal_net
+        timex = int(oldest["rec_time"])
+        return cal_acc, timex, newest["time"], newest["dist"], newest["steps"]
+
+    @staticmethod
+    def walk_segments(margins):
+        """Segments of a walk relevant for calorie computation: list of (seg_time, speed_kmh)"""
+        return [(x["_segment_time"], x["speed"] / 10.0) for x in margins if "_segment_time" in x]
+
+    @staticmethod
+    def segment_calories(segments, model, profile):
+        """Gross and net calories of the walk segments under the given model and profile"""
+        rmr = calories_rmrcb_minute(profile.weight, profile.height, profile.age, profile.male)
+        ccal, ccal_net = 0.0, 0.0
+        for el_time, speed in segments:
+            cur = (el_time / 60) * model(speed, profile)
+            ccal += cur
+            ccal_net += cur - (el_time / 60) * rmr
+        return ccal, ccal_net
+
+    def rescore(self, models=None, profiles=None, limit=None):
+        """
+        Re-computes calories of all walks in the stats file under each model and profile.
+        The stats file is parsed once, segments of each walk are reused for all combinations.
+        Yields (walk_idx, rec_time, time, dist, {(model_name, profile_idx): (cal, cal_net)})
+        """
+        models = models or list(CALORIE_MODELS.keys())
+        profiles = profiles or [self.profile]
+        for idx, margins in enumerate(self.parse_stats(limit)):
+            segments = self.walk_segments(margins)
+            if not segments or not sum(x[0] for x in segments):
+                continue
+
+            scores = {}
+            for mname in models:
+                model = CALORIE_MODELS[mname]
+                for pidx, profile in enumerate(profiles):
+                    scores[(mname, pidx)] = self.segment_calories(segments, model, profile)
+
+            first = margins[0]
+            yield idx, first.get("rec_time"), first.get("time"), first.get("dist"), scores
+
     def remove_records(self, margins):
         ret = []
         for recs in margins:
@@ -6,14 +6,10 @@ import json
 import logging
 from typing import Union
 
-import coloredlogs
-
 from ph4_walkingpad.profile import Profile, calories_rmrcb_minute, calories_walk2_minute
 from ph4_walkingpad.utils import parse_time_string
 
 logger = logging.getLogger(__name__)
-coloredlogs.CHROOT_FILES = []
-coloredlogs.install(level=logging.INFO)
 
 
 class CalMeter:
@@ -91,6 +87,9 @@ class CalMeter:
         parser = self.argparser()
         self.args = parser.parse_args()
 
+        import coloredlogs
+
+        coloredlogs.CHROOT_FILES = []
         if self.args.debug:
             coloredlogs.install(level=logging.DEBUG)
         else:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Command line entry point of the controller.
+Arguments are parsed before the heavy modules are loaded: the interactive shell (ph4acmd2, blessed, aioconsole)
+is imported only when it is started, bleak only when Bluetooth is used, requests only for service calls.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from ph4_walkingpad.profile import CALORIE_MODELS
+
+logger = logging.getLogger(__name__)
+
+
+def argparser():
+    parser = argparse.ArgumentParser(description="ph4 WalkingPad controller")
+
+    parser.add_argument("-d", "--debug", dest="debug", action="store_const", const=True, help="enables debug mode")
+    parser.add_argument(
+        "--no-bt",
+        dest="no_bt",
+        action="store_const",
+        const=True,
+        help="Do not use Bluetooth, no belt interaction enabled",
+    )
+    parser.add_argument("--info", dest="info", action="store_const", const=True, help="enables info logging mode")
+    parser.add_argument("-s", "--scan", dest="scan", action="store_const", const=True, help="Scan all BLE and exit")
+    parser.add_argument("--cmd", dest="cmd", action="store_const", const=True, help="Non-interactive mode")
+    parser.add_argument(
+        "--ignore-bad-packets",
+        dest="ignore_bad_packets",
+        action="store_const",
+        const=True,
+        help="Ignore bad packets warnings",
+    )
+    parser.add_argument(
+        "--stats", dest="stats", type=int, default=None, help="Enable periodic stats collecting, interval in ms"
+    )
+    parser.add_argument("-j", "--json-file", dest="json_file", help="Write stats to a JSON file")
+    parser.add_argument("-p", "--profile", dest="profile", help="Profile JSON file")
+    parser.add_argument(
+        "-a",
+        "--address",
+        dest="address",
+        help="Walking pad address (if none, scanner is used). OSX 12 have to scan first, do not use",
+    )
+    parser.add_argument(
+        "--filter",
+        dest="address_filter",
+        help="Walking pad address filter, if scanning and multiple devices are found",
+    )
+    parser.add_argument(
+        "--scan-timeout", dest="scan_timeout", type=float, default=3.0, help="Scan timeout in seconds, double"
+    )
+    parser.add_argument(
+        "--device-cache",
+        dest="device_cache",
+        default=None,
+        help="Known devices cache file, default ~/.ph4-walkingpad/devices.json",
+    )
+    parser.add_argument(
+        "--no-device-cache",
+        dest="no_device_cache",
+        action="store_const",
+        const=True,
+        help="Do not use known devices cache, always scan",
+    )
+    parser.add_argument(
+        "--full-enum",
+        dest="full_enum",
+        action="store_const",
+        const=True,
+        help="Enumerate all GATT services on connect (slow), otherwise only FE01/FE02 are resolved",
+    )
+    parser.add_argument(
+        "--no-reconnect",
+        dest="no_reconnect",
+        action="store_const",
+        const=True,
+        help="Do not reconnect automatically when the connection drops",
+    )
+    parser.add_argument(
+        "--upload-outbox",
+        dest="upload_outbox",
+        default=None,
+        help="Upload outbox file, default ~/.ph4-walkingpad/outbox.json",
+    )
+    parser.add_argument(
+        "--records-cache",
+        dest="records_cache",
+        default=None,
+        help="Remote records cache file, default ~/.ph4-walkingpad/records.json",
+    )
+    parser.add_argument("--dashboard", dest="dashboard", action="store_const", const=True, help="Show live dashboard")
+    parser.add_argument(
+        "--dashboard-fps", dest="dashboard_fps", type=float, default=4.0, help="Dashboard refresh rate limit"
+    )
+    parser.add_argument(
+        "--cal-model",
+        dest="cal_model",
+        default="walk2",
+        choices=sorted(CALORIE_MODELS.keys()),
+        help="Calorie model used for the computation",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        dest="metrics_port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on this local HTTP port",
+    )
+    parser.add_argument(
+        "--resample",
+        dest="resample",
+        type=float,
+        default=None,
+        help="Resample stats records to a uniform timeline with the given step in seconds for the analysis",
+    )
+    parser.add_argument(
+        "--event-log",
+        dest="event_log",
+        default=None,
+        help="Append-only event log file (statuses, commands, connection changes, uploads), replayed on start",
+    )
+    parser.add_argument("--metrics-host", dest="metrics_host", default="127.0.0.1", help="Metrics server bind address")
+    return parser
+
+
+def setup_logging(args):
+    import coloredlogs
+
+    coloredlogs.CHROOT_FILES = []
+    if args.debug:
+        coloredlogs.install(level=logging.DEBUG)
+    elif args.info or args.scan:
+        coloredlogs.install(level=logging.INFO)
+    else:
+        coloredlogs.install(level=logging.WARNING)
+
+
+async def scan(args):
+    """Scan only mode, logs all WalkingPad candidates"""
+    from ph4_walkingpad.pad import Scanner
+
+    scanner = Scanner()
+    await scanner.scan(timeout=args.scan_timeout)
+    if scanner.walking_belt_candidates:
+        logger.info("WalkingPad candidates: %s" % (scanner.walking_belt_candidates,))
+    return scanner.walking_belt_candidates
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    args = argparser().parse_args(args=argv[1:])
+    setup_logging(args)
+
+    try:
+        loop = asyncio.get_running_loop()
+    except Exception:
+        loop = asyncio.new_event_loop()
+
+    if args.scan:
+        loop.run_until_complete(scan(args))
+        return
+
+    from ph4_walkingpad.main import WalkingPadControl
+
+    loop.set_debug(True)
+    br = WalkingPadControl()
+    loop.run_until_complete(br.main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,8 @@ import sys
 from blessed import Terminal
 from ph4acmd2 import Cmd as Cmd2
 
+from ph4_walkingpad.runtime import Runtime
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,30 +28,23 @@ class Ph4Cmd(Cmd2):
     def __init__(self, *args, **kwargs):
         super().__init__(allow_cli_args=False, **kwargs)
         self.t = Terminal()
-        self.worker_loop = None
+        self.runtime = Runtime()
         self.cmd_running = True
 
     async def _read_line(self):
+        # Windows consoles, follows the reader contract of ph4acmd2 (remove_reader / reset_reader / switch_reader)
         while True:
+            if not self.reader_enabled:
+                await asyncio.sleep(0.1)
+                continue
             line = await self.loop.run_in_executor(None, sys.stdin.readline)
-
-            # does not work:
-            # line = await self.loop.run_in_executor(None, lambda: self._read_command_line(self.prompt))
             self._exec_cmd(line)
             print(self.prompt)
             sys.stdout.flush()
 
-    def looper(self, loop):
-        logger.debug("Starting looper for loop %s" % (loop,))
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
-
-    def submit_coro(self, coro, loop=None):
-        return asyncio.run_coroutine_threadsafe(coro, loop or self.worker_loop)
-
-    def wait_coro(self, coro, loop=None):
-        future = self.submit_coro(coro, loop=loop)
-        return future.result()
+    def submit_coro(self, coro):
+        """Runs coroutine as a runtime task on the shell loop, returns the task"""
+        return self.runtime.spawn(coro)
 
     def get_term_width(self):
         try:
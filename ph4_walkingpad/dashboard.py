@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sys
+import time
+from collections import deque
+from typing import Optional
+
+from ph4_walkingpad.pad import WalkingPadCurStatus
+
+logger = logging.getLogger(__name__)
+
+SPARK_CHARS = " ▁▂▃▄▅▆▇█"
+
+
+def sparkline(values, vmax=None):
+    values = list(values)
+    if not values:
+        return ""
+    vmax = vmax or max(values) or 1
+    top = len(SPARK_CHARS) - 1
+    return "".join(SPARK_CHARS[max(0, min(top, int(round(top * x / vmax))))] for x in values)
+
+
+def format_duration(secs):
+    secs = int(secs or 0)
+    return "%d:%02d:%02d" % (secs // 3600, (secs // 60) % 60, secs % 60)
+
+
+class Dashboard:
+    """
+    Live status panel drawn at the top of the terminal.
+    Panel rows are kept out of the terminal scroll region, so shell output scrolls below the panel.
+    Updates only mark the state dirty, the render task redraws at most `fps` times per second
+    and rewrites only the lines that changed since the last frame. The whole panel is repainted
+    after other output (invalidate), on terminal resize and every `repaint_interval` seconds.
+    """
+
+    ROWS = 5
+
+    def __init__(self, term, fps=4.0, history=60, out=None, runtime=None):
+        self.term = term
+        self.fps = fps
+        self.runtime = runtime  # Runtime running the refresh task
+        self.out = out or sys.stdout
+        self.speeds = deque(maxlen=history)
+        self.status: Optional[WalkingPadCurStatus] = None
+        self.segments = []
+        self.cur_cal = 0.0
+        self.cur_cal_net = 0.0
+        self.dirty = False
+        self.prev_lines = []
+        self.full = True  # next frame repaints all rows
+        self.size = None  # terminal size the scroll region is set for
+        self.repaint_interval = 5.0
+        self.task = None
+
+    def update(self, status: WalkingPadCurStatus, segments=None, cur_cal=None, cur_cal_net=None):
+        self.status = status
+        self.speeds.append(status.speed / 10.0)
+        if segments is not None:
+            self.segments = segments
+        self.cur_cal = cur_cal or 0.0
+        self.cur_cal_net = cur_cal_net or 0.0
+        self.dirty = True
+
+    def build_lines(self, width=80):
+        st = self.status
+        if st is None:
+            return ["WalkingPad: waiting for status...".ljust(width)[:width]]
+
+        seg_cal = self.segments[-5:]
+        total = sum(self.segments) + self.cur_cal
+        lines = [
+            "Speed: %4.1f km/h   Distance: %6.2f km   Steps: %6d   Time: %s"
+            % (st.speed / 10.0, st.dist / 100.0, st.steps, format_duration(st.time)),
+            "Calories: segment %6.2f (net %6.2f), total %7.2f kcal" % (self.cur_cal, self.cur_cal_net, total),
+            "Segments: %s" % (", ".join("%.1f" % x for x in seg_cal) or "-",),
+            "Speed: %s" % (sparkline(self.speeds, vmax=6.0),),
+            "-" * width,
+        ]
+        return [x[:width] for x in lines]
+
+    def invalidate(self):
+        """Repaints the whole panel on the next frame, e.g., after other output"""
+        self.full = True
+        self.dirty = True
+
+    def frame(self):
+        """Escape sequence updating changed lines only, cursor position is preserved. None if nothing changed."""
+        t = self.term
+        width, height = t.width or 80, t.height or 24
+        lines = self.build_lines(width)[: self.ROWS]
+        lines += [""] * (self.ROWS - len(lines))
+
+        region = ""
+        if self.size != (width, height):
+            # Setting the scroll region homes the cursor, the prompt goes to the bottom row
+            region = t.csr(self.ROWS, height - 1) + t.move_xy(0, height - 1)
+            self.size = (width, height)
+            self.full = True
+
+        changes = [
+            t.move_xy(0, i) + line + t.clear_eol
+            for i, line in enumerate(lines)
+            if self.full or i >= len(self.prev_lines) or self.prev_lines[i] != line
+        ]
+        self.prev_lines = lines
+        self.full = False
+        if not changes:
+            return None
+        return region + t.save + "".join(changes) + t.restore
+
+    def render(self):
+        self.dirty = False
+        data = self.frame()
+        if data:
+            self.out.write(data)
+            self.out.flush()
+
+    async def run(self):
+        interval = 1.0 / max(0.1, self.fps)
+        last_full = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if time.monotonic() - last_full >= self.repaint_interval:
+                    self.invalidate()
+                    last_full = time.monotonic()
+                if self.dirty:
+                    self.render()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Dashboard failed: %s" % (e,))
+
+    def start(self):
+        if self.task is None:
+            self.prev_lines = []
+            self.size = None
+            self.dirty = True
+            self.task = self.runtime.spawn(self.run(), name="dashboard")
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        t = self.term
+        if self.prev_lines:
+            self.out.write(t.save + "".join(t.move_xy(0, i) + t.clear_eol for i in range(len(self.prev_lines))))
+            self.out.write(t.restore)
+        if self.size:
+            height = self.size[1]
+            self.out.write(t.csr(0, height - 1) + t.move_xy(0, height - 1))
+        self.out.flush()
+        self.prev_lines = []
+        self.size = None
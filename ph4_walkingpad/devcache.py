@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import platform
+import time
+
+from ph4_walkingpad.utils import default_data_dir
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_file():
+    return os.path.join(default_data_dir(), "devices.json")
+
+
+class DeviceCache:
+    """
+    Small JSON cache of pads connected successfully before.
+    Entry: address (MAC, or platform identifier on OSX), name, platform, characteristic handles, last seen time,
+    learned command spacing per command type, preferences set on the pad.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_file()
+        self.devices = {}
+
+    @staticmethod
+    def get_platform():
+        try:
+            return platform.system().lower()
+        except Exception:
+            return None
+
+    def load(self):
+        self.devices = {}
+        if not os.path.exists(self.path):
+            return self
+
+        try:
+            with open(self.path, "r") as fh:
+                js = json.load(fh)
+            self.devices = js.get("devices", {}) if isinstance(js, dict) else {}
+        except Exception as e:
+            logger.warning("Could not load device cache %s: %s" % (self.path, e))
+        return self
+
+    def dump(self):
+        """JSON object of the cache file"""
+        return {"devices": self.devices}
+
+    def save(self):
+        dname = os.path.dirname(self.path)
+        if dname:
+            os.makedirs(dname, exist_ok=True)
+
+        tmp_fname = self.path + ".tmp"
+        with open(tmp_fname, "w+") as fh:
+            json.dump(self.dump(), fh, indent=2)
+        os.replace(tmp_fname, self.path)
+
+    def get(self, address):
+        return self.devices.get(str(address))
+
+    def last(self, address_prefix=None):
+        """Most recently seen device of this platform"""
+        plat = self.get_platform()
+        cands = [
+            x
+            for x in self.devices.values()
+            if x.get("platform") == plat and (not address_prefix or str(x.get("address")).startswith(address_prefix))
+        ]
+        return max(cands, key=lambda x: x.get("last_seen") or 0) if cands else None
+
+    def update(self, address, name=None, handles=None, spacing=None, prefs=None, **kwargs):
+        address = str(address)
+        rec = self.devices.setdefault(address, {"address": address})
+        rec["platform"] = self.get_platform()
+        rec["last_seen"] = time.time()
+        if name is not None:
+            rec["name"] = name
+        if handles:
+            rec["handles"] = dict(handles)
+        if spacing:
+            rec["spacing"] = dict(spacing)
+        if prefs:
+            rec["prefs"] = {str(k): v for k, v in prefs.items()}
+        rec.update(kwargs)
+        return rec
+
+    def remove(self, address):
+        return self.devices.pop(str(address), None)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from typing import Optional
+
+from ph4_walkingpad.analysis import MarginAnalyzer, StatsAnalysis
+from ph4_walkingpad.history import is_hist
+from ph4_walkingpad.profile import calories_rmrcb_minute, model_walk2
+from ph4_walkingpad.records import (
+    EVENT_PREFIX,
+    FAST_FIELDS,
+    StatsLineParser,
+    StatusRecord,
+)
+from ph4_walkingpad.upload import walk_id
+
+logger = logging.getLogger(__name__)
+
+EVENT_CMD = "cmd"
+EVENT_CONN = "conn"
+EVENT_UPLOAD = "upload"
+
+
+class View:
+    """Materialised view of the event log, updated incrementally by statuses and other events"""
+
+    name = "view"
+
+    def reset(self):
+        pass
+
+    def on_status(self, rec):
+        pass
+
+    def on_event(self, ev):
+        pass
+
+    def summary(self):
+        return {}
+
+
+class LiveView(View):
+    """Current state: last status, connection, last command"""
+
+    name = "live"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last: Optional[StatusRecord] = None
+        self.connected = False
+        self.address = None
+        self.last_cmd = None
+        self.num_statuses = 0
+        self.num_cmds = 0
+
+    def on_status(self, rec):
+        self.last = rec
+        self.num_statuses += 1
+
+    def on_event(self, ev):
+        if ev["ev"] == EVENT_CMD:
+            self.last_cmd = ev.get("cmd")
+            self.num_cmds += 1
+        elif ev["ev"] == EVENT_CONN:
+            self.connected = ev.get("state") == "connected"
+            self.address = ev.get("address") or self.address
+
+    def summary(self):
+        last = self.last
+        return {
+            "connected": self.connected,
+            "address": self.address,
+            "last_cmd": self.last_cmd,
+            "statuses": self.num_statuses,
+            "commands": self.num_cmds,
+            "status": {k: last[k] for k in ("time", "dist", "steps", "speed", "rec_time")} if last else None,
+        }
+
+
+class CalorieView(View):
+    """Calories of the current walk, each interval between two statuses at the speed of the first one"""
+
+    name = "calories"
+
+    def __init__(self, profile=None, cal_model=model_walk2):
+        self.profile = profile
+        self.cal_model = cal_model
+        self.reset()
+
+    def reset(self):
+        self.prev = None
+        self.cal = 0.0
+        self.cal_net = 0.0
+
+    def on_status(self, rec):
+        prev, self.prev = self.prev, rec
+        if prev is None or self.profile is None:
+            return
+        if rec["time"] < prev["time"] or rec["steps"] < prev["steps"]:
+            self.cal, self.cal_net = 0.0, 0.0
+            return
+
+        el_time = rec["time"] - prev["time"]
+        if el_time <= 0 or prev["speed"] == 0:
+            return
+        pf = self.profile
+        cal = (el_time / 60) * self.cal_model(prev["speed"] / 10.0, pf)
+        self.cal += cal
+        self.cal_net += cal - (el_time / 60) * calories_rmrcb_minute(pf.weight, pf.height, pf.age, pf.male)
+
+    def summary(self):
+        return {"cal": round(self.cal, 3), "cal_net": round(self.cal_net, 3)}
+
+
+class WalksView(View):
+    """
+    Walk margins as produced by StatsAnalysis.parse_stats, newest first, maintained incrementally.
+    Records are buffered since the last break (counter reset, long outage), margins of the buffered chunk
+    are computed by the margin analysis once the chunk is closed by a break, the open chunk on demand.
+    """
+
+    name = "walks"
+
+    def __init__(self, max_walks=100):
+        self.max_walks = max_walks
+        self.reset()
+
+    def reset(self):
+        self.anchor = None  # last record of the previous chunk
+        self.chunk: list = []
+        self.walks: list = []  # finished walks, oldest first
+
+    @staticmethod
+    def is_break(a, b):
+        time_diff = b["time"] - a["time"]
+        rtime_diff = (b["rec_time"] or 0) - (a["rec_time"] or 0)
+        return (
+            time_diff < 0
+            or b["steps"] < a["steps"]
+            or b["dist"] < a["dist"]
+            or rtime_diff < 0
+            or abs(time_diff - rtime_diff) > 5 * 60
+        )
+
+    def analyze(self, chunk, anchor=None, successor=None):
+        """
+        Margins of the walks in the chunk, newest first. Records around the chunk are fed as in a whole-file
+        analysis: the successor (first record of the next chunk) resets the analyzer at the chunk end,
+        the anchor (last record of the previous chunk) finishes the oldest walk of the chunk.
+        """
+        analyzer = MarginAnalyzer()
+        recs = ([successor] if successor is not None else []) + chunk[::-1] + ([anchor] if anchor is not None else [])
+        ret = []
+        for idx, js in enumerate(recs):
+            margins = analyzer.feed(js.copy())
+            # Break at the chunk end finishes the walk of the next chunk, not part of this one
+            if margins and not (successor is not None and idx == 1):
+                ret.append(margins)
+        return ret
+
+    def on_status(self, rec):
+        if self.chunk and self.is_break(self.chunk[-1], rec):
+            walks = self.analyze(self.chunk, self.anchor, rec)
+            self.walks.extend(reversed(walks))
+            del self.walks[: max(0, len(self.walks) - self.max_walks)]
+            self.anchor, self.chunk = self.chunk[-1], []
+        self.chunk.append(rec)
+
+    def margins(self, limit=None):
+        ret = self.analyze(self.chunk, self.anchor) if self.chunk else []
+        ret += self.walks[::-1]
+        return ret[:limit] if limit else ret
+
+    def summary(self):
+        return {"walks": len(self.margins()), "chunk": len(self.chunk)}
+
+
+class UploadView(View):
+    """Walks not uploaded yet, keyed by walk_id. Depends on the walks view."""
+
+    name = "uploads"
+
+    def __init__(self, walks: WalksView, did=None, profile=None):
+        self.walks_view = walks
+        self.did = did
+        self.analysis = StatsAnalysis(profile=profile)
+        self.reset()
+
+    def reset(self):
+        self.uploaded = set()
+
+    def on_event(self, ev):
+        if ev["ev"] == EVENT_UPLOAD and ev.get("wid"):
+            self.uploaded.add(ev["wid"])
+
+    def candidates(self, hist=False):
+        """List of (wid, (cal_acc, timex, dur, dist, steps)), walks ingested from the pad history only with hist"""
+        ret = []
+        for margins in self.walks_view.margins():
+            if not hist and is_hist(margins):
+                continue
+            rec = self.analysis.walk_record(margins) if self.analysis.profile else (0,) + self.walk_totals(margins)
+            wid = walk_id(self.did, rec[1])
+            if rec[4] > 0 and wid not in self.uploaded:
+                ret.append((wid, rec))
+        return ret
+
+    @staticmethod
+    def walk_totals(margins):
+        mm = [x for x in margins if x.get("_segment_dist")]
+        if not mm:
+            return 0, 0, 0, 0
+        oldest = min(mm, key=lambda x: x["rec_time"])
+        newest = max(mm, key=lambda x: x["rec_time"])
+        return int(oldest["rec_time"]), newest["time"], newest["dist"], newest["steps"]
+
+    def summary(self):
+        return {"candidates": len(self.candidates()), "uploaded": len(self.uploaded)}
+
+
+class EventLog:
+    """
+    Append-only log of statuses, commands sent, connection changes and uploads, JSON lines.
+    Status events are stats records (the stats file schema), so a stats file is a valid event log of statuses.
+    Other events are {"ev": type, "t": time, ...}. Views are updated on each appended event
+    and rebuilt by replay() from the log.
+    """
+
+    def __init__(self, fname=None, io=None, views=()):
+        self.fname = fname
+        self.io = io
+        self.views = {}
+        self.pending: Optional[list] = None  # events logged during rebuild(), for the rebuilt views
+        for view in views:
+            self.register(view)
+
+    def register(self, view):
+        self.views[view.name] = view
+        return view
+
+    def write(self, js):
+        """Appends the event to the log file, a failed write is logged, views are updated regardless"""
+        if not self.fname:
+            return
+        try:
+            line = json.dumps(js) + "\n"
+            if self.io is not None:
+                self.io.append(self.fname, line)
+            else:
+                with open(self.fname, "a+") as fh:
+                    fh.write(line)
+        except Exception as e:
+            logger.warning("Event log write failed: %s" % (e,), exc_info=e)
+
+    def status(self, js):
+        """Appends status event, js in the stats file record schema"""
+        rec = StatusRecord.from_dict({k: js.get(k) for k in FAST_FIELDS})
+        for view in self.views.values():
+            view.on_status(rec)
+        if self.pending is not None:
+            self.pending.append((rec, None))
+        self.write(js)
+
+    def event(self, kind, **data):
+        ev = {"ev": kind, "t": time.time()}
+        ev.update(data)
+        for view in self.views.values():
+            view.on_event(ev)
+        if self.pending is not None:
+            self.pending.append((None, ev))
+        self.write(ev)
+        return ev
+
+    async def rebuild(self, views):
+        """
+        Replays the log into fresh views on the I/O thread and swaps them in, returns the number of events.
+        The current views keep serving live events meanwhile. Events logged during the replay are written
+        after it, I/O jobs run in order, and are applied to the fresh views before the swap.
+        """
+        await self.io.drain()
+        self.pending = []
+        try:
+            num = await self.io.run(replay, self.fname, views)
+            for rec, ev in self.pending:
+                for view in views:
+                    if rec is not None:
+                        view.on_status(rec)
+                    else:
+                        view.on_event(ev)
+        finally:
+            self.pending = None
+        self.views = {}
+        for view in views:
+            self.register(view)
+        return num
+
+    def replay(self, fname=None, views=None):
+        """Rebuilds the views from the log file, returns the number of events. Blocking."""
+        views = list(views if views is not None else self.views.values())
+        return replay(fname or self.fname, views)
+
+
+def replay(fname, views):
+    """
+    Replays the event log to the views, from scratch. Status lines are decoded by the fixed-schema fast path
+    of StatsLineParser into compact records, other events by json.
+    """
+    for view in views:
+        view.reset()
+
+    parser = StatsLineParser(FAST_FIELDS, records=True)
+    num = 0
+    with open(fname, "r") as fh:
+        for line in fh:
+            if line.startswith(EVENT_PREFIX):
+                try:
+                    ev = json.loads(line)
+                except Exception as e:
+                    logger.debug("Invalid event line: %s, %s" % (e, line[:80]))
+                    continue
+                for view in views:
+                    view.on_event(ev)
+            else:
+                if not line or line.isspace():
+                    continue
+                rec = parser.parse(line)
+                if rec is None or rec["time"] is None:
+                    continue
+                for view in views:
+                    view.on_status(rec)
+            num += 1
+    logger.debug("Replayed %d events from %s, parser: %s" % (num, fname, parser.stats()))
+    return num
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import binascii
+import json
+import logging
+from collections import OrderedDict
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.records import ANALYSIS_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def is_hist(margins):
+    """True for a walk ingested from the pad history, its time is estimated, not recorded"""
+    return any(x.get("hist") for x in margins)
+
+
+class HistorySync:
+    """
+    Ingests walk records stored in the pad (WalkingPadLastStatus) into the stats file.
+    Records matching a walk already in the stats file (belt time, distance and steps within tolerances) are skipped,
+    as are records continuing a local walk cut off by a disconnect: local totals not above the record totals
+    and no other local walk started before the pad walk could have ended.
+    A new record is written as a synthetic walk of two stats records marked with "hist": the start with zero
+    counters and the end with the totals, at the average speed, ending at the reception time.
+    Ingested walks are then found by the analysis as any other walk, and deduplicated on the next sync.
+    Their times are estimated, upload and sync leave them out unless confirmed, see is_hist().
+    """
+
+    def __init__(self, stats_file, pid=None, dev=None, lookback=50, tol_time=5, tol_dist=1, tol_steps=10):
+        self.stats_file = stats_file
+        self.pid = pid
+        self.dev = dev
+        self.lookback = lookback  # number of local walks to compare with
+        self.tol_time = tol_time
+        self.tol_dist = tol_dist
+        self.tol_steps = tol_steps
+
+    def local_walks(self):
+        """
+        (time, dist, steps, start, next_start) of the last local walks, newest first.
+        Start is set for walks cut off with the belt running (no stop recorded), next_start is the start of the next walk.
+        """
+        analysis = StatsAnalysis(stats_file=self.stats_file, fields=ANALYSIS_FIELDS)
+        ret = []
+        next_start = None
+        for margins in analysis.parse_stats(self.lookback):
+            if margins and margins[0]["time"] > 0:  # break records after a counter reset are no walks
+                last, first = margins[0], margins[-1]
+                start = first["rec_time"] - first["time"]
+                cut = start if last["speed"] > 0 and not is_hist(margins) else None
+                ret.append((last["time"], last["dist"], last["steps"], cut, next_start))
+                next_start = start
+        return ret
+
+    def is_same(self, rec, walk):
+        t, d, s = walk[:3]
+        return (
+            abs(rec.time - t) <= self.tol_time
+            and abs(rec.dist - d) <= self.tol_dist
+            and abs(rec.steps - s) <= self.tol_steps
+        )
+
+    def is_partial(self, rec, walk):
+        """Local walk is the beginning of the pad record, recording cut off in the same belt session"""
+        t, d, s, start, next_start = walk
+        if start is None or t <= 0:
+            return False
+        end = start + rec.time  # earliest end of the pad walk
+        return (
+            t <= rec.time + self.tol_time
+            and d <= rec.dist + self.tol_dist
+            and s <= rec.steps + self.tol_steps
+            and end <= rec.rtime + self.tol_time
+            and (next_start is None or next_start >= end - self.tol_time)
+        )
+
+    def is_known(self, rec, walks):
+        return any(self.is_same(rec, x) or self.is_partial(rec, x) for x in walks)
+
+    def to_stats(self, rec, end=None):
+        """Synthetic stats records of the walk ending at `end` (reception time by default), stats file schema"""
+        end = rec.rtime if end is None else end
+        speed = int(round(rec.dist * 360.0 / rec.time)) if rec.time > 0 else 0
+        ret = []
+        for time, dist, steps, rtime in ((0, 0, 0, end - rec.time), (rec.time, rec.dist, rec.steps, end)):
+            js: OrderedDict = OrderedDict()
+            js["time"] = time
+            js["dist"] = dist
+            js["steps"] = steps
+            js["speed"] = speed
+            js["app_speed"] = 0
+            js["belt_state"] = 0
+            js["controller_button"] = 0
+            js["manual_mode"] = 1
+            js["raw"] = binascii.hexlify(rec.raw).decode("utf8") if rec.raw is not None else None
+            js["rec_time"] = rtime
+            js["pid"] = self.pid
+            js["dev"] = self.dev
+            js["hist"] = True
+            ret.append(js)
+        return ret
+
+    def new_records(self, records):
+        """Pad records not present in the stats file yet"""
+        walks = self.local_walks() if self.stats_file else []
+        ret = []
+        for rec in records:
+            if rec.time <= 0 or rec.steps <= 0:
+                continue
+            if self.is_known(rec, walks):
+                logger.debug("History record already known: %s" % (rec,))
+                continue
+            walks.append((rec.time, rec.dist, rec.steps, None, None))
+            ret.append(rec)
+        return ret
+
+    def ingest(self, records):
+        """Appends new pad records to the stats file as walks, returns the ingested records. Blocking."""
+        new = self.new_records(records)
+        if not new:
+            return new
+
+        # Several records received at once are placed one before another, the pad does not report walk times
+        walks = []
+        end = None
+        for rec in sorted(new, key=lambda x: -x.rtime):
+            end = rec.rtime if end is None else min(rec.rtime, end - 1)
+            walks.append(self.to_stats(rec, end))
+            end -= rec.time
+
+        lines = [json.dumps(js) + "\n" for walk in reversed(walks) for js in walk]
+        with open(self.stats_file, "a+") as fh:
+            fh.write("".join(lines))
+        logger.info("Ingested %d walks from the pad history" % (len(new),))
+        return new
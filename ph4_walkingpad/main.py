@@ -1,25 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse
 import asyncio
 import binascii
 import json
 import logging
 import os
 import re
-import shutil
 import sys
-import threading
 import time
 from collections import OrderedDict
+from datetime import datetime
 from typing import Optional, Union
 
-import coloredlogs
-from aioconsole import ainput, get_standard_streams
-
 from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.cli import argparser, setup_logging
 from ph4_walkingpad.cmd_helper import Ph4Cmd
+from ph4_walkingpad.dashboard import Dashboard
+from ph4_walkingpad.devcache import DeviceCache
+from ph4_walkingpad.events import (
+    EVENT_UPLOAD,
+    CalorieView,
+    EventLog,
+    LiveView,
+    UploadView,
+    WalksView,
+)
+from ph4_walkingpad.history import HistorySync, is_hist
+from ph4_walkingpad.metrics import Metrics, MetricsServer
+from ph4_walkingpad.pacing import PaceGoal, PacingController
 from ph4_walkingpad.pad import (
     Controller,
     Scanner,
@@ -27,13 +36,22 @@ from ph4_walkingpad.pad import (
     WalkingPadCurStatus,
     WalkingPadLastStatus,
 )
-from ph4_walkingpad.profile import Profile, calories_rmrcb_minute, calories_walk2_minute
+from ph4_walkingpad.persist import IOExecutor
+from ph4_walkingpad.profile import (
+    CALORIE_MODELS,
+    Profile,
+    calories_rmrcb_minute,
+    get_calorie_model,
+    model_walk2,
+)
+from ph4_walkingpad.program import ProgramRunner, load_program
+from ph4_walkingpad.records import ANALYSIS_FIELDS, read_stats_file
+from ph4_walkingpad.resample import export_csv
+from ph4_walkingpad.sync import RecordSync, default_records_file
+from ph4_walkingpad.upload import UploadQueue, default_outbox_file
 from ph4_walkingpad.upload import login as svc_login
-from ph4_walkingpad.upload import upload_record
 
 logger = logging.getLogger(__name__)
-coloredlogs.CHROOT_FILES = []
-coloredlogs.install(level=logging.INFO)
 
 
 class WalkingPadControl(Ph4Cmd):
@@ -45,12 +63,23 @@ class WalkingPadControl(Ph4Cmd):
         self.ctler = None  # type: Optional[Controller]
         self.profile = None
         self.analysis = None  # type: Optional[StatsAnalysis]
+        self.cal_model = model_walk2
         self.loaded_margins = []
         self.streams = None
+        self.metrics = Metrics()
+        self.metrics_server = None  # type: Optional[MetricsServer]
+        self.device_cache = None  # type: Optional[DeviceCache]
+        self.upload_queue = None  # type: Optional[UploadQueue]
+        self.record_sync = None  # type: Optional[RecordSync]
+        self.events = None  # type: Optional[EventLog]
+
+        self.io = IOExecutor()
+        self.render_pending = None
+        self.render_task = None
+        self.dashboard = None  # type: Optional[Dashboard]
+        self.program = None  # type: Optional[ProgramRunner]
+        self.pacing = None  # type: Optional[PacingController]
 
-        self.worker_thread = None
-        self.stats_thread = None
-        self.stats_loop = None
         self.stats_task = None
         self.stats_collecting = False
         self.asked_status = False
@@ -69,40 +98,53 @@ class WalkingPadControl(Ph4Cmd):
         if self.ctler:
             await self.ctler.disconnect()
 
-    async def connect(self, address):
+    async def connect(self, address, handles=None):
         if self.args.no_bt:
             return
 
-        self.ctler = Controller(address=address, do_read_chars=False)
+        self.ctler = Controller(address=address, do_read_chars=False, fast_connect=not self.args.full_enum)
         self.ctler.log_messages_info = self.args.cmd
         self.ctler.ignore_bad_packets = self.args.ignore_bad_packets
         self.ctler.handler_cur_status = self.on_status
         self.ctler.handler_last_status = self.on_last_record
+        if self.events:
+            self.ctler.handler_event = self.events.event
+        self.ctler.metrics = self.metrics
+        self.ctler.auto_reconnect = not self.args.no_reconnect
+        self.ctler.gatt_handles = dict(handles or {})
+        device_cache = await self.load_device_cache()
+        cached = device_cache.get(getattr(address, "address", address)) if device_cache else None
+        if cached:
+            self.ctler.spacing.load(cached.get("spacing"))
+            self.ctler.prefs.update({int(k): v for k, v in (cached.get("prefs") or {}).items()})
 
         await self.ctler.run()
-        await asyncio.sleep(1.5)  # needs to sleep a bit
+        self.ctler.start_dispatcher()
+        if self.render_task is None:
+            self.render_task = self.submit_coro(self.render_loop())
+        self.remember_device(address)
 
+        # The pad is ready once it answers, command spacing is then learned per command type
+        await self.ctler.ask_stats(confirm=True, timeout=3.0)
         await self.ctler.ask_profile()
-        await asyncio.sleep(1.5)
         await self.ask_beep()
-        await asyncio.sleep(1.0)
 
     async def work(self):
-        self.worker_loop = asyncio.new_event_loop()
-        self.worker_thread = threading.Thread(target=self.looper, args=(self.worker_loop,))
-        self.worker_thread.daemon = True
-        self.worker_thread.start()
+        if self.args.metrics_port is not None:
+            await self.start_metrics()
 
-        address = await self.scan_address()
         if self.args.scan:
+            await self.scan_address()
             return
 
-        await self.connect(address)
-        # await asyncio.wait_for(self.connect(address), None, loop=self.worker_loop)
+        await self.connect_device()
 
         if self.args.stats:
             self.start_stats_fetching()
 
+        if self.args.dashboard:
+            self.toggle_dashboard(True)
+
         res = None
         if not self.args.cmd:
             sys.argv = [self.args_src[0]]
@@ -116,13 +158,78 @@ class WalkingPadControl(Ph4Cmd):
             except KeyboardInterrupt:
                 print("Terminating")
 
-        self.stats_collecting = False
-        if not self.args.no_bt:
-            await asyncio.sleep(1)
+        self.stop_stats_fetching()
+        if self.ctler:
+            self.remember_device(self.ctler.address)  # learned command spacing
+        await self.io.drain()
+        if self.dashboard:
+            self.dashboard.stop()
+        if self.render_task:
+            self.render_task.cancel()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        if self.upload_queue:
+            self.upload_queue.close()
+        self.io.shutdown()
 
         logger.info("Terminating")
         return res
 
+    async def start_metrics(self):
+        self.metrics_server = MetricsServer(self.metrics, host=self.args.metrics_host, port=self.args.metrics_port)
+        await self.metrics_server.start()
+
+    async def connect_device(self):
+        """Connects directly to the last known pad if possible, scans only if it fails"""
+        if self.args.no_bt:
+            return
+
+        cached = await self.get_cached_device()
+        if cached:
+            try:
+                logger.info("Connecting to the cached device %s" % (cached["address"],))
+                await self.connect(cached["address"], cached.get("handles"))
+                return
+            except Exception as e:
+                logger.info("Direct connect to %s failed, scanning: %s" % (cached["address"], e))
+                if self.ctler:
+                    await self.ctler.disconnect()
+
+        address = await self.scan_address()
+        await self.connect(address)
+
+    async def load_device_cache(self):
+        if self.args.no_device_cache or self.device_cache is not None:
+            return self.device_cache
+        self.device_cache = await self.io.run(DeviceCache(self.args.device_cache).load)
+        return self.device_cache
+
+    async def get_cached_device(self):
+        if self.args.address or not await self.load_device_cache():
+            return None
+        return self.device_cache.last(address_prefix=self.args.address_filter)
+
+    def remember_device(self, address):
+        """Updates the loaded device cache, written on the I/O thread"""
+        if self.device_cache is None or not address:
+            return
+
+        def on_saved(fut):
+            if fut.exception():
+                logger.warning("Could not store device cache: %s" % (fut.exception(),))
+
+        try:
+            self.device_cache.update(
+                getattr(address, "address", address),
+                name=getattr(address, "name", None),
+                handles=self.ctler.gatt_handles if self.ctler else None,
+                spacing=self.ctler.spacing.dump() if self.ctler else None,
+                prefs=self.ctler.prefs if self.ctler else None,
+            )
+            self.io.save_json(self.device_cache.path, self.device_cache.dump()).add_done_callback(on_saved)
+        except Exception as e:
+            logger.warning("Could not store device cache: %s" % (e,))
+
     async def scan_address(self):
         if self.args.no_bt:
             return
@@ -138,40 +245,37 @@ class WalkingPadControl(Ph4Cmd):
 
         if not address or self.args.scan:
             scanner = Scanner()
-            await scanner.scan(timeout=self.args.scan_timeout)
+            await scanner.scan(
+                timeout=self.args.scan_timeout,
+                address_prefix=self.args.address_filter if not self.args.scan else None,
+                early_exit=not self.args.scan,
+            )
 
             if scanner.walking_belt_candidates:
                 candidates = scanner.walking_belt_candidates
                 logger.info("WalkingPad candidates: %s" % (candidates,))
                 if self.args.scan:
                     return None
-
-                if self.args.address_filter:
-                    candidates = [x for x in candidates if str(x.address).startswith(self.args.address_filter)]
-                return candidates[0] if candidates else None
+                return candidates[0]
         return None
 
-    def init_stats_fetcher(self):
-        self.stats_loop = asyncio.new_event_loop()
-        self.stats_thread = threading.Thread(target=self.looper, args=(self.stats_loop,))
-        self.stats_thread.daemon = True
-        self.stats_thread.start()
-
     def start_stats_fetching(self):
-        if self.args.no_bt:
+        if self.args.no_bt or self.stats_collecting:
             return
 
-        if self.stats_thread is None:
-            self.init_stats_fetcher()
-
         logger.info("Starting stats fetching")
         self.stats_collecting = True
-        self.submit_coro(self.stats_fetcher(), self.stats_loop)
+        self.stats_task = self.submit_coro(self.stats_fetcher())
+
+    def stop_stats_fetching(self):
+        self.stats_collecting = False
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            self.stats_task = None
 
     async def stats_fetcher(self):
         while self.stats_collecting:
             try:
-                # await asyncio.wait_for(self.ctler.ask_stats(), None, loop=self.worker_loop)
                 await self.ctler.ask_stats()
                 await asyncio.sleep(max(500, self.args.stats or 0) / 1000.0)
             except Exception as e:
@@ -216,10 +320,7 @@ class WalkingPadControl(Ph4Cmd):
         ccal, ccal_net, ccal_sum, ccal_net_sum = None, None, None, None
         if el_time > 0 and el_dist > 0:
             ccal = (
-                (
-                    (el_time / 60)
-                    * calories_walk2_minute(self.last_speed_change_rec.speed / 10.0, self.profile.weight, 0.00)
-                )
+                ((el_time / 60) * self.cal_model(self.last_speed_change_rec.speed / 10.0, self.profile))
                 if self.last_speed_change_rec is not None
                 else 0
             )
@@ -243,6 +344,14 @@ class WalkingPadControl(Ph4Cmd):
             self.cur_cal_net = 0
             self.last_speed_change_rec = status
 
+        self.update_metrics(status, ccal_sum, ccal_net_sum)
+        if self.program and self.program.running:
+            self.program.on_status(status)
+        if self.pacing and self.pacing.running:
+            self.pacing.on_status(status)
+        if self.dashboard and self.dashboard.task:
+            self.dashboard.update(status, self.calorie_acc, self.cur_cal, self.cur_cal_net)
+
         ccal_str = ""
         if ccal is not None:
             ccal_str = ", cal: %6.2f, net: %6.2f, total: %6.2f, total net: %6.2f" % (
@@ -254,11 +363,11 @@ class WalkingPadControl(Ph4Cmd):
 
         if self.asked_status:
             self.asked_status = False
-            print(str(status) + ccal_str)
+            self.render(str(status) + ccal_str)
 
         elif self.asked_status_beep:
             self.asked_status_beep = False
-            print(str(status) + ccal_str)
+            self.render(str(status) + ccal_str)
 
         if not self.args.json_file:
             return
@@ -277,13 +386,52 @@ class WalkingPadControl(Ph4Cmd):
         )
         js["rec_time"] = status.rtime if status is not None else None
         js["pid"] = self.profile.pid if self.profile else None
+        js["dev"] = getattr(self.ctler.address, "address", self.ctler.address) if self.ctler else None
         js["ccal"] = round(ccal * 1000) / 1000 if ccal else None
         js["ccal_net"] = round(ccal_net * 1000) / 1000 if ccal_net else None
         js["ccal_sum"] = round(ccal_sum * 1000) / 1000 if ccal_sum else None
         js["ccal_net_sum"] = round(ccal_net_sum * 1000) / 1000 if ccal_net_sum else None
-        with open(self.args.json_file, "a+") as fh:
-            json.dump(js, fh)
-            fh.write("\n")
+        self.persist_record(js)
+        if self.events:
+            self.events.status(js)
+
+    def persist_record(self, js):
+        """Appends the record to the stats file, on the I/O thread"""
+        self.io.append(self.args.json_file, json.dumps(js) + "\n")
+
+    def postcmd(self, stop, statement):
+        if self.dashboard and self.dashboard.task:
+            self.dashboard.invalidate()
+        return super().postcmd(stop, statement)
+
+    def render(self, line):
+        """Schedules line for printing, the renderer prints only the latest one each render interval"""
+        self.render_pending = line
+        if self.render_task is None:
+            print(line)
+            self.render_pending = None
+
+    async def render_loop(self, interval=0.2):
+        while True:
+            await asyncio.sleep(interval)
+            line, self.render_pending = self.render_pending, None
+            if line is not None:
+                print(line)
+                if self.dashboard and self.dashboard.task:
+                    self.dashboard.invalidate()
+
+    def update_metrics(self, status: WalkingPadCurStatus, ccal_sum=None, ccal_net_sum=None):
+        mt = self.metrics
+        mt.set_gauge("speed_kmh", status.speed / 10.0, helps="Current belt speed in km/h")
+        mt.set_gauge("distance_km", status.dist / 100.0, helps="Distance of the current walk in km")
+        mt.set_gauge("steps", status.steps, helps="Steps of the current walk")
+        mt.set_gauge("time_seconds", status.time, helps="Belt running time of the current walk")
+        mt.set_gauge("belt_state", status.belt_state, helps="Belt state reported by the pad")
+        mt.set_gauge("last_status_timestamp_seconds", status.rtime, helps="Reception time of the last status")
+        if ccal_sum is not None:
+            mt.set_gauge("calories_kcal", ccal_sum, helps="Calories burned this walk")
+        if ccal_net_sum is not None:
+            mt.set_gauge("calories_net_kcal", ccal_net_sum, helps="Net calories burned this walk")
 
     def on_last_record(self, sender, status: WalkingPadLastStatus):
         print(status)
@@ -296,17 +444,10 @@ class WalkingPadControl(Ph4Cmd):
             self.profile = Profile.from_data(dt)
 
     def save_profile(self):
+        """Saves the profile on the I/O thread, returns the future of the write"""
         if not self.args.profile or not self.profile:
-            return
-
-        tmp_fname = self.args.profile + ".tmp"
-        bak_fname = self.args.profile + ".backup"
-        with open(tmp_fname, "w+") as fh:
-            json.dump(self.profile.dump(), fh, indent=2)
-
-        if not os.path.exists(bak_fname):
-            shutil.copy(self.args.profile, bak_fname)
-        os.rename(tmp_fname, self.args.profile)
+            return None
+        return self.io.save_json(self.args.profile, self.profile.dump(), backup=True)
 
     def login(self):
         if not self.args.profile or not self.profile:
@@ -322,13 +463,43 @@ class WalkingPadControl(Ph4Cmd):
         self.save_profile()
         return res
 
-    def load_stats(self):
-        """Compute last unfinished walk from the stats file (segments of the same speed)"""
+    def build_views(self):
+        """Empty event log views"""
+        walks = WalksView()
+        views = [LiveView(), CalorieView(self.profile, self.cal_model), walks]
+        views.append(UploadView(walks, did=self.profile.did if self.profile else None, profile=self.profile))
+        return views
+
+    def setup_events(self):
+        if not self.args.event_log:
+            return
+        self.events = EventLog(self.args.event_log, io=self.io, views=self.build_views())
+
+    async def replay_events(self):
+        """Rebuilds the event log views from the log file into fresh views, on the I/O thread"""
+        if not self.events or not os.path.exists(self.events.fname):
+            return 0
+        num = await self.events.rebuild(self.build_views())
+        logger.info("Event log replayed, events: %d" % (num,))
+        return num
+
+    async def load_stats(self):
+        """Compute last unfinished walk from the stats file (segments of the same speed), on the I/O thread"""
+        await self.replay_events()
         if not self.args.json_file:
+            if self.events:
+                self.analysis = StatsAnalysis(profile=self.profile, cal_model=self.cal_model)
+                self.loaded_margins = self.events.views["walks"].margins(5)
             return
 
-        self.analysis = StatsAnalysis(profile=self.profile, stats_file=self.args.json_file)
-        accs = self.analysis.load_last_stats(5)
+        self.analysis = StatsAnalysis(
+            profile=self.profile,
+            stats_file=self.args.json_file,
+            cal_model=self.cal_model,
+            fields=ANALYSIS_FIELDS,  # compact records by the fast parser path
+            resample_step=self.args.resample,
+        )
+        accs = await self.io.run(self.analysis.load_last_stats, 5, True)
         self.loaded_margins = self.analysis.loaded_margins
 
         self.calorie_acc = accs[0]
@@ -375,91 +546,43 @@ class WalkingPadControl(Ph4Cmd):
         #     self.last_speed_change_rec.rtime -= mgs[0]['_segment_rtime']
         #     self.last_speed_change_rec.steps -= mgs[0]['_segment_steps']
 
-    async def main(self):
+    async def main(self, args=None):
         logger.debug("App started")
 
-        parser = self.argparser()
         self.args_src = sys.argv
-        self.args = parser.parse_args(args=self.args_src[1:])
-
-        if self.args.debug:
-            coloredlogs.install(level=logging.DEBUG)
-        elif self.args.info or self.args.scan:
-            coloredlogs.install(level=logging.INFO)
-        else:
-            coloredlogs.install(level=logging.WARNING)
+        if args is None:
+            args = self.argparser().parse_args(args=self.args_src[1:])
+            setup_logging(args)
+        self.args = args
 
+        self.cal_model = get_calorie_model(self.args.cal_model)
         self.load_profile()
+        self.setup_events()
 
         try:
-            self.load_stats()
+            await self.load_stats()
         except Exception as e:
             logger.debug("Stats loading failed: %s" % (e,))
 
         try:
-            await self.work()
+            await self.runtime.run(self.work())
         except Exception as e:
             logger.error("Exception in the main entry point: %s" % (e,), exc_info=e)
         finally:
             await self.disconnect()
 
     def argparser(self):
-        parser = argparse.ArgumentParser(description="ph4 WalkingPad controller")
-
-        parser.add_argument("-d", "--debug", dest="debug", action="store_const", const=True, help="enables debug mode")
-        parser.add_argument(
-            "--no-bt",
-            dest="no_bt",
-            action="store_const",
-            const=True,
-            help="Do not use Bluetooth, no belt interaction enabled",
-        )
-        parser.add_argument("--info", dest="info", action="store_const", const=True, help="enables info logging mode")
-        parser.add_argument("-s", "--scan", dest="scan", action="store_const", const=True, help="Scan all BLE and exit")
-        parser.add_argument("--cmd", dest="cmd", action="store_const", const=True, help="Non-interactive mode")
-        parser.add_argument(
-            "--ignore-bad-packets",
-            dest="ignore_bad_packets",
-            action="store_const",
-            const=True,
-            help="Ignore bad packets warnings",
-        )
-        parser.add_argument(
-            "--stats", dest="stats", type=int, default=None, help="Enable periodic stats collecting, interval in ms"
-        )
-        parser.add_argument("-j", "--json-file", dest="json_file", help="Write stats to a JSON file")
-        parser.add_argument("-p", "--profile", dest="profile", help="Profile JSON file")
-        parser.add_argument(
-            "-a",
-            "--address",
-            dest="address",
-            help="Walking pad address (if none, scanner is used). OSX 12 have to scan first, do not use",
-        )
-        parser.add_argument(
-            "--filter",
-            dest="address_filter",
-            help="Walking pad address filter, if scanning and multiple devices are found",
-        )
-        parser.add_argument(
-            "--scan-timeout", dest="scan_timeout", type=float, default=3.0, help="Scan timeout in seconds, double"
-        )
-        return parser
+        return argparser()
 
     async def stop_belt(self, to_standby=False):
-        await self.ctler.stop_belt()
+        # Next step is sent once the pad confirms the previous one
+        await self.ctler.stop_belt(confirm=to_standby)
         if to_standby:
-            await asyncio.sleep(1.5)
             await self.ctler.switch_mode(WalkingPad.MODE_STANDBY)
 
     async def start_belt(self, manual=True):
-        if manual:
-            await self.ctler.switch_mode(WalkingPad.MODE_MANUAL)
-            await asyncio.sleep(1.5)
-            await self.ctler.start_belt()
-        else:
-            await self.ctler.switch_mode(WalkingPad.MODE_AUTOMAT)
-            await asyncio.sleep(1.5)
-            await self.ctler.start_belt()
+        await self.ctler.switch_mode(WalkingPad.MODE_MANUAL if manual else WalkingPad.MODE_AUTOMAT, confirm=True)
+        await self.ctler.start_belt()
 
     async def switch_mode(self, mode):
         if mode == "manual":
@@ -490,21 +613,7 @@ class WalkingPadControl(Ph4Cmd):
         # mt_data = re.match(r'^(?:(%s)\s*m)\s+(?:(\d+)\s*s)\s+(?:(%s)\s*m)\s+(?:(%s)\s*m)\s+(?:(%s)\s*m)\s+$')
         cal_acc, timex, dur, dist, steps = 0, 0, 0, 0, 0
         if mt_int:
-            idx = int(line)
-            mm = [x for x in self.loaded_margins[idx] if "_segment_dist" in x and x["_segment_dist"] > 0]
-            oldest = min(mm, key=lambda x: x["rec_time"])
-            newest = min(mm, key=lambda x: -x["rec_time"])
-
-            cal_acc = 0
-            for r in mm:
-                el_time = r["_segment_rtime"]
-                ccal = (el_time / 60) * calories_walk2_minute(r["speed"] / 10.0, self.profile.weight, 0.00)
-                ccal_net = ccal - (el_time / 60) * calories_rmrcb_minute(
-                    self.profile.weight, self.profile.height, self.profile.age, self.profile.male
-                )
-                cal_acc += ccal_net
-            timex = int(oldest["rec_time"])
-            dur, dist, steps = newest["time"], newest["dist"], newest["steps"]
+            cal_acc, timex, dur, dist, steps = self.margin_record(int(line))
 
         elif "," in line:
             p = [x.strip() for x in line.split(",")]
@@ -534,13 +643,113 @@ class WalkingPadControl(Ph4Cmd):
             return
 
         self.poutput("Uploading...")
-        r = upload_record(
+        queue = await self.get_upload_queue()
+        wid, res = await queue.upload(
             self.profile.token, self.profile.did, cal=int(cal_acc), timex=timex, dur=dur, distance=dist, step=steps
         )
-        r.raise_for_status()
-        self.poutput("Response: %s, data: %s" % (r, r.json()))
+        if isinstance(res, Exception):
+            self.poutput("Upload of %s failed: %s" % (wid, res))
+        else:
+            self.poutput("Uploaded %s, response: %s" % (wid, res["response"]))
+
+    def margin_record(self, idx):
+        """Upload record computed from the loaded margin: cal_acc, timex, dur, dist, steps"""
+        return self.analysis.walk_record(self.loaded_margins[idx])
+
+    async def sync_records(self, hist=False):
+        """Fetches new remote records, shows local walks missing upstream, pad history walks only with hist"""
+        if not self.profile or not self.profile.token:
+            self.poutput("Profile is not properly loaded (token)")
+            return
+
+        if self.record_sync is None:
+            self.record_sync = await self.io.run(RecordSync(self.args.records_cache or default_records_file()).load)
+
+        num_new = await self.io.run(self.record_sync.sync, self.profile.token)
+        self.poutput("New remote records: %d, total: %d" % (num_new, len(self.record_sync.records)))
+        if not self.analysis:
+            return
+
+        walks = [(i, self.margin_record(i)) for i in self.margin_indices(hist)]
+        missing = self.record_sync.missing_walks(walks)
+        for idx, (cal_acc, timex, dur, dist, steps) in missing:
+            self.poutput(
+                "Missing upstream: margin %2d, time: %d, duration=%5d, distance=%5d, steps=%5d, cal=%5d"
+                % (idx, timex, dur, dist, steps, cal_acc)
+            )
+        self.poutput("Local walks: %d, missing upstream: %d" % (len(walks), len(missing)))
+
+    async def sync_history(self):
+        """Downloads walks stored in the pad, ingests those missing in the stats file as walks"""
+        if not self.args.json_file:
+            self.poutput("Stats file is required (--json-file)")
+            return
+
+        records = await self.ctler.collect_history()
+        hist = HistorySync(
+            self.args.json_file,
+            pid=self.profile.pid if self.profile else None,
+            dev=getattr(self.ctler.address, "address", self.ctler.address),
+        )
+        await self.io.drain()  # pending live records first
+        new = await self.io.run(hist.ingest, records)
+        for rec in new:
+            self.poutput("Ingested: %s" % (rec,))
+        self.poutput("Pad records: %d, new walks: %d" % (len(records), len(new)))
+        if new:
+            self.poutput("Times of ingested walks are estimated, check them and confirm by `upload_all hist`")
+        if new:
+            await self.load_stats()
+
+    async def get_upload_queue(self):
+        if self.upload_queue is None:
+            self.upload_queue = await self.io.run(UploadQueue(self.args.upload_outbox or default_outbox_file()).load)
+        return self.upload_queue
+
+    def margin_indices(self, hist=False):
+        """Indices of the loaded walks, walks ingested from the pad history (estimated times) only with hist"""
+        ret = [i for i, m in enumerate(self.loaded_margins) if hist or not is_hist(m)]
+        skipped = len(self.loaded_margins) - len(ret)
+        if skipped:
+            self.poutput("Pad history walks left out: %d, add `hist` to include them" % (skipped,))
+        return ret
+
+    async def upload_all(self, hist=False):
+        """Queues all loaded walks not uploaded yet and uploads them in bulk, pad history walks only with hist"""
+        if not self.profile or not self.profile.did or not self.profile.token:
+            self.poutput("Profile is not properly loaded (token, did)")
+            return
+
+        queue = await self.get_upload_queue()
+        for idx in self.margin_indices(hist):
+            cal_acc, timex, dur, dist, steps = self.margin_record(idx)
+            if steps == 0:
+                continue
+            wid = await self.io.run(queue.enqueue, self.profile.did, cal_acc, timex, dur, dist, steps)
+            if wid:
+                self.poutput("Queued walk %s: Duration=%5d, distance=%5d, steps=%5d" % (wid, dur, dist, steps))
+
+        if queue.failed:
+            self.poutput(
+                "Walks rejected by the service: %d, `upload <margin_index>` sends again" % (len(queue.failed),)
+            )
+        if not queue.pending:
+            self.poutput("Nothing to upload")
+            return
+
+        self.poutput("Uploading %d walks..." % (len(queue.pending),))
+        res = await queue.flush(self.profile.token)
+        failed = [k for k, v in res.items() if isinstance(v, Exception)]
+        for wid in failed:
+            self.poutput("Upload of %s failed: %s" % (wid, res[wid]))
+        if self.events:
+            for wid in (k for k, v in res.items() if not isinstance(v, Exception)):
+                self.events.event(EVENT_UPLOAD, wid=wid)
+        self.poutput("Uploaded: %d, failed: %d" % (len(res) - len(failed), len(failed)))
 
     async def ask_prompt(self, prompt="", is_int=False):
+        from aioconsole import ainput
+
         ret_val = None
         self.switch_reader(False)
         self.remove_reader()
@@ -562,6 +771,8 @@ class WalkingPadControl(Ph4Cmd):
         return ret_val
 
     async def ask_yn(self):
+        from aioconsole import ainput, get_standard_streams
+
         ret_val = None
         self.switch_reader(False)
         self.remove_reader()
@@ -587,7 +798,7 @@ class WalkingPadControl(Ph4Cmd):
 
     def do_quit(self, line):
         """Terminate the shell"""
-        self.stats_collecting = True
+        self.stop_stats_fetching()
         self.cmd_running = False
         print("Terminating, please wait...")
         return super().do_quit(line)
@@ -609,9 +820,31 @@ class WalkingPadControl(Ph4Cmd):
         """Asks for the latest record, does not print anything"""
         self.submit_coro(self.ctler.ask_hist())
 
+    def do_history(self, line):
+        """Downloads walks stored in the pad and adds those missing to the stats file, e.g., walks without the host"""
+        self.submit_coro(self.sync_history())
+
     def do_speed(self, line):
-        """Change speed of the running belt. Enter as speed * 10, e.g. 20 for 2.0 km/h"""
-        self.submit_coro(self.ctler.change_speed(int(line)))
+        """Change speed of the running belt. Enter as speed * 10, e.g. 20 for 2.0 km/h. speed 20 confirm waits for the belt"""
+        args = line.split()
+        self.submit_coro(self.change_speed(int(args[0]), confirm="confirm" in args[1:]))
+
+    async def change_speed(self, speed, confirm=False):
+        st = await self.ctler.change_speed(speed, confirm=confirm)
+        if confirm:
+            self.poutput("Speed %s: %s" % ("confirmed" if st else "not confirmed", st or ""))
+
+    def do_latency(self, line):
+        """Prints command round-trip latencies, write to the confirming status"""
+        if not self.ctler:
+            return
+        for name, stats in sorted(self.ctler.cmd_stats.items()):
+            sm = stats.summary()
+            lats = ["%6.3f s" % sm[x] if sm[x] is not None else "%8s" % "-" for x in ("median", "p90", "max")]
+            self.poutput(
+                "%-10s count: %4d, timeouts: %3d, median: %s, p90: %s, max: %s"
+                % (name, sm["count"], sm["timeouts"], lats[0], lats[1], lats[2])
+            )
 
     def do_start(self, line):
         """Start the belt in the manual mode"""
@@ -625,6 +858,123 @@ class WalkingPadControl(Ph4Cmd):
         """Switch mode of the belt"""
         self.submit_coro(self.switch_mode(line.strip()))
 
+    def do_gatt(self, line):
+        """Diagnostic: enumerate all GATT services, characteristics and descriptors. Use `gatt read` to read values"""
+        if not self.ctler:
+            return
+        read = line.strip() == "read"
+        self.submit_coro(self.ctler.enumerate_services(read_chars=read, read_descriptors=read, log_fnc=print))
+
+    def toggle_dashboard(self, enable=None):
+        if self.dashboard is None:
+            self.dashboard = Dashboard(self.t, fps=self.args.dashboard_fps, runtime=self.runtime)
+        enable = self.dashboard.task is None if enable is None else enable
+        if enable:
+            self.dashboard.start()
+        else:
+            self.dashboard.stop()
+
+    def do_dashboard(self, line):
+        """Toggles live dashboard at the top of the terminal. Use `dashboard on` / `dashboard off`"""
+        arg = line.strip().lower()
+        self.toggle_dashboard(True if arg == "on" else False if arg == "off" else None)
+
+    async def run_program(self, fname):
+        steps = load_program(fname)
+        if not steps:
+            self.poutput("Empty program")
+            return
+
+        self.program = ProgramRunner(self.ctler, steps)
+        self.poutput("Program %s: %d steps, %d s" % (fname, len(steps), self.program.total_duration))
+        if not self.stats_collecting:
+            self.start_stats_fetching()
+
+        res = await self.program.run()
+        self.poutput("Program finished: %s" % (res,))
+
+    def do_program(self, line):
+        """Runs interval program from a JSON file: program <file>, program stop, program status"""
+        arg = line.strip()
+        if arg == "stop":
+            if self.program:
+                self.program.stop()
+        elif arg == "status":
+            if self.program:
+                self.poutput("Step %d/%d, %s" % (self.program.idx, len(self.program.steps), self.program.report()))
+        elif arg:
+            if self.program and self.program.running:
+                self.poutput("Program is already running")
+                return
+            self.submit_coro(self.run_program(arg))
+        else:
+            self.poutput("Usage: program <file> | stop | status")
+
+    async def run_pacing(self, goal: PaceGoal):
+        if not self.ctler:
+            self.poutput("Pacing not started: no controller")
+            return
+        try:
+            self.pacing = PacingController(self.ctler, goal, self.profile, model=self.cal_model)
+        except ValueError as e:
+            self.poutput("Pacing not started: %s (--profile)" % (e,))
+            return
+        self.poutput("Pacing: %s %s in %d s" % (goal.value, "km" if goal.kind == "dist" else "kcal", goal.duration))
+        if not self.stats_collecting:
+            self.start_stats_fetching()
+        if self.ctler.last_status:
+            self.pacing.on_status(self.ctler.last_status)
+
+        res = await self.pacing.run()
+        self.poutput("Pacing finished: %s" % (res,))
+
+    def do_max_speed(self, line):
+        """Sets the max speed preference of the pad in km/h, pacing stays below it: max_speed 4.5"""
+        if not self.ctler:
+            return
+        arg = line.strip()
+        if not arg:
+            self.poutput("Max speed: %.1f km/h" % (self.ctler.speed_limit() / 10.0,))
+            return
+        speed = int(round(float(arg) * 10))
+        if not 0 < speed <= WalkingPad.MAX_SPEED:
+            self.poutput("Max speed has to be in (0, %.1f] km/h" % (WalkingPad.MAX_SPEED / 10.0,))
+            return
+        self.submit_coro(self.ctler.set_pref_max_speed(speed))
+
+    def write_trace(self, pacing, fname, trace):
+        """Writes the pacing trace snapshot, blocking"""
+        pacing.dump_trace(fname, trace)
+        return ["Trace of %d decisions written to %s" % (len(trace), fname)]
+
+    def do_pace(self, line):
+        """Adjusts speed to reach a goal in time: pace 5km in 60min, pace 300kcal in 45min, pace stop|status|trace <file>"""
+        arg = line.strip()
+        if arg == "stop":
+            if self.pacing:
+                self.pacing.stop()
+        elif arg == "status":
+            if self.pacing:
+                self.poutput("Pacing: %s" % (self.pacing.result(),))
+        elif arg.startswith("trace"):
+            fname = arg[len("trace") :].strip()
+            if not self.pacing or not fname:
+                self.poutput("Usage: pace trace <file>, pacing has to be started first")
+                return
+            self.submit_coro(self.run_blocking("Trace", self.write_trace, self.pacing, fname, list(self.pacing.trace)))
+        elif arg:
+            if self.pacing and self.pacing.running:
+                self.poutput("Pacing is already running")
+                return
+            try:
+                goal = PaceGoal.parse(arg)
+            except Exception as e:
+                self.poutput("Invalid goal: %s" % (e,))
+                return
+            self.submit_coro(self.run_pacing(goal))
+        else:
+            self.poutput("Usage: pace <goal> | stop | status | trace <file>")
+
     def do_status(self, line):
         """Print the last received status"""
         print(self.ctler.last_status)
@@ -640,7 +990,17 @@ class WalkingPadControl(Ph4Cmd):
     def do_upload(self, line):
         """Uploads records to the app server. Format: dist, dur, steps, timex, cal_acc.
         Alternatively, use upload <margin_index>"""
-        self.submit_coro(self.upload_record(line), loop=self.loop)
+        self.submit_coro(self.upload_record(line))
+
+    def do_upload_all(self, line):
+        """Uploads all loaded walks (see margins) not uploaded yet, retries pending uploads from the outbox.
+        Walks ingested from the pad history are confirmed by `upload_all hist`"""
+        self.submit_coro(self.upload_all(hist=line.strip() == "hist"))
+
+    def do_sync(self, line):
+        """Syncs remote records incrementally and lists loaded walks missing upstream.
+        Walks ingested from the pad history are included by `sync hist`"""
+        self.submit_coro(self.sync_records(hist=line.strip() == "hist"))
 
     def do_login(self, line):
         """Login to the walkingpad service, refreshes JWT token for record upload (logs of the application)
@@ -652,32 +1012,124 @@ class WalkingPadControl(Ph4Cmd):
         except Exception as e:
             logger.error("Could not login: %s" % (e,), exc_info=e)
 
-    def do_margins(self, line):
-        target = int(line) if line else None
+    async def run_blocking(self, what, fn, *args):
+        """Runs blocking fn on the I/O thread so BLE notifications keep flowing on the loop, prints returned lines"""
+        try:
+            lines = await self.io.run(fn, *args)
+        except Exception as e:
+            logger.error("%s failed: %s" % (what, e), exc_info=e)
+            return
+        for line in lines or ():
+            self.poutput(line)
+
+    def rescore(self, models, profile_files, limit=None):
+        """Rescoring table lines, blocking"""
+        profiles = [self.profile] if self.profile else []
+        for fname in profile_files:
+            with open(fname, "r") as fh:
+                profiles.append(Profile.from_data(json.load(fh)))
+        if not profiles:
+            return ["No profile to score, use --profile or give profile files"]
+
+        analysis = StatsAnalysis(profile=profiles[0], stats_file=self.args.json_file, fields=ANALYSIS_FIELDS)
+        cols = [(m, p) for m in models for p in range(len(profiles))]
+        out = ["Profiles: %s" % (", ".join("%d: %s" % (i, p) for i, p in enumerate(profiles)),)]
+        out.append(
+            "%4s %-19s %8s %7s | %s" % ("idx", "end", "time", "km", " | ".join("%s/%d net (gross)" % x for x in cols))
+        )
+
+        num_walks = 0
+        for idx, rec_time, timex, dist, scores in analysis.rescore(models, profiles, limit):
+            num_walks += 1
+            end = datetime.fromtimestamp(rec_time).strftime("%Y-%m-%d %H:%M:%S") if rec_time else "-"
+            vals = " | ".join("%8.2f (%7.2f)" % (scores[x][1], scores[x][0]) for x in cols)
+            out.append("%4d %-19s %8s %7.2f | %s" % (idx, end, timex, (dist or 0) / 100.0, vals))
+        out.append("Walks: %d" % (num_walks,))
+        return out
+
+    def do_rescore(self, line):
+        """
+        Re-computes calories of all walks in the stats file under several models and profiles, in one pass.
+        Usage: rescore [limit] [model,model,...] [profile.json ...]
+        """
+        if not self.args.json_file:
+            self.poutput("No stats file, use --json-file")
+            return
+
+        limit, models, profile_files = None, list(CALORIE_MODELS.keys()), []
+        for arg in line.split():
+            if arg.isdigit():
+                limit = int(arg)
+            elif arg.endswith(".json"):
+                profile_files.append(arg)
+            else:
+                models = arg.split(",")
+
+        try:
+            [get_calorie_model(x) for x in models]
+        except Exception as e:
+            self.poutput("Invalid model: %s" % (e,))
+            return
+        self.submit_coro(self.run_blocking("Rescoring", self.rescore, models, profile_files, limit))
+
+    def margins_lines(self, target=None, details=False):
+        """Margins output lines, details are loaded from the stats file, blocking"""
+        out = []
         for i, m in enumerate(self.loaded_margins):
             if target is not None and i != target:
                 continue
-            print("=" * 80, "Margin %2d, records: %3d" % (i, len(m)))
-            print(json.dumps(self.analysis.remove_records([m])[0], indent=2))
-            print("- " * 40, "Margin %2d, records: %3d" % (i, len(m)))
-        print("Num margins: %s" % (len(self.loaded_margins),))
+            out.append("=" * 80 + " Margin %2d, records: %3d" % (i, len(m)))
+            if details:
+                out.append(json.dumps([x.to_dict() if hasattr(x, "to_dict") else x for x in m], indent=2))
+            else:
+                out.append(json.dumps(self.analysis.remove_records([m])[0], indent=2))
+            out.append("- " * 40 + " Margin %2d, records: %3d" % (i, len(m)))
+        out.append("Num margins: %s" % (len(self.loaded_margins),))
+        return out
+
+    def do_margins(self, line):
+        """Prints loaded walk margins: margins [index] [details], details loads segment records from the stats file"""
+        args = line.split()
+        target = int(args[0]) if args and args[0].isdigit() else None
+        self.submit_coro(self.run_blocking("Margins", self.margins_lines, target, "details" in args))
+
+    def export(self, fname, step=None):
+        with open(fname, "w", newline="") as fh:
+            num = export_csv(read_stats_file(self.args.json_file), fh, step)
+        return ["Exported %d records to %s" % (num, fname)]
+
+    def do_export(self, line):
+        """Exports stats file records to CSV: export <file.csv> [step], resampled to step seconds if given"""
+        args = line.split()
+        if not args or not self.args.json_file:
+            self.poutput("Usage: export <file.csv> [step], requires the stats file (--json-file)")
+            return
+
+        step = float(args[1]) if len(args) > 1 else None
+        self.submit_coro(self.run_blocking("Export", self.export, args[0], step))
+
+    def do_views(self, line):
+        """Prints event log views: views [name]"""
+        if not self.events:
+            self.poutput("Event log is not enabled (--event-log)")
+            return
+        for name, view in self.events.views.items():
+            if line.strip() and name != line.strip():
+                continue
+            self.poutput("%s: %s" % (name, json.dumps(view.summary())))
+
+    def do_replay(self, line):
+        """Rebuilds the event log views from the log file"""
+        self.submit_coro(self.replay_events())
 
     do_q = do_quit
     do_Q = do_quit
 
 
 def main():
-    try:
-        loop = asyncio.get_running_loop()
-    except Exception:
-        loop = asyncio.new_event_loop()
-
-    loop.set_debug(True)
-    br = WalkingPadControl()
-    loop.run_until_complete(br.main())
+    from ph4_walkingpad.cli import main as cli_main
 
-    # Alternatively
-    # asyncio.run(br.main())
+    cli_main()
 
 
 if __name__ == "__main__":
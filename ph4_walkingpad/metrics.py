@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+
+
+class Metrics:
+    """
+    Live session metrics - gauges, counters and latency summaries.
+    Rendered in the Prometheus text exposition format.
+
+    Updates are plain dict assignments, no locking is involved, so the BLE path
+    never waits on a scrape. Rendering works on a snapshot of the current values.
+    """
+
+    def __init__(self, prefix="walkingpad"):
+        self.prefix = prefix
+        self.helps = OrderedDict()
+        self.types = OrderedDict()
+        self.values = OrderedDict()  # (name, labels) -> value
+        self.summaries = OrderedDict()  # (name, labels) -> [count, sum, max]
+
+    def _name(self, name, mtype, helps=None):
+        fname = "%s_%s" % (self.prefix, name) if self.prefix else name
+        if fname not in self.types:
+            self.types[fname] = mtype
+            self.helps[fname] = helps or name
+        return fname
+
+    def set_gauge(self, name, value, labels=None, helps=None):
+        fname = self._name(name, "gauge", helps)
+        self.values[(fname, tuple(labels or ()))] = value
+
+    def inc(self, name, value=1, labels=None, helps=None):
+        fname = self._name(name, "counter", helps)
+        key = (fname, tuple(labels or ()))
+        self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, labels=None, helps=None):
+        fname = self._name(name, "summary", helps)
+        key = (fname, tuple(labels or ()))
+        summ = self.summaries.get(key)
+        if summ is None:
+            self.summaries[key] = [1, value, value]
+        else:
+            summ[0] += 1
+            summ[1] += value
+            summ[2] = max(summ[2], value)
+
+    def get(self, name, labels=None, default=None):
+        fname = "%s_%s" % (self.prefix, name) if self.prefix else name
+        return self.values.get((fname, tuple(labels or ())), default)
+
+    def render(self):
+        values = list(self.values.items())
+        summaries = [(k, list(v)) for k, v in list(self.summaries.items())]
+        lines = []
+        done = set()
+
+        for fname, mtype in list(self.types.items()):
+            if fname in done:
+                continue
+            done.add(fname)
+            lines.append("# HELP %s %s" % (fname, self.helps.get(fname, fname)))
+            lines.append("# TYPE %s %s" % (fname, mtype))
+
+            if mtype != "summary":
+                for (vname, labels), val in values:
+                    if vname == fname and val is not None:
+                        lines.append("%s%s %s" % (fname, format_labels(labels), val))
+                continue
+
+            samples = [(format_labels(labels), v) for (vname, labels), v in summaries if vname == fname]
+            for lbl, (cnt, total, _) in samples:
+                lines.append("%s_count%s %s" % (fname, lbl, cnt))
+                lines.append("%s_sum%s %s" % (fname, lbl, total))
+
+            # Maximum is not a summary sample, exposed as a gauge of its own
+            lines.append("# HELP %s_max Maximum of %s" % (fname, self.helps.get(fname, fname)))
+            lines.append("# TYPE %s_max gauge" % (fname,))
+            for lbl, (_, _, vmax) in samples:
+                lines.append("%s_max%s %s" % (fname, lbl, vmax))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing metrics on /metrics, runs on an existing asyncio loop"""
+
+    def __init__(self, metrics: Metrics, host="127.0.0.1", port=9105, read_timeout=5.0):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        sockets = self.server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info("Metrics server listening on %s:%s" % (self.host, self.port))
+        return self
+
+    async def stop(self):
+        if not self.server:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), self.read_timeout)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.read_timeout)
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+
+            parts = request.decode("latin1").split()
+            path = parts[1] if len(parts) >= 2 else ""
+            if parts and parts[0] == "GET" and path.split("?")[0] in ("/metrics", "/"):
+                status, ctype, body = "200 OK", "text/plain; version=0.0.4", self.metrics.render().encode("utf8")
+            else:
+                status, ctype, body = "404 Not Found", "text/plain", b"Not found\n"
+
+            writer.write(
+                b"HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                % (status.encode("latin1"), ctype.encode("latin1"), len(body))
+            )
+            writer.write(body)
+            await writer.drain()
+
+        except Exception as e:
+            logger.debug("Metrics request failed: %s" % (e,))
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception as e:
+                logger.debug("Metrics connection close failed: %s" % (e,))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ph4_walkingpad.pad import WalkingPadCurStatus
+from ph4_walkingpad.profile import Profile, calories_net_minute, model_walk2
+from ph4_walkingpad.utils import parse_time_string
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PaceGoal:
+    kind: str = "dist"  # dist [km], cal [net kcal]
+    value: float = 0.0
+    duration: float = 0.0  # seconds
+
+    @staticmethod
+    def parse(spec):
+        """Parses goal such as "5km in 60min", "300kcal in 45m", "5 km 1:00" """
+        mt = re.match(r"^\s*([\d.]+)\s*(km|kcal|cal)\s+(?:in\s+)?(.+?)\s*$", spec.strip(), re.IGNORECASE)
+        if not mt:
+            raise ValueError("Unknown goal format, use e.g. '5km in 60min' or '300kcal in 45min'")
+        kind = "dist" if mt.group(2).lower() == "km" else "cal"
+        dur = mt.group(3).lower().replace("min", "m").replace(" ", "")
+        return PaceGoal(kind=kind, value=float(mt.group(1)), duration=parse_time_string(dur))
+
+
+def net_cal_minute(speed_kmh, profile: Profile, model=model_walk2):
+    return calories_net_minute(speed_kmh, profile, model=model)
+
+
+class PacingController:
+    """
+    Host-side closed-loop controller adjusting belt speed to reach a distance or calorie goal in time.
+    Required speed is recomputed from the remaining goal and time on each status.
+    Commands are rate-limited (cmd_interval) and sent only if the change exceeds the deadband.
+    Each decision is recorded to the trace for offline evaluation.
+    """
+
+    def __init__(
+        self,
+        ctler,
+        goal: PaceGoal,
+        profile: Optional[Profile] = None,
+        model=model_walk2,
+        min_speed=10,
+        max_speed=None,
+        cmd_interval=15.0,
+        deadband=1.5,
+        clock=time.time,
+    ):
+        if goal.kind == "cal" and profile is None:
+            raise ValueError("Calorie goal requires a profile")
+        self.ctler = ctler
+        self.goal = goal
+        self.profile = profile  # calories are tracked only with a profile
+        self.model = model  # calorie model, as in the analysis
+        self.min_speed = min_speed
+        self.max_speed = max_speed if max_speed is not None else ctler.speed_limit()  # max speed pref of the pad
+        self.cmd_interval = cmd_interval
+        self.deadband = deadband
+        self.clock = clock
+
+        self.start_status: Optional[WalkingPadCurStatus] = None
+        self.last_status: Optional[WalkingPadCurStatus] = None
+        self.kcal = 0.0
+        self.last_cmd = None  # (time, speed)
+        self.trace: list[dict] = []
+        self.running = False
+        self.status_event = None
+
+    def elapsed(self):
+        if self.start_status is None or self.last_status is None:
+            return 0
+        return self.last_status.time - self.start_status.time
+
+    def progress(self):
+        if self.start_status is None or self.last_status is None:
+            return 0.0
+        if self.goal.kind == "dist":
+            return (self.last_status.dist - self.start_status.dist) / 100.0
+        return self.kcal
+
+    def on_status(self, status: WalkingPadCurStatus):
+        prev = self.last_status
+        if self.start_status is None or (prev is not None and status.time < prev.time):
+            self.start_status = status
+            self.kcal = 0.0
+        elif prev is not None and status.time > prev.time and self.profile is not None:
+            self.kcal += (status.time - prev.time) / 60.0 * net_cal_minute(prev.speed / 10.0, self.profile, self.model)
+        self.last_status = status
+        if self.status_event is not None:
+            self.status_event.set()
+
+    def required_speed(self):
+        """Speed in belt units needed to reach the goal in the remaining time, float"""
+        remaining_t = self.goal.duration - self.elapsed()
+        remaining = self.goal.value - self.progress()
+        if remaining <= 0:
+            return float(self.min_speed)
+        if remaining_t <= 0:
+            return float(self.max_speed)
+
+        if self.goal.kind == "dist":
+            speed = remaining / (remaining_t / 3600.0) * 10
+        else:
+            rate = remaining / (remaining_t / 60.0)
+            speed = next(
+                (
+                    s
+                    for s in range(self.min_speed, self.max_speed + 1)
+                    if net_cal_minute(s / 10.0, self.profile, self.model) >= rate
+                ),
+                self.max_speed,
+            )
+        return min(float(self.max_speed), max(float(self.min_speed), speed))
+
+    def decide(self, now=None):
+        """Returns speed to command now or None"""
+        if self.last_status is None:
+            return None
+
+        now = self.clock() if now is None else now
+        target_raw = self.required_speed()
+        target = int(round(target_raw))
+        current = self.last_cmd[1] if self.last_cmd else self.last_status.speed
+
+        # Rate limiting and hysteresis. Distance is reported in 10 m units, the deadband widens
+        # with the speed error the quantization causes as the remaining time shrinks.
+        remaining_t = self.goal.duration - self.elapsed()
+        deadband = self.deadband
+        if self.goal.kind == "dist" and remaining_t > 0:
+            deadband += 0.01 / (remaining_t / 3600.0) * 10
+        rate_ok = self.last_cmd is None or now - self.last_cmd[0] >= self.cmd_interval
+        endgame = self.last_cmd is not None and remaining_t < 2 * self.cmd_interval
+        cmd = target if rate_ok and not endgame and abs(target_raw - current) >= deadband else None
+        if cmd is not None:
+            self.last_cmd = (now, cmd)
+
+        st = self.last_status
+        self.trace.append(
+            {
+                "t": now,
+                "belt_time": st.time,
+                "elapsed": self.elapsed(),
+                "speed": st.speed,
+                "target": target,
+                "cmd": cmd,
+                "dist": st.dist,
+                "kcal": round(self.kcal, 3),
+                "progress": round(self.progress(), 3),
+            }
+        )
+        return cmd
+
+    def done(self):
+        return self.progress() >= self.goal.value or self.elapsed() >= self.goal.duration
+
+    async def run(self, poll=1.0):
+        self.running = True
+        try:
+            while self.running and not self.done():
+                cmd = self.decide()
+                if cmd is not None:
+                    logger.info("Pacing: changing speed to %.1f km/h" % (cmd / 10,))
+                    await self.ctler.change_speed(cmd)
+                await asyncio.sleep(poll)
+        finally:
+            self.running = False
+        return self.result()
+
+    def stop(self):
+        self.running = False
+
+    def result(self):
+        return {
+            "goal": self.goal.kind,
+            "value": self.goal.value,
+            "duration": self.goal.duration,
+            "progress": round(self.progress(), 3),
+            "elapsed": self.elapsed(),
+            "commands": len([x for x in self.trace if x["cmd"] is not None]),
+        }
+
+    def dump_trace(self, fname, trace=None):
+        """Writes the trace as JSON lines, a snapshot of the trace can be given to write it off the loop"""
+        with open(fname, "w+") as fh:
+            for rec in self.trace if trace is None else trace:
+                json.dump(rec, fh)
+                fh.write("\n")
+
+
+def simulate(goal: PaceGoal, profile: Optional[Profile] = None, pad=None, dt=1.0, **kwargs):
+    """Runs the pacing controller against the simulated pad in virtual time, returns the controller"""
+    from ph4_walkingpad.sim import SimulatedPad
+
+    pad = pad or SimulatedPad()
+    ctl = PacingController(pad, goal, profile, clock=pad.clock, **kwargs)
+    ctl.on_status(pad.status())
+    while not ctl.done() and pad.now < goal.duration * 2:
+        cmd = ctl.decide()
+        if cmd is not None:
+            pad.command(cmd)
+        ctl.on_status(pad.tick(dt))
+    return ctl
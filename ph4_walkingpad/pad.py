@@ -6,20 +6,89 @@ import binascii
 import logging
 import platform
 import time
+from collections import deque
 from dataclasses import dataclass, field
 from typing import Optional
 
-import bleak
-from bleak import BleakClient
-
 # typing
 if False:
     from bleak.backends.device import BLEDevice
 
+    from ph4_walkingpad.metrics import Metrics
+
 
 logger = logging.getLogger(__name__)
 
 
+class CommandStats:
+    """Round-trip latencies of a command type, write to the confirming status. Keeps last `size` samples."""
+
+    def __init__(self, size=64):
+        self.samples: deque[float] = deque(maxlen=size)
+        self.count = 0
+        self.timeouts = 0
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        data = sorted(self.samples)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "median": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "max": max(self.samples) if self.samples else None,
+        }
+
+
+class CommandSpacing:
+    """
+    Learned minimal spacing after each command type before the next command may be sent.
+    Additive increase, multiplicative decrease: after `streak` confirmed commands the spacing shrinks by `decrease`,
+    an unconfirmed or failed command backs it off to at least the default. Never below the confirmation latency.
+    """
+
+    def __init__(self, default=0.69, min_space=0.1, max_space=3.0, decrease=0.9, streak=3):
+        self.default = default
+        self.min_space = min_space
+        self.max_space = max_space
+        self.decrease = decrease
+        self.streak = streak
+        self.spaces: dict[str, float] = {}
+        self.successes: dict[str, int] = {}
+
+    def get(self, name):
+        return self.spaces.get(name, self.default)
+
+    def confirmed(self, name, latency):
+        self.successes[name] = self.successes.get(name, 0) + 1
+        if self.successes[name] < self.streak:
+            return
+        self.successes[name] = 0
+        floor = max(self.min_space, min(latency, self.max_space))
+        self.spaces[name] = max(floor, self.get(name) * self.decrease)
+
+    def failed(self, name):
+        self.successes[name] = 0
+        self.spaces[name] = min(self.max_space, max(self.default, self.get(name) * 1.5 + 0.1))
+        logger.debug("Command spacing after %s increased to %.3f s" % (name, self.spaces[name]))
+
+    def dump(self):
+        return {k: round(v, 3) for k, v in self.spaces.items()}
+
+    def load(self, data):
+        for k, v in (data or {}).items():
+            self.spaces[k] = min(self.max_space, max(self.min_space, float(v)))
+        return self
+
+
 class Scanner:
     UUIDS = [
         "00001800-0000-1000-8000-00805f9b34fb",
@@ -50,6 +119,11 @@ class Scanner:
         self.receive_data = []
         self.walking_belt_candidates: list[BLEDevice] = []
 
+        # Background scanning, cache of known pads: address -> KnownPad
+        self.known_pads: dict[str, KnownPad] = {}
+        self.cache_ttl = 60.0
+        self.background_scanner = None
+
     @staticmethod
     def is_darwin():
         try:
@@ -61,42 +135,139 @@ class Scanner:
     def get_bleak_kwargs():
         return Scanner.BLEAK_KWARGS if Scanner.is_darwin() else {}
 
-    async def scan(self, timeout=3.0, dev_name="walkingpad", matcher=None):
-        kwargs = Scanner.get_bleak_kwargs()
-        logger.info("Scanning for peripherals...")
-        logger.debug("Scanning kwargs: %s" % (kwargs,))
-        scanner = bleak.BleakScanner(**kwargs)
-        dev_map = await scanner.discover(timeout=timeout, return_adv=True, **kwargs)
-        dev = None
+    @staticmethod
+    def matches(dev, dev_name="walkingpad", matcher=None, address_prefix=None):
+        if address_prefix and not str(dev.address).startswith(address_prefix):
+            return False
+        if dev_name and dev.name and dev_name in dev.name.lower():
+            return True
+        return bool(matcher and matcher(dev.name))
 
-        for i, dev_addr in enumerate(dev_map):
-            dev, advertisements = dev_map[dev_addr]
+    @staticmethod
+    def get_rssi(dev, advertisements=None):
+        rssi = getattr(advertisements, "rssi", None)
+        return rssi if rssi is not None else getattr(dev, "rssi", None)
 
-            # Print the devices discovered
+    def reset(self):
+        self.devices_dict = {}
+        self.devices_list = []
+        self.walking_belt_candidates = []
+
+    def on_detection(self, dev, advertisements):
+        is_new = dev.address not in self.devices_dict
+        renamed = not is_new and dev.name and self.devices_dict[dev.address][0] != dev.name
+        self.devices_dict[dev.address] = [dev.name, advertisements.service_uuids]
+        if is_new:
+            self.devices_list.append(dev.address)
+        if is_new or renamed:
             info_str = ", ".join(
                 [
-                    "[%2d]" % i,
+                    "[%2d]" % (self.devices_list.index(dev.address),),
                     str(dev.address),
                     str(dev.name),
                     str(advertisements.service_uuids),
                 ]
             )
             logger.info("Device: %s" % info_str)
+        return is_new
+
+    async def scan(self, timeout=3.0, dev_name="walkingpad", matcher=None, address_prefix=None, early_exit=False):
+        """
+        Scans for peripherals using detection callbacks.
+        With early_exit, returns as soon as the first matching device advertises, otherwise waits the whole timeout.
+        Results are reset on each call.
+        """
+        kwargs = Scanner.get_bleak_kwargs()
+        logger.info("Scanning for peripherals...")
+        logger.debug("Scanning kwargs: %s" % (kwargs,))
+        self.reset()
+        found = asyncio.Event()
 
-            # Put devices information into list
-            self.devices_dict[dev.address] = []
-            self.devices_dict[dev.address].append(dev.name)
-            self.devices_dict[dev.address].append(advertisements.service_uuids)
-            self.devices_list.append(dev.address)
-
-            if dev_name and dev.name and dev_name in dev.name.lower():
-                self.walking_belt_candidates.append(dev)
+        def detection_callback(dev, advertisements):
+            # Every advertisement is evaluated, the name may arrive later in a scan response
+            self.on_detection(dev, advertisements)
+            self.update_known(dev, advertisements, dev_name, matcher)
+            if self.add_candidate(dev, dev_name, matcher, address_prefix):
+                found.set()
 
-            elif matcher and matcher(dev.name):
-                self.walking_belt_candidates.append(dev)
+        from bleak import BleakScanner
 
-        if not dev:
+        scanner = BleakScanner(detection_callback=detection_callback, **kwargs)
+        await scanner.start()
+        try:
+            if early_exit:
+                try:
+                    await asyncio.wait_for(found.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(timeout)
+        finally:
+            await scanner.stop()
+
+        if not self.devices_list:
             logger.warning("Scanning ended up with no results")
+        return self.walking_belt_candidates
+
+    def add_candidate(self, dev, dev_name="walkingpad", matcher=None, address_prefix=None):
+        """Adds a matching device to the candidates once, returns True if added"""
+        if not self.matches(dev, dev_name, matcher, address_prefix):
+            return False
+        if any(x.address == dev.address for x in self.walking_belt_candidates):
+            return False
+        self.walking_belt_candidates.append(dev)
+        return True
+
+    def update_known(self, dev, advertisements=None, dev_name="walkingpad", matcher=None):
+        if not self.matches(dev, dev_name, matcher):
+            return
+        self.known_pads[dev.address] = KnownPad(
+            device=dev, name=dev.name, rssi=self.get_rssi(dev, advertisements), last_seen=time.time()
+        )
+
+    def prune_known(self, now=None):
+        now = now or time.time()
+        for addr in [k for k, v in self.known_pads.items() if now - v.last_seen > self.cache_ttl]:
+            del self.known_pads[addr]
+
+    def get_known_pads(self):
+        """Known pads seen within cache_ttl, strongest signal first"""
+        self.prune_known()
+        return sorted(self.known_pads.values(), key=lambda x: -(x.rssi if x.rssi is not None else -999))
+
+    async def start_background(self, dev_name="walkingpad", matcher=None, ttl=None):
+        """Keeps scanning in the background, maintains known_pads cache with RSSI"""
+        if self.background_scanner:
+            return
+        if ttl is not None:
+            self.cache_ttl = ttl
+
+        def detection_callback(dev, advertisements):
+            self.update_known(dev, advertisements, dev_name, matcher)
+
+        from bleak import BleakScanner
+
+        kwargs = Scanner.get_bleak_kwargs()
+        self.background_scanner = BleakScanner(detection_callback=detection_callback, **kwargs)
+        await self.background_scanner.start()
+
+    async def stop_background(self):
+        if not self.background_scanner:
+            return
+        scanner, self.background_scanner = self.background_scanner, None
+        await scanner.stop()
+
+
+@dataclass
+class KnownPad:
+    device: Optional["BLEDevice"] = None
+    name: Optional[str] = None
+    rssi: Optional[int] = None
+    last_seen: float = 0.0
+
+
+CMD_162_NAMES = {0: "ask_stats", 1: "speed", 2: "mode", 3: "beep", 4: "start"}
+CMD_NAMES = {165: "profile", 166: "pref", 167: "hist"}
 
 
 class WalkingPad:
@@ -104,6 +275,8 @@ class WalkingPad:
     MODE_MANUAL = 1
     MODE_AUTOMAT = 0
 
+    MAX_SPEED = 60  # belt speed units, 6.0 km/h
+
     PREFS_MAX_SPEED = 3
     PREFS_START_SPEED = 4
     PREFS_START_INTEL = 5
@@ -150,6 +323,95 @@ class WalkingPad:
         cmd[-2] = sum(cmd[1:-2]) % 256
         return cmd
 
+    @staticmethod
+    def cmd_name(cmd):
+        """Short command type name, used for latency accounting"""
+        if len(cmd) < 3:
+            return "unknown"
+        if cmd[1] == 162:
+            return CMD_162_NAMES.get(cmd[2], "cmd_162")
+        return CMD_NAMES.get(cmd[1], "unknown")
+
+    @staticmethod
+    def confirmable(cmd):
+        """Commands with an effect visible in the status: ask_stats, speed, mode, start"""
+        return len(cmd) >= 4 and cmd[1] == 162 and cmd[2] in (0, 1, 2, 4)
+
+    @staticmethod
+    def confirms(cmd, status: "WalkingPadCurStatus", prev: Optional["WalkingPadCurStatus"] = None):
+        """
+        True if the status reflects the command, see confirmable().
+        Speed is confirmed by the target speed reported in app_speed or by the belt speed.
+        Start is confirmed by the belt state change relative to prev, the last status before the write.
+        """
+        if not WalkingPad.confirmable(cmd):
+            return False
+        if cmd[2] == 0:
+            return True  # ask_stats, any status
+        if cmd[2] == 1:
+            return status.speed == cmd[3] or (cmd[3] > 0 and status.app_speed == cmd[3] * 3)
+        if cmd[2] == 2:
+            return status.manual_mode == cmd[3]
+        return status.belt_state != 0 and (prev is None or prev.belt_state == 0)
+
+
+class CommandEncoder:
+    """
+    Command frames: 247, command type, payload, CRC (sum of type and payload mod 256), 253.
+    Frames of the common commands (speeds, modes, stats request) are built once and cached as immutable bytes,
+    other frames are built on demand. All frames are checked by validate_frame.
+    """
+
+    HEAD = 247
+    TAIL = 253
+    FRAME_LENGTHS = {162: 6, 165: 10, 166: 9, 167: 6}  # by command type
+    MAX_SPEED = WalkingPad.MAX_SPEED
+
+    def __init__(self):
+        self.speeds = [self.build(162, 1, x) for x in range(self.MAX_SPEED + 1)]
+        self.modes = {
+            x: self.build(162, 2, x) for x in (WalkingPad.MODE_AUTOMAT, WalkingPad.MODE_MANUAL, WalkingPad.MODE_STANDBY)
+        }
+        self.stats = self.build(162, 0, 0)
+        self.start = self.build(162, 4, 1)
+        self.beep = self.build(162, 3, 7)
+        self.hist = {0: self.build(167, 170, 255), 1: self.build(167, 170, 0)}
+        self.profiles = [self.validate_frame(bytes(x)) for x in WalkingPad.PAYLOADS_255]
+
+    @staticmethod
+    def build(*body):
+        return CommandEncoder.validate_frame(bytes((CommandEncoder.HEAD, *body, sum(body) & 0xFF, CommandEncoder.TAIL)))
+
+    @staticmethod
+    def validate_frame(frame):
+        """Returns the frame if its layout and CRC match the protocol, raises ValueError otherwise"""
+        if len(frame) < 4 or frame[0] != CommandEncoder.HEAD or frame[-1] != CommandEncoder.TAIL:
+            raise ValueError("Invalid frame delimiters: %s" % (bytes(frame).hex(),))
+        length = CommandEncoder.FRAME_LENGTHS.get(frame[1])
+        if length is None or len(frame) != length:
+            raise ValueError("Invalid frame length or command type: %s" % (bytes(frame).hex(),))
+        if sum(frame[1:-2]) & 0xFF != frame[-2]:
+            raise ValueError("Invalid frame CRC: %s" % (bytes(frame).hex(),))
+        return frame
+
+    def speed(self, speed: int):
+        return self.speeds[speed] if 0 <= speed <= self.MAX_SPEED else self.build(162, 1, speed)
+
+    def mode(self, mode: int):
+        return self.modes.get(mode) or self.build(162, 2, mode)
+
+    def history(self, mode=0):
+        return self.hist[0 if mode == 0 else 1]
+
+    def profile(self, profile_idx=0):
+        return self.profiles[profile_idx]
+
+    def pref(self, key: int, arr):
+        return self.build(166, key, *arr)
+
+
+ENCODER = CommandEncoder()
+
 
 @dataclass
 class WalkingPadCurStatus:
@@ -164,7 +426,7 @@ class WalkingPadCurStatus:
     manual_mode: int = 0
     rtime: float = 0.0
 
-    def load_from(self, cmd):
+    def load_from(self, cmd, rtime=None):
         self.raw = bytearray(cmd)
         self.belt_state = cmd[2]
         self.speed = cmd[3]
@@ -174,18 +436,18 @@ class WalkingPadCurStatus:
         self.steps = WalkingPad.byte2int(cmd[11:])
         self.app_speed = cmd[14]  # / 30
         self.controller_button = cmd[16]
-        self.rtime = time.time()
+        self.rtime = rtime or time.time()
 
     @staticmethod
     def check_type(cmd):
         return bytes(cmd[0:2]) == bytes([248, 162])
 
     @staticmethod
-    def from_data(cmd):
+    def from_data(cmd, rtime=None):
         if not WalkingPadCurStatus.check_type(cmd):
             raise ValueError("Incorrect message type, could not parse")
         m = WalkingPadCurStatus()
-        m.load_from(cmd)
+        m.load_from(cmd, rtime)
         return m
 
     def __str__(self):
@@ -214,23 +476,23 @@ class WalkingPadLastStatus:
     steps: int = 0
     rtime: float = 0.0
 
-    def load_from(self, cmd):
+    def load_from(self, cmd, rtime=None):
         self.raw = bytearray(cmd)
         self.time = WalkingPad.byte2int(cmd[8:])
         self.dist = WalkingPad.byte2int(cmd[11:])
         self.steps = WalkingPad.byte2int(cmd[14:])
-        self.rtime = time.time()
+        self.rtime = rtime or time.time()
 
     @staticmethod
     def check_type(cmd):
         return bytes(cmd[0:2]) == bytes([248, 167])
 
     @staticmethod
-    def from_data(cmd):
+    def from_data(cmd, rtime=None):
         if not WalkingPadLastStatus.check_type(cmd):
             raise ValueError("Incorrect message type, could not parse")
         m = WalkingPadLastStatus()
-        m.load_from(cmd)
+        m.load_from(cmd, rtime)
         return m
 
     def __str__(self):
@@ -243,9 +505,13 @@ class WalkingPadLastStatus:
 
 
 class Controller:
-    def __init__(self, address=None, do_read_chars=True):
+    UUID_FE01 = "0000fe01-0000-1000-8000-00805f9b34fb"
+    UUID_FE02 = "0000fe02-0000-1000-8000-00805f9b34fb"
+
+    def __init__(self, address=None, do_read_chars=True, fast_connect=False):
         self.address = address
         self.do_read_chars = do_read_chars
+        self.fast_connect = fast_connect
         self.log_messages_info = True
         self.ignore_bad_packets = False
 
@@ -253,14 +519,46 @@ class Controller:
         self.char_fe02 = None
         self.client = None
         self.last_raw_cmd = None
+        self.encoder = ENCODER
         self.last_cmd_time = None
         self.last_status = None
         self.last_record = None
-        self.minimal_cmd_space = 0.69
+        self.spacing = CommandSpacing(default=0.69)  # learned per command type, see minimal_cmd_space
+        self.last_cmd_name = None
+        self.metrics: Optional[Metrics] = None
+
+        # Command confirmations, (cmd, write time, future) resolved by the next status reflecting the command
+        self.status_waiters: list[list] = []
+        self.cmd_stats: dict[str, CommandStats] = {}
+        self.confirm_timeout = 5.0
+        self.confirm_poll = 1.0  # asks for status if none arrived while waiting
+        self.record_collectors: list[list] = []  # lists receiving history records (WalkingPadLastStatus)
+        self.prefs: dict[int, int] = {}  # preferences set on the pad, key -> value
+
+        # Connection supervision
+        self.auto_reconnect = False
+        self.reconnect_backoff = 1.0
+        self.reconnect_backoff_max = 60.0
+        self.reconnect_wait = 30.0  # max time a command waits for the connection to come back
+        self.gatt_handles = {}  # cached characteristic handles, {"fe01": int, "fe02": int}
+        self.closing = False
+        self.reconnecting = False
+        self.reconnect_task = None
+
+        # Connection timing, connect start -> connected -> first status received
+        self.connect_started = None
+        self.connect_latency = None
+        self.first_status_latency = None
 
         self.handler_cur_status = None
         self.handler_last_status = None
         self.handler_message = None
+        self.handler_event = None  # handler_event(kind, **data), commands sent and connection changes
+
+        # Frame dispatching off the BLE callback
+        self.frame_queue: Optional[asyncio.Queue] = None
+        self.dispatch_loop = None
+        self.dispatch_task = None
 
     async def __aenter__(self):
         await self.run()
@@ -270,6 +568,56 @@ class Controller:
         await self.disconnect()
 
     def notif_handler(self, sender, data):
+        """BLE notification callback. With a running dispatcher, only enqueues the raw frame with a timestamp."""
+        rtime = time.time()
+        if self.metrics:
+            self.metrics.inc("packets_received_total", helps="Notification packets received")
+
+        if self.frame_queue is None:
+            return self.process_frame(sender, data, rtime)
+
+        item = (sender, rtime, bytes(data))
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self.dispatch_loop:
+            self.frame_queue.put_nowait(item)
+        else:
+            self.dispatch_loop.call_soon_threadsafe(self.frame_queue.put_nowait, item)
+
+    def start_dispatcher(self):
+        """Decodes and dispatches frames in a separate task on the current loop, off the BLE callback"""
+        if self.dispatch_task is not None:
+            return
+        self.dispatch_loop = asyncio.get_running_loop()
+        self.frame_queue = asyncio.Queue()
+        self.dispatch_task = asyncio.ensure_future(self.dispatch_frames())
+
+    async def stop_dispatcher(self):
+        task, self.dispatch_task = self.dispatch_task, None
+        queue, self.frame_queue = self.frame_queue, None
+        if task is None:
+            return
+
+        # Process frames enqueued so far
+        while queue is not None and not queue.empty():
+            sender, rtime, data = queue.get_nowait()
+            self.process_frame(sender, data, rtime)
+
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def dispatch_frames(self):
+        while True:
+            sender, rtime, data = await self.frame_queue.get()
+            self.process_frame(sender, data, rtime)
+
+    def process_frame(self, sender, data, rtime=None):
         logger_fnc = logger.info if self.log_messages_info else logger.debug
         msg_hex = ", ".join("{:02x}".format(x) for x in data)
         logger_fnc("Msg: %s" % msg_hex)
@@ -277,8 +625,12 @@ class Controller:
 
         try:
             if WalkingPadCurStatus.check_type(data):
-                m = WalkingPadCurStatus.from_data(data)
+                m = WalkingPadCurStatus.from_data(data, rtime)
                 self.last_status = m
+                if self.first_status_latency is None and self.connect_started is not None:
+                    self.on_first_status(m)
+                if self.status_waiters:
+                    self.resolve_waiters(m)
                 already_notified = True
                 self.on_cur_status_received(sender, m)
                 if self.handler_cur_status:
@@ -286,8 +638,10 @@ class Controller:
                 logger_fnc("Status: %s" % (m,))
 
             elif WalkingPadLastStatus.check_type(data):
-                m = WalkingPadLastStatus.from_data(data)
-                self.last_record = None
+                m = WalkingPadLastStatus.from_data(data, rtime)
+                self.last_record = m
+                for collector in self.record_collectors:
+                    collector.append(m)
                 already_notified = True
                 self.on_last_status_received(sender, m)
                 if self.handler_last_status:
@@ -299,9 +653,22 @@ class Controller:
                 self.handler_message(sender, data, already_notified)
 
         except Exception as e:
+            if self.metrics:
+                self.metrics.inc("bad_packets_total", helps="Notification packets failed to process")
             log_fnc = logger.debug if self.ignore_bad_packets else logger.error
             log_fnc("Exception in processing msg [%s]: %s" % (msg_hex, e), exc_info=e)
 
+    def on_first_status(self, status: WalkingPadCurStatus):
+        self.first_status_latency = status.rtime - self.connect_started
+        logger.info(
+            "Connect latency: %.3f s, connect to first status: %.3f s"
+            % (self.connect_latency or 0, self.first_status_latency)
+        )
+        if self.metrics:
+            self.metrics.set_gauge(
+                "connect_first_status_seconds", self.first_status_latency, helps="Connect to first status latency"
+            )
+
     def on_message_received(self, sender, data, already_notified=False):
         """Override to use as message callback"""
 
@@ -311,14 +678,35 @@ class Controller:
     def on_last_status_received(self, sender, status: WalkingPadLastStatus):
         """Override to receive last status"""
 
+    def emit_event(self, kind, **data):
+        if not self.handler_event:
+            return
+        try:
+            self.handler_event(kind, **data)
+        except Exception as e:
+            logger.warning("Event handler failed: %s" % (e,), exc_info=e)
+
     def fix_crc(self, cmd):
         return WalkingPad.fix_crc(cmd)
 
+    def is_connected(self):
+        return self.client is not None and self.client.is_connected
+
+    def device_address(self):
+        """Address string, self.address is a BLEDevice on the scan path"""
+        return getattr(self.address, "address", self.address)
+
     async def disconnect(self):
+        await self.stop_dispatcher()
+        self.closing = True
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
         if not self.client:
             return
         logger.info("Disconnecting")
         await self.client.disconnect()
+        self.emit_event("conn", state="closed", address=self.device_address())
 
     async def connect(self, address=None):
         address = address or self.address
@@ -326,62 +714,255 @@ class Controller:
             raise ValueError("No address given to connect to")
 
         logger.info("Connecting to %s" % (address,))
+        if self.client and self.metrics:
+            self.metrics.inc("reconnects_total", helps="Connection attempts after the first one")
+
+        self.address = address
+        self.closing = False
+        from bleak import BleakClient
+
         kwargs = Scanner.get_bleak_kwargs()
-        self.client = BleakClient(address, **kwargs)
-        return await self.client.connect(timeout=10.0, **kwargs)
+        started = time.time()
+        self.client = BleakClient(address, disconnected_callback=self.on_disconnected, **kwargs)
+        res = await self.client.connect(timeout=10.0, **kwargs)
 
-    async def send_cmd(self, cmd):
-        self.fix_crc(cmd)
-        if self.last_cmd_time and time.time() - self.last_cmd_time < self.minimal_cmd_space:
-            to_sleep = max(0, min(time.time() - self.last_cmd_time, self.minimal_cmd_space))
-            await asyncio.sleep(to_sleep)
+        # Shared by the first connection and reconnects
+        self.connect_latency = time.time() - started
+        self.emit_event("conn", state="connected", address=self.device_address(), latency=self.connect_latency)
+        return res
 
-        return await self.send_cmd_raw(cmd)
+    def on_disconnected(self, client):
+        if client is not self.client or self.closing:
+            return
+
+        logger.warning("Disconnected from %s" % (self.address,))
+        self.emit_event("conn", state="disconnected", address=self.device_address())
+        if self.metrics:
+            self.metrics.inc("disconnects_total", helps="Unexpected disconnects")
+        if self.auto_reconnect and not self.reconnecting:
+            self.reconnect_task = asyncio.ensure_future(self.reconnect())
+
+    async def reconnect(self):
+        """Reconnects with exponential backoff, reusing cached characteristic handles"""
+        self.reconnecting = True
+        backoff = self.reconnect_backoff
+        try:
+            while not self.closing:
+                try:
+                    await self.run()
+                    logger.info("Reconnected to %s" % (self.address,))
+                    return True
+
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Reconnect failed: %s, next attempt in %.1f s" % (e, backoff))
+
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.reconnect_backoff_max)
+        finally:
+            self.reconnecting = False
+            self.reconnect_task = None
+        return False
+
+    async def wait_connected(self, timeout=None):
+        """Waits for the connection to come back, if reconnect is in progress. Loop agnostic, polls the state."""
+        if self.is_connected() and self.char_fe02 is not None:
+            return True
+
+        deadline = time.time() + (timeout if timeout is not None else self.reconnect_wait)
+        while (self.reconnecting or self.auto_reconnect) and not self.closing and time.time() < deadline:
+            await asyncio.sleep(0.1)
+            if self.is_connected() and self.char_fe02 is not None and not self.reconnecting:
+                return True
+        return self.is_connected()
+
+    def resolve_waiters(self, status: WalkingPadCurStatus):
+        waiters = []
+        for waiter in self.status_waiters:
+            cmd, sent, fut, prev = waiter
+            if fut.done():
+                continue
+            if status.rtime < sent or not WalkingPad.confirms(cmd, status, prev):
+                waiters.append(waiter)
+                continue
+
+            latency = status.rtime - sent
+            name = WalkingPad.cmd_name(cmd)
+            self.command_stats(name).add(latency)
+            self.spacing.confirmed(name, latency)
+            if self.metrics:
+                self.metrics.observe(
+                    "cmd_confirm_seconds", latency, labels=(("cmd", name),), helps="Command write to confirming status"
+                )
+            fut.set_result(status)
+        self.status_waiters = waiters
+
+    def command_stats(self, name) -> CommandStats:
+        stats = self.cmd_stats.get(name)
+        if stats is None:
+            stats = self.cmd_stats[name] = CommandStats()
+        return stats
+
+    async def wait_confirmation(self, waiter, timeout=None):
+        """Waits for the status confirming the command, asks for status periodically. None on timeout."""
+        cmd, _, fut, _ = waiter
+        timeout = self.confirm_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        try:
+            while not fut.done():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                last_rtime = self.last_status.rtime if self.last_status else None
+                await asyncio.wait([fut], timeout=min(self.confirm_poll, remaining))
+                cur_rtime = self.last_status.rtime if self.last_status else None
+                if not fut.done() and cur_rtime == last_rtime and time.time() < deadline:
+                    await self.ask_stats()
+        finally:
+            if waiter in self.status_waiters:
+                self.status_waiters.remove(waiter)
+
+        if fut.done():
+            return fut.result()
+
+        name = WalkingPad.cmd_name(cmd)
+        self.command_stats(name).timeouts += 1
+        self.spacing.failed(name)
+        if self.metrics:
+            self.metrics.inc("cmd_confirm_timeouts_total", labels=(("cmd", name),), helps="Unconfirmed commands")
+        logger.debug("Command %s not confirmed in %.1f s" % (name, timeout))
+        return None
+
+    async def send_cmd(self, cmd, confirm=False, timeout=None):
+        """
+        Sends the command. With confirm, waits for the status reflecting the command (see WalkingPad.confirms)
+        and returns it, None on timeout. Round-trip latencies are kept per command type in cmd_stats.
+        """
+        if not isinstance(cmd, bytes):
+            self.fix_crc(cmd)  # frames of the encoder are final
+        if not self.is_connected() or self.reconnecting:
+            if not await self.wait_connected():
+                raise ConnectionError("Not connected to the pad")
+
+        # Spacing learned for the previous command type, the pad drops commands sent too early
+        if self.last_cmd_time:
+            to_sleep = self.cmd_space() - (time.time() - self.last_cmd_time)
+            if to_sleep > 0:
+                await asyncio.sleep(to_sleep)
+
+        if not confirm or not WalkingPad.confirmable(cmd):
+            return await self.send_cmd_raw(cmd)
+
+        # Already in effect (e.g., start of a running belt), nothing to confirm and no latency to measure
+        prev = self.last_status
+        if prev is not None and cmd[2] != 0 and WalkingPad.confirms(cmd, prev):
+            await self.send_cmd_raw(cmd)
+            return prev
+
+        # Registered before the write, the confirming status may arrive before the write call returns
+        waiter = [cmd, time.time(), asyncio.get_running_loop().create_future(), prev]
+        self.status_waiters.append(waiter)
+        try:
+            await self.send_cmd_raw(cmd)
+        except Exception:
+            self.status_waiters.remove(waiter)
+            raise
+        return await self.wait_confirmation(waiter, timeout)
+
+    @property
+    def minimal_cmd_space(self):
+        """Spacing after commands not learned yet"""
+        return self.spacing.default
+
+    @minimal_cmd_space.setter
+    def minimal_cmd_space(self, value):
+        self.spacing.default = value
+
+    def cmd_space(self):
+        return self.spacing.get(self.last_cmd_name) if self.last_cmd_name else self.minimal_cmd_space
 
     async def send_cmd_raw(self, cmd):
         self.last_raw_cmd = cmd
         self.last_cmd_time = time.time()
-        r = await self.client.write_gatt_char(self.char_fe02, cmd)
+        self.last_cmd_name = WalkingPad.cmd_name(cmd)
+        try:
+            r = await self.client.write_gatt_char(self.char_fe02, cmd)
+        except Exception:
+            self.spacing.failed(self.last_cmd_name)
+            raise
+        if self.handler_event:
+            self.emit_event("cmd", cmd=self.last_cmd_name, raw=binascii.hexlify(bytes(cmd)).decode("utf8"))
+        if self.metrics:
+            self.metrics.observe(
+                "cmd_latency_seconds",
+                time.time() - self.last_cmd_time,
+                labels=(("cmd", self.last_cmd_name),),
+                helps="Command write latency",
+            )
         return r
 
-    async def switch_mode(self, mode: int):
-        cmd = bytearray([247, 162, 2, mode, 0xFF, 253])
-        return await self.send_cmd(cmd)
+    async def switch_mode(self, mode: int, confirm=False, timeout=None):
+        return await self.send_cmd(self.encoder.mode(mode), confirm, timeout)
 
-    async def change_speed(self, speed: int):
-        cmd = bytearray([247, 162, 1, speed, 0xFF, 253])
-        return await self.send_cmd(cmd)
+    async def change_speed(self, speed: int, confirm=False, timeout=None):
+        return await self.send_cmd(self.encoder.speed(speed), confirm, timeout)
 
-    async def stop_belt(self):
-        return await self.change_speed(0)
+    async def stop_belt(self, confirm=False, timeout=None):
+        return await self.change_speed(0, confirm, timeout)
 
-    async def start_belt(self):
-        cmd = bytearray([247, 162, 4, 1, 0xFF, 253])
-        return await self.send_cmd(cmd)
+    async def start_belt(self, confirm=False, timeout=None):
+        return await self.send_cmd(self.encoder.start, confirm, timeout)
 
     async def ask_profile(self, profile_idx=0):
-        cmd = bytearray(WalkingPad.PAYLOADS_255[profile_idx])
-        return await self.send_cmd(cmd)
+        return await self.send_cmd(self.encoder.profile(profile_idx))
 
-    async def ask_stats(self):
-        cmd = bytearray([247, 162, 0, 0, 162, 253])
-        return await self.send_cmd(cmd)
+    async def ask_stats(self, confirm=False, timeout=None):
+        return await self.send_cmd(self.encoder.stats, confirm, timeout)
 
     async def ask_hist(self, mode=0):
-        cmd = bytearray([247, 167, 170, 255, 80, 253] if mode == 0 else [247, 167, 170, 0, 81, 253])
-        return await self.send_cmd(cmd)
+        return await self.send_cmd(self.encoder.history(mode))
+
+    async def collect_history(self, modes=(0, 1), idle=1.0, timeout=10.0):
+        """
+        Asks the pad for its stored walk records, returns received WalkingPadLastStatus records without duplicates.
+        Collection of each request ends when no record arrives for `idle` seconds.
+        """
+        records: list[WalkingPadLastStatus] = []
+        self.record_collectors.append(records)
+        deadline = time.time() + timeout
+        try:
+            for mode in modes:
+                num = len(records)
+                await self.ask_hist(mode)
+                last_change = time.time()
+                while time.time() < min(deadline, last_change + idle):
+                    await asyncio.sleep(0.05)
+                    if len(records) != num:
+                        num, last_change = len(records), time.time()
+        finally:
+            self.record_collectors.remove(records)
+
+        uniq = {}
+        for rec in records:
+            uniq.setdefault((rec.time, rec.dist, rec.steps), rec)
+        return list(uniq.values())
 
     async def cmd_162_3_7(self, mode=0):
-        cmd = bytearray([247, 162, 3, 7, 172, 253])
-        return await self.send_cmd(cmd)
+        return await self.send_cmd(self.encoder.beep)
 
     async def set_pref_arr(self, key: int, arr):
-        cmd = bytearray([247, 166, key, *arr, 172, 253])
-        return await self.send_cmd(cmd)
+        return await self.send_cmd(self.encoder.pref(key, arr))
 
     async def set_pref_int(self, key: int, val: int, stype: int = 0):
         arr = [stype, *WalkingPad.int2byte(val)]
-        return await self.set_pref_arr(key, arr)
+        res = await self.set_pref_arr(key, arr)
+        self.prefs[key] = val
+        return res
+
+    def speed_limit(self):
+        """Max speed preference of the pad if set, hardware max otherwise"""
+        return self.prefs.get(WalkingPad.PREFS_MAX_SPEED, WalkingPad.MAX_SPEED)
 
     async def set_pref_max_speed(self, speed):
         return await self.set_pref_int(WalkingPad.PREFS_MAX_SPEED, speed)
@@ -407,37 +988,65 @@ class Controller:
     async def set_pref_target(self, target_type: int = 0, value: int = 0):
         return await self.set_pref_int(WalkingPad.PREFS_TARGET, value, target_type)
 
-    async def run(self, address=None):
-        await self.connect(address)
-        client = self.client
+    def resolve_cached_chars(self):
+        """Resolves FE01/FE02 characteristics from cached handles, skips service enumeration"""
+        if not self.gatt_handles or not self.client:
+            return False
 
-        x = client.is_connected
-        logger.info("Connected: {0}".format(x))
+        services = self.client.services
+        fe01 = services.get_characteristic(self.gatt_handles.get("fe01"))
+        fe02 = services.get_characteristic(self.gatt_handles.get("fe02"))
+        if not fe01 or not fe02 or not fe01.uuid.startswith("0000fe01") or not fe02.uuid.startswith("0000fe02"):
+            logger.info("Cached characteristic handles are stale, enumerating services")
+            return False
 
-        self.char_fe01 = None
-        self.char_fe02 = None
+        self.char_fe01 = fe01
+        self.char_fe02 = fe02
+        logger.info("Using cached characteristic handles: %s" % (self.gatt_handles,))
+        return True
+
+    def resolve_chars_fast(self):
+        """Resolves FE01/FE02 characteristics by UUID, without reading any characteristic or descriptor"""
+        services = self.client.services
+        try:
+            self.char_fe01 = services.get_characteristic(self.UUID_FE01)
+            self.char_fe02 = services.get_characteristic(self.UUID_FE02)
+        except Exception as e:
+            logger.info("Fast characteristic resolution failed: %s" % (e,))
+            self.char_fe01, self.char_fe02 = None, None
+        return self.char_fe01 is not None and self.char_fe02 is not None
+
+    async def enumerate_services(self, read_chars=None, read_descriptors=None, log_fnc=None):
+        """Full GATT enumeration. Diagnostic, reads characteristics and descriptors one by one."""
+        client = self.client
+        read_chars = self.do_read_chars if read_chars is None else read_chars
+        read_descriptors = read_chars if read_descriptors is None else read_descriptors
+        do_log = log_fnc is not None or logger.isEnabledFor(logging.INFO)
+        log_fnc = log_fnc or logger.info
 
         for service in client.services:
-            logger.info("[Service] {0}: {1}".format(service.uuid, service.description))
+            if do_log:
+                log_fnc("[Service] {0}: {1}".format(service.uuid, service.description))
             for char in service.characteristics:
                 value = None
                 if "read" in char.properties:
                     try:
-                        if self.do_read_chars and char.uuid != "0000fe01-0000-1000-8000-00805f9b34fb":
+                        if read_chars and char.uuid != self.UUID_FE01:
                             value = bytes(await client.read_gatt_char(char.uuid))
                     except Exception as e:
                         logger.info("read failed for %s" % (char.uuid,))
                         value = str(e).encode()
 
-                logger.info(
-                    "\t[Characteristic] {0}: (Handle: {1}) ({2}) | Name: {3}, Value: {4} ".format(
-                        char.uuid,
-                        char.handle,
-                        ",".join(char.properties),
-                        char.description,
-                        value,
+                if do_log:
+                    log_fnc(
+                        "\t[Characteristic] {0}: (Handle: {1}) ({2}) | Name: {3}, Value: {4} ".format(
+                            char.uuid,
+                            char.handle,
+                            ",".join(char.properties),
+                            char.description,
+                            value,
+                        )
                     )
-                )
 
                 if char.uuid.startswith("0000fe01"):
                     self.char_fe01 = char
@@ -445,17 +1054,42 @@ class Controller:
                 if char.uuid.startswith("0000fe02"):
                     self.char_fe02 = char
 
+                if not read_descriptors:
+                    continue
+
                 for descriptor in char.descriptors:
                     value = await client.read_gatt_descriptor(descriptor.handle)
-                    logger.info(
-                        "\t\t[Descriptor] {0}: (Handle: {1}) | Value: {2} ".format(
-                            descriptor.uuid, descriptor.handle, bytes(value)
+                    if do_log:
+                        log_fnc(
+                            "\t\t[Descriptor] {0}: (Handle: {1}) | Value: {2} ".format(
+                                descriptor.uuid, descriptor.handle, bytes(value)
+                            )
                         )
-                    )
+
+    async def run(self, address=None):
+        self.connect_started = time.time()
+        self.first_status_latency = None
+        await self.connect(address)
+        client = self.client
+
+        x = client.is_connected
+        logger.info("Connected: {0}".format(x))
+
+        self.char_fe01 = None
+        self.char_fe02 = None
+
+        if not self.resolve_cached_chars():
+            if self.fast_connect and self.resolve_chars_fast():
+                logger.info("Characteristics resolved by UUID, service enumeration skipped")
+            else:
+                await self.enumerate_services()
+
+        if self.char_fe01 is not None and self.char_fe02 is not None:
+            self.gatt_handles = {"fe01": self.char_fe01.handle, "fe02": self.char_fe02.handle}
 
         try:
             logger.info("Enabling notification for %s" % (self.char_fe01.uuid,))
-            await client.start_notify(self.char_fe01.uuid, self.notif_handler)
+            await client.start_notify(self.char_fe01, self.notif_handler)
 
         except Exception as e:
             logger.warning("Notify failed: %s" % (e,))
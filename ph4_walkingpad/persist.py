@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(fname, data, backup=False):
+    """Writes data via a temporary file and rename, keeps the first version as fname.backup if backup is set"""
+    dname = os.path.dirname(fname)
+    if dname:
+        os.makedirs(dname, exist_ok=True)
+    tmp_fname = fname + ".tmp"
+    bak_fname = fname + ".backup"
+    with open(tmp_fname, "w+") as fh:
+        fh.write(data)
+
+    if backup and os.path.exists(fname) and not os.path.exists(bak_fname):
+        shutil.copy(fname, bak_fname)
+    os.replace(tmp_fname, fname)
+
+
+def append_text(fname, data):
+    with open(fname, "a+") as fh:
+        fh.write(data)
+
+
+class IOExecutor:
+    """
+    Dedicated file I/O thread, event loops never block on disk.
+    Jobs run in the submission order. Appends are buffered per file and written in batches,
+    at most one batch per file is queued, so a slow disk does not pile up jobs.
+    Thread-safe, usable from any thread and event loop.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+        self.lock = threading.Lock()
+        self.buffers: dict[str, list[str]] = {}
+        self.pending: dict[str, Future] = {}
+        self.last_future: Future = Future()
+        self.last_future.set_result(None)
+        self.num_writes = 0
+
+    def submit(self, fn, *args) -> Future:
+        with self.lock:
+            self.last_future = fut = self.executor.submit(fn, *args)
+        return fut
+
+    async def run(self, fn, *args):
+        """Runs fn(*args) on the I/O thread and returns its result"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def append(self, fname, data):
+        """Appends data to the file, returns immediately"""
+        with self.lock:
+            self.buffers.setdefault(fname, []).append(data)
+            if fname in self.pending:
+                return
+            self.last_future = self.pending[fname] = self.executor.submit(self._write_batch, fname)
+
+    def _write_batch(self, fname):
+        with self.lock:
+            batch = "".join(self.buffers.pop(fname, []))
+            self.pending.pop(fname, None)
+        if not batch:
+            return
+        try:
+            append_text(fname, batch)
+            self.num_writes += 1
+        except Exception as e:
+            logger.error("Could not write to %s: %s" % (fname, e))
+
+    def save_json(self, fname, obj, backup=False) -> Future:
+        """Atomic JSON file write, the object is serialized on the calling thread"""
+        return self.submit(write_atomic, fname, json.dumps(obj, indent=2), backup)
+
+    async def drain(self):
+        """Waits for all jobs submitted so far"""
+        while True:
+            with self.lock:
+                fut = self.last_future
+            try:
+                await asyncio.wrap_future(fut)
+            except Exception as e:
+                logger.debug("I/O job failed: %s" % (e,))
+            with self.lock:
+                if fut is self.last_future and not self.buffers:
+                    return
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -49,6 +49,40 @@ def calories_walk2_minute(speed: float, weight: float, deg: float):
     return 1 / 60.0 * ((0.1 * mpm + 1.8 * mpm * deg + 3.5) * weight * 60 * 5 / 1000)
 
 
+def model_walk2(speed: float, profile) -> float:
+    """Gross kcal per minute, shapesense walking model, flat belt"""
+    return calories_walk2_minute(speed, profile.weight, 0.00)
+
+
+def model_walk(speed: float, profile) -> float:
+    """Gross kcal per minute, velocity / height based model"""
+    return calories_walk_minute(speed, profile.weight, profile.height)
+
+
+def model_acsm(speed: float, profile) -> float:
+    """Gross kcal per minute, ACSM walking equation (the walk2 formula used for inclines), flat belt"""
+    mpm = speed * 1000 / 60
+    return (0.1 * mpm + 3.5) * profile.weight * 5 / 1000
+
+
+# Calorie models: fnc(speed_kmh, profile) -> gross kcal per minute
+CALORIE_MODELS = {
+    "walk2": model_walk2,
+    "walk": model_walk,
+    "acsm": model_acsm,
+}
+
+
+def get_calorie_model(name):
+    if name not in CALORIE_MODELS:
+        raise ValueError("Unknown calorie model %s, known: %s" % (name, ", ".join(CALORIE_MODELS)))
+    return CALORIE_MODELS[name]
+
+
+def calories_net_minute(speed: float, profile, model=model_walk2) -> float:
+    return model(speed, profile) - calories_rmrcb_minute(profile.weight, profile.height, profile.age, profile.male)
+
+
 class Profile:
     def __init__(
         self,
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ph4_walkingpad.pad import WalkingPadCurStatus
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProgramStep:
+    start: float = 0.0  # belt time offset from the program start, seconds
+    duration: float = 0.0
+    speed: int = 0  # km/h * 10, as used by Controller.change_speed
+
+
+@dataclass
+class StepResult:
+    planned: float = 0.0  # planned belt time of the speed change
+    achieved: Optional[float] = None  # belt time the new speed was reported at
+    speed: int = 0
+
+    @property
+    def error(self):
+        return None if self.achieved is None else self.achieved - self.planned
+
+
+def to_speed(val):
+    """km/h to belt speed units"""
+    return int(round(float(val) * 10))
+
+
+def expand_steps(steps, max_speed=60):
+    """
+    Expands workout definition steps to a flat list of (duration, speed) tuples.
+    Step forms:
+      {"speed": 3.5, "duration": 60}
+      {"ramp": [3.0, 5.0], "duration": 120, "step": 0.5}
+      {"repeat": 3, "steps": [...]}
+    Speeds are in km/h, durations in seconds.
+    """
+    ret = []
+    for st in steps:
+        if "repeat" in st:
+            sub = expand_steps(st["steps"], max_speed)
+            ret += sub * int(st["repeat"])
+
+        elif "ramp" in st:
+            v0, v1 = to_speed(st["ramp"][0]), to_speed(st["ramp"][1])
+            incr = max(1, to_speed(st.get("step", 0.1)))
+            sign = 1 if v1 >= v0 else -1
+            speeds = [v0 + sign * i * incr for i in range(abs(v1 - v0) // incr + 1)]
+            if speeds[-1] != v1:
+                speeds.append(v1)  # range not a multiple of the step, the ramp ends at the target
+            dur = float(st["duration"]) / len(speeds)
+            for speed in speeds:
+                ret.append((dur, min(max_speed, speed)))
+
+        else:
+            ret.append((float(st["duration"]), min(max_speed, to_speed(st["speed"]))))
+    return ret
+
+
+def build_program(js, max_speed=60):
+    """Program steps with belt time offsets. Consecutive steps of the same speed are merged."""
+    res = []
+    offset = 0.0
+    for dur, speed in expand_steps(js["steps"] if isinstance(js, dict) else js, max_speed):
+        if res and res[-1].speed == speed:
+            res[-1].duration += dur
+        else:
+            res.append(ProgramStep(start=offset, duration=dur, speed=speed))
+        offset += dur
+    return res
+
+
+def load_program(fname, max_speed=60):
+    with open(fname, "r") as fh:
+        return build_program(json.load(fh), max_speed)
+
+
+class ProgramRunner:
+    """
+    Executes program steps against Controller.change_speed.
+    Step transitions are timed off the belt time from status frames, extrapolated between frames.
+    Commands are issued ahead by the expected pacing delay and command latency.
+    """
+
+    def __init__(self, ctler, steps, tolerance=2.0, clock=time.time, poll=0.05):
+        self.ctler = ctler
+        self.steps = steps
+        self.tolerance = tolerance
+        self.clock = clock
+        self.poll = poll
+
+        self.last_status: Optional[WalkingPadCurStatus] = None
+        self.begin: Optional[float] = None  # belt time at the program start
+        self.idx = 0
+        self.latency = 0.3  # EWMA of command -> reported speed, seconds
+        self.results: list[StepResult] = []
+        self.pending: Optional[StepResult] = None
+        self.pending_sent = None
+        self.running = False
+
+    @property
+    def total_duration(self):
+        return self.steps[-1].start + self.steps[-1].duration if self.steps else 0
+
+    def on_status(self, status: WalkingPadCurStatus):
+        self.last_status = status
+        if self.begin is None:
+            self.begin = status.time
+
+        pend = self.pending
+        if pend is not None and status.speed == pend.speed:
+            pend.achieved = status.time - self.begin
+            if self.pending_sent is not None:
+                self.latency = 0.7 * self.latency + 0.3 * max(0.0, status.rtime - self.pending_sent)
+            self.pending = None
+
+    def belt_time(self, now=None):
+        """Program belt time, extrapolated from the last status"""
+        st = self.last_status
+        if st is None or self.begin is None:
+            return None
+        now = self.clock() if now is None else now
+        running = st.speed > 0
+        return st.time - self.begin + (max(0.0, now - st.rtime) if running else 0.0)
+
+    def lead_time(self, now=None):
+        """How much ahead the command has to be issued: pacing wait of the controller + latency estimate"""
+        now = self.clock() if now is None else now
+        pacing = 0.0
+        last_cmd = getattr(self.ctler, "last_cmd_time", None)
+        if last_cmd:
+            space = self.ctler.cmd_space()
+            pacing = max(0.0, space - (now - last_cmd))
+        return pacing + self.latency
+
+    def is_due(self, now=None):
+        if self.idx >= len(self.steps):
+            return False
+        btime = self.belt_time(now)
+        if btime is None:
+            return self.idx == 0
+        return btime + self.lead_time(now) >= self.steps[self.idx].start
+
+    async def send_step(self):
+        step = self.steps[self.idx]
+        self.idx += 1
+        self.pending = StepResult(planned=step.start, speed=step.speed)
+        self.results.append(self.pending)
+        self.pending_sent = self.clock()
+        logger.info("Program step %d/%d: speed %.1f km/h" % (self.idx, len(self.steps), step.speed / 10))
+        await self.ctler.change_speed(step.speed)
+
+    async def run(self):
+        self.running = True
+        try:
+            while self.running and self.idx < len(self.steps):
+                if self.is_due():
+                    await self.send_step()
+                else:
+                    await asyncio.sleep(self.poll)
+
+            # Wait for the program end
+            while self.running:
+                btime = self.belt_time()
+                if btime is not None and btime >= self.total_duration:
+                    break
+                await asyncio.sleep(self.poll)
+        finally:
+            self.running = False
+        return self.report()
+
+    def stop(self):
+        self.running = False
+
+    def report(self):
+        errs = [abs(x.error) for x in self.results if x.error is not None]
+        return {
+            "steps": len(self.steps),
+            "sent": len(self.results),
+            "confirmed": len(errs),
+            "max_error": max(errs) if errs else None,
+            "mean_error": sum(errs) / len(errs) if errs else None,
+            "within_tolerance": bool(errs) and max(errs) <= self.tolerance,
+        }
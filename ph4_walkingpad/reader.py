@@ -95,3 +95,26 @@ def reverse_file(file, batch_size=None, lines_separator=None, keep_lines_separat
             keep_lines_separator=keep_lines_separator,
         ),
     )
+
+
+def reverse_lines_offsets(byte_stream, batch_size=1 << 16, separator=b"\n"):
+    """
+    Yields (offset, line) for lines of the byte stream from the end, offset is the line start position.
+    Lines are without the separator.
+    """
+    pos = byte_stream.seek(0, os.SEEK_END)
+    tail = b""
+    while pos > 0:
+        size = min(batch_size, pos)
+        pos -= size
+        byte_stream.seek(pos)
+        lines = (byte_stream.read(size) + tail).split(separator)
+        tail = lines[0]
+
+        offset = pos + len(tail) + len(separator)
+        batch = []
+        for line in lines[1:]:
+            batch.append((offset, line))
+            offset += len(line) + len(separator)
+        yield from reversed(batch)
+    yield 0, tail
@@ -0,0 +1,273 @@
+import json
+import logging
+import re
+from collections.abc import MutableMapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Fields of the stats file records the margin analysis works with
+ANALYSIS_FIELDS = ("time", "dist", "steps", "speed", "rec_time")
+
+# Integer fields written first by WalkingPadControl.on_status, in this order
+PREFIX_FIELDS = ("time", "dist", "steps", "speed", "app_speed", "belt_state", "controller_button", "manual_mode")
+# Record owner fields following rec_time, profile id and the device address. Missing in older records.
+OWNER_FIELDS = ("pid", "dev")
+# Walk markers following the owner fields, `true` or missing. "hist" marks walks ingested from the pad history.
+MARK_FIELDS = ("hist",)
+TAIL_FIELDS = OWNER_FIELDS + MARK_FIELDS
+FAST_FIELDS = PREFIX_FIELDS + ("rec_time",) + TAIL_FIELDS
+EVENT_PREFIX = '{"ev": '  # non-status lines of the event log, skipped by the stats parser
+
+PREFIX_RE = re.compile(r"\{" + ", ".join(r'"%s": (-?\d+)' % x for x in PREFIX_FIELDS) + r", ")
+REC_TIME_RE = re.compile(r'"rec_time": (-?[\d.]+(?:[eE][-+]?\d+)?)[,}]')
+# Owner and marker fields right after rec_time, each optional, one group per field, None if missing
+TAIL_RE = re.compile(
+    "".join(r'(?:, "%s": (null|"[^"\\]*"))?' % x for x in OWNER_FIELDS)
+    + "".join(r'(?:, "%s": (null|false|true))?' % x for x in MARK_FIELDS)
+)
+TAIL_KEYS = tuple(', "%s": ' % x for x in TAIL_FIELDS)
+
+
+def tail_value(val):
+    """Owner string or marker value of a TAIL_RE group, None for null, false and missing"""
+    if val is None or val == "null" or val == "false":
+        return None
+    return val[1:-1] if val[0] == '"' else True
+
+
+class StatusRecord(MutableMapping):
+    """
+    Compact stats file record used by the analysis. Analysis fields and annotations (_ldiff, _segment_*, ...)
+    are stored in slots, other fields of full records in the `extra` dict.
+    Keeps the dict interface (rec["time"], "_records" in rec, rec.get(), dict(rec)), to_dict() for JSON output.
+    `offset` is the position of the record line in the stats file, not part of the mapping.
+    """
+
+    __slots__ = ANALYSIS_FIELDS + (
+        "_ldiff",
+        "_breaking",
+        "_segment_time",
+        "_segment_rtime",
+        "_segment_dist",
+        "_segment_steps",
+        "_records",
+        "pid",
+        "dev",
+        "hist",
+        "extra",
+        "offset",
+    )
+    SLOTS = frozenset(__slots__) - {"extra", "offset"}
+
+    def __init__(self, time=0, dist=0, steps=0, speed=0, rec_time=0.0, **kwargs):
+        self.time = time
+        self.dist = dist
+        self.steps = steps
+        self.speed = speed
+        self.rec_time = rec_time
+        self.extra = None
+        self.offset = None
+        for k, v in kwargs.items():
+            self[k] = v
+
+    @staticmethod
+    def from_dict(js, copy=True):
+        """Record of the dict, with copy=False the dict is taken over as `extra` once the slot fields are moved out"""
+        rec = StatusRecord.__new__(StatusRecord)
+        rec.time = rec.dist = rec.steps = rec.speed = 0
+        rec.rec_time = 0.0
+        rec.offset = None
+        extra = dict(js) if copy else js
+        for key in StatusRecord.SLOTS.intersection(extra):
+            setattr(rec, key, extra.pop(key))
+        rec.extra = extra or None
+        return rec
+
+    def __getitem__(self, key):
+        if key in self.SLOTS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.SLOTS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.SLOTS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        if key in self.SLOTS:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if key in self.SLOTS and hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "StatusRecord(%s)" % (", ".join("%s=%r" % (k, v) for k, v in self.items()),)
+
+    def copy(self):
+        rec = StatusRecord.__new__(StatusRecord)
+        for key in self.__slots__:
+            if hasattr(self, key):
+                setattr(rec, key, getattr(self, key))
+        if self.extra is not None:
+            rec.extra = dict(self.extra)
+        return rec
+
+    def to_dict(self):
+        """Plain dict for JSON output, detail records are converted recursively"""
+        ret = dict(self.items())
+        if ret.get("_records") is not None:
+            ret["_records"] = [x.to_dict() if isinstance(x, StatusRecord) else x for x in ret["_records"]]
+        return ret
+
+
+class SegmentRecords(Sequence):
+    """
+    Detail records of a segment, loaded from the stats file on demand.
+    Only the line offset range is kept, `loader(lo, hi)` returns records with line offsets in (lo, hi], newest first.
+    """
+
+    __slots__ = ("loader", "lo", "hi", "count")
+
+    def __init__(self, loader, lo, hi, count):
+        self.loader = loader
+        self.lo = lo
+        self.hi = hi
+        self.count = count
+
+    def load(self):
+        return self.loader(self.lo, self.hi) if self.count > 0 else []
+
+    def __getitem__(self, idx):
+        return self.load()[idx]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "SegmentRecords(offsets=(%s, %s], count=%s)" % (self.lo, self.hi, self.count)
+
+
+class StatsLineParser:
+    """
+    Stats file line parser with a fast path for the fixed schema written by the controller.
+    With a field projection of FAST_FIELDS, records are extracted by three anchored regex matches (integer prefix,
+    rec_time, owner and marker tail) without building the full JSON object, hex `raw` and calorie fields are skipped.
+    Other shapes fall back to json.loads. With records=True, StatusRecord objects are returned instead of dicts.
+    """
+
+    def __init__(self, fields=ANALYSIS_FIELDS, records=False):
+        self.fields = tuple(fields) if fields else None
+        self.records = records
+        fields = self.fields or ()
+        self.fast = self.fields is not None and all(x in FAST_FIELDS for x in fields)
+        # (field, regex group index) of the prefix and of the tail
+        self.prefix_plan = [(x, PREFIX_FIELDS.index(x)) for x in fields if x in PREFIX_FIELDS]
+        self.tail_plan = [(x, TAIL_FIELDS.index(x)) for x in fields if x in TAIL_FIELDS]
+        self.with_rec_time = "rec_time" in fields
+        # Records of the analysis projection (StatsAnalysis.projection), built without an intermediate dict
+        self.analysis_records = records and set(fields) == set(ANALYSIS_FIELDS + TAIL_FIELDS)
+        self.num_fast = 0
+        self.num_fallback = 0
+        self.num_failed = 0
+
+    def parse_fast(self, line):
+        mt = PREFIX_RE.match(line)
+        if not mt:
+            return None
+        rt = REC_TIME_RE.search(line, mt.end())
+        if not rt:
+            return None
+
+        tail = ()
+        if self.tail_plan:
+            tail = TAIL_RE.match(line, rt.end() - 1).groups()
+            for _, idx in self.tail_plan:
+                if tail[idx] is None and TAIL_KEYS[idx] in line:
+                    return None  # present out of the fixed order or an escaped string
+
+        vals = mt.groups()
+        if self.analysis_records:
+            rec = StatusRecord(int(vals[0]), int(vals[1]), int(vals[2]), int(vals[3]), float(rt.group(1)))
+            rec.pid, rec.dev, rec.hist = tail_value(tail[0]), tail_value(tail[1]), tail_value(tail[2])
+            return rec
+
+        ret = {}
+        for fld, idx in self.prefix_plan:
+            ret[fld] = int(vals[idx])
+        if self.with_rec_time:
+            ret["rec_time"] = float(rt.group(1))
+        for fld, idx in self.tail_plan:
+            ret[fld] = tail_value(tail[idx])
+        return StatusRecord.from_dict(ret, copy=False) if self.records else ret
+
+    def parse(self, line):
+        """Parsed record dict or None for an invalid line"""
+        if self.fast:
+            ret = self.parse_fast(line)
+            if ret is not None:
+                self.num_fast += 1
+                return ret
+
+        if line.startswith(EVENT_PREFIX):
+            return None
+
+        try:
+            js = json.loads(line)
+        except Exception as e:
+            self.num_failed += 1
+            logger.debug("Invalid stats line: %s, %s" % (e, line[:80]))
+            return None
+
+        if not isinstance(js, dict):
+            self.num_failed += 1
+            return None
+
+        self.num_fallback += 1
+        if self.fields is not None:
+            js = {k: js.get(k) for k in self.fields}
+        return StatusRecord.from_dict(js, copy=False) if self.records else js
+
+    def stats(self):
+        return {"fast": self.num_fast, "fallback": self.num_fallback, "failed": self.num_failed}
+
+
+def read_stats_file(fname, fields=ANALYSIS_FIELDS + OWNER_FIELDS):
+    """Records of the stats file in the file order, oldest first, invalid lines skipped"""
+    parser = StatsLineParser(fields)
+    with open(fname, "r") as fh:
+        for line in fh:
+            if not line or line.isspace():
+                continue
+            js = parser.parse(line)
+            if js is not None:
+                yield js
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import csv
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("rec_time", "time", "dist", "steps", "speed")
+SIGNED = ("rec_time", "time", "dist", "steps")  # negated for the reversed input
+CARRIED = ("pid", "dev")  # record owner, copied to the resampled records
+
+
+def is_break(a, b, max_gap=5 * 60):
+    """Consecutive records a, b cannot be interpolated (belt reset, new walk, long outage)"""
+    rtime_diff = b["rec_time"] - a["rec_time"]
+    time_diff = b["time"] - a["time"]
+    return (
+        time_diff < 0
+        or b["steps"] < a["steps"]
+        or b["dist"] < a["dist"]
+        or rtime_diff <= 0
+        or rtime_diff > max_gap
+        or abs(time_diff - rtime_diff) > max_gap
+        or any(a.get(x) != b.get(x) for x in CARRIED)
+    )
+
+
+def change_point(a, b):
+    """
+    Time of the speed change between records a and b. Speed of `a` is assumed until the change,
+    speed of `b` after it. The change time is inferred from the distance travelled in between.
+    """
+    ta, tb = a["rec_time"], b["rec_time"]
+    if a["speed"] == b["speed"]:
+        return tb
+    va, vb = a["speed"] / 36.0, b["speed"] / 36.0  # m/s
+    dist = (b["dist"] - a["dist"]) * 10.0  # m
+    return min(tb, max(ta, ta + (dist - vb * (tb - ta)) / (va - vb)))
+
+
+def interp_py(run, grid):
+    rts = [x["rec_time"] for x in run]
+    ret = []
+    for g in grid:
+        idx = min(max(0, bisect.bisect_right(rts, g) - 1), len(run) - 2)
+        a, b = run[idx], run[idx + 1]
+        frac = (g - a["rec_time"]) / (b["rec_time"] - a["rec_time"])
+        ret.append(
+            {
+                "rec_time": g,
+                "time": a["time"] + frac * (b["time"] - a["time"]),
+                "dist": a["dist"] + frac * (b["dist"] - a["dist"]),
+                "steps": a["steps"] + frac * (b["steps"] - a["steps"]),
+                "speed": a["speed"] if g < change_point(a, b) else b["speed"],
+            }
+        )
+    return ret
+
+
+def interp_np(run, grid):
+    import numpy as np
+
+    arr = np.array([[x[f] for f in FIELDS] for x in run], dtype=float)
+    rts, dist, speed = arr[:, 0], arr[:, 2], arr[:, 4]
+    grid = np.asarray(grid, dtype=float)
+
+    # Speed change points of all intervals, see change_point
+    ta, tb = rts[:-1], rts[1:]
+    va, vb = speed[:-1] / 36.0, speed[1:] / 36.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tc = np.where(va != vb, ta + ((dist[1:] - dist[:-1]) * 10.0 - vb * (tb - ta)) / (va - vb), tb)
+    tc = np.clip(np.nan_to_num(tc, nan=tb), ta, tb)
+
+    idx = np.clip(np.searchsorted(rts, grid, side="right") - 1, 0, len(run) - 2)
+    cols = [grid] + [np.interp(grid, rts, arr[:, i]) for i in (1, 2, 3)]
+    cols.append(np.where(grid < tc[idx], speed[idx], speed[idx + 1]))
+    return [
+        {"rec_time": r, "time": t, "dist": d, "steps": s, "speed": int(v)}
+        for r, t, d, s, v in zip(*[c.tolist() for c in cols])
+    ]
+
+
+def resample(records, step=1.0, max_gap=5 * 60, reverse=False, chunk=4096, use_numpy=True):
+    """
+    Rebuilds a uniform timeline from irregular status records, streaming.
+    Records are sampled every `step` seconds of rec_time, belt time, distance and steps are interpolated linearly,
+    speed changes between two records are placed by the distance travelled in between.
+    Breaks (belt reset, outage over max_gap) are not interpolated, records on both sides of a break are kept,
+    so segment totals are preserved. With reverse, records are expected and returned newest first.
+    Interpolation runs on chunks of records, vectorised with numpy if available.
+    """
+    interp = interp_py
+    if use_numpy:
+        try:
+            import numpy  # noqa: F401, optional, loaded lazily as it is slow to import
+
+            interp = interp_np
+        except ImportError:
+            pass
+
+    run = []
+    t0, k = 0.0, 0
+
+    def view(rec):
+        ret = {f: rec[f] for f in FIELDS}
+        ret.update({f: rec[f] for f in CARRIED if rec.get(f) is not None})
+        if reverse:
+            for f in SIGNED:
+                ret[f] = -ret[f]
+        return ret
+
+    def output(rec):
+        if reverse:
+            for f in SIGNED:
+                rec[f] = -rec[f]
+        return rec
+
+    def flush(final):
+        nonlocal k
+        end = run[-1]["rec_time"]
+        k_end = max(k, int(math.ceil((end - t0) / step)))
+        owner = {f: run[-1][f] for f in CARRIED if f in run[-1]}
+        if len(run) > 1 and k_end > k:
+            for rec in interp(run, [t0 + i * step for i in range(k, k_end)]):
+                rec.update(owner)
+                yield output(rec)
+        k = k_end
+        if final:
+            yield output(dict(run[-1]))
+
+    for rec in records:
+        rec = view(rec)
+        if run and is_break(run[-1], rec, max_gap):
+            yield from flush(True)
+            run = []
+        if not run:
+            t0, k = rec["rec_time"], 0
+        run.append(rec)
+        if len(run) >= chunk:
+            yield from flush(False)
+            run = [run[-1]]
+
+    if run:
+        yield from flush(True)
+
+
+def export_csv(records, fh, step=None, **kwargs):
+    """Writes records to CSV, resampled to the uniform timeline if step is given. Returns number of rows."""
+    writer = csv.writer(fh)
+    writer.writerow(FIELDS)
+    num = 0
+    for rec in resample(records, step, **kwargs) if step else records:
+        writer.writerow([rec[f] for f in FIELDS])
+        num += 1
+    return num
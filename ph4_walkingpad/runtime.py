@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime:
+    """
+    Single event loop runtime. Commands and background services (stats fetching, metrics, programs)
+    run as tasks of one asyncio.TaskGroup on the loop of the shell, no cross-loop hops.
+    Task failures are logged and do not tear down the group. On shutdown, remaining tasks are cancelled
+    and awaited. spawn() is safe to call from other threads as well.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.group = None
+        self.thread_id = None
+        self.tasks = set()
+        self.closing = False
+        self.latencies = []  # dispatch latencies of spawned tasks, seconds, bounded
+        self.max_latencies = 1024
+
+    async def run(self, main):
+        """Runs coroutine main within the task group, shuts the runtime down once main finishes"""
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        async with asyncio.TaskGroup() as group:
+            self.group = group
+            try:
+                return await main
+            finally:
+                await self.shutdown()
+
+    def spawn(self, coro, name=None):
+        """Schedules coroutine as a runtime task, returns the task (concurrent future if called off the loop thread)"""
+        if self.closing:
+            coro.close()
+            raise RuntimeError("Runtime is shutting down")
+        if self.loop is not None and threading.get_ident() != self.thread_id:
+            return asyncio.run_coroutine_threadsafe(self._spawn_async(coro, name), self.loop)
+
+        start = time.perf_counter()
+        wrapped = self._guard(coro, start)
+        task = self.group.create_task(wrapped, name=name) if self.group else asyncio.ensure_future(wrapped)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _spawn_async(self, coro, name):
+        return await self.spawn(coro, name)
+
+    async def _guard(self, coro, start):
+        self.latencies.append(time.perf_counter() - start)
+        if len(self.latencies) > self.max_latencies:
+            del self.latencies[: len(self.latencies) - self.max_latencies]
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Task failed: %s" % (e,), exc_info=e)
+
+    async def shutdown(self, timeout=5.0):
+        """Cancels and awaits all runtime tasks"""
+        self.closing = True
+        current = asyncio.current_task()
+        tasks = [x for x in self.tasks if x is not current and not x.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logger.warning("Tasks not finished on shutdown: %s" % (len(pending),))
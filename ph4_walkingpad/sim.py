@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+from ph4_walkingpad.pad import WalkingPadCurStatus
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedPad:
+    """
+    Simple pad model running in virtual time, for offline evaluation of speed controllers.
+    Mimics the Controller command interface used by the controllers (change_speed, last_status, pacing fields).
+    Speed commands are applied after `latency` seconds, the belt then ramps with `accel` km/h per second.
+    """
+
+    def __init__(self, latency=0.5, accel=0.5, step_len=0.6, max_speed=60, start_time=0.0):
+        self.latency = latency
+        self.accel = accel
+        self.step_len = step_len  # meters
+        self.max_speed = max_speed
+        self.minimal_cmd_space = 0.69
+        self.last_cmd_time = None
+        self.now = start_time
+
+        self.speed = 0.0  # km/h
+        self.target = 0  # km/h * 10
+        self.pending = []  # (apply_time, speed)
+        self.belt_time = 0.0
+        self.dist_m = 0.0
+        self.steps = 0.0
+        self.commands = []  # (time, speed)
+        self.last_status = None
+
+    def clock(self):
+        return self.now
+
+    def command(self, speed: int):
+        self.last_cmd_time = self.now
+        self.commands.append((self.now, speed))
+        self.pending.append((self.now + self.latency, min(self.max_speed, max(0, int(speed)))))
+
+    def cmd_space(self):
+        return self.minimal_cmd_space
+
+    def speed_limit(self):
+        return self.max_speed
+
+    async def change_speed(self, speed: int):
+        self.command(speed)
+
+    def tick(self, dt=1.0):
+        """Advances the virtual time, returns the current status"""
+        while self.pending and self.pending[0][0] <= self.now + dt:
+            self.target = self.pending.pop(0)[1]
+
+        target_kmh = self.target / 10.0
+        dv = self.accel * dt
+        if abs(target_kmh - self.speed) <= dv:
+            self.speed = target_kmh
+        else:
+            self.speed += dv if target_kmh > self.speed else -dv
+
+        self.now += dt
+        if self.speed > 0:
+            self.belt_time += dt
+            dist = self.speed / 3.6 * dt
+            self.dist_m += dist
+            self.steps += dist / self.step_len
+        return self.status()
+
+    def status(self):
+        st = WalkingPadCurStatus(
+            dist=int(self.dist_m / 10),
+            time=int(self.belt_time),
+            steps=int(self.steps),
+            speed=int(round(self.speed * 10)),
+            app_speed=self.target * 3,
+            belt_state=1 if self.speed > 0 else 0,
+            manual_mode=1,
+            rtime=self.now,
+        )
+        self.last_status = st
+        return st
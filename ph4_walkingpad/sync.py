@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+
+from ph4_walkingpad.upload import get_records
+from ph4_walkingpad.utils import default_data_dir
+
+logger = logging.getLogger(__name__)
+
+
+def default_records_file():
+    return os.path.join(default_data_dir(), "records.json")
+
+
+def extract_records(js):
+    """Record list from the service response, tolerates both plain list and wrapped forms"""
+    if isinstance(js, list):
+        return js
+    if not isinstance(js, dict):
+        return []
+
+    data = js.get("data", js)
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("list", "records", "items"):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+class RecordSync:
+    """
+    Local cache of remote walk records keyed by the record start `time`.
+    Sync fetches only records newer than the stored high-water timestamp, page by page.
+    """
+
+    def __init__(self, cache_file=None, per_page=100, max_pages=1000):
+        self.cache_file = cache_file
+        self.per_page = per_page
+        self.max_pages = max_pages
+        self.records = {}  # str(time) -> record
+        self.timestamp = 0  # high-water mark, newest record time
+
+    def load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return self
+        with open(self.cache_file, "r") as fh:
+            js = json.load(fh)
+        self.records = js.get("records", {})
+        self.timestamp = js.get("timestamp", 0)
+        return self
+
+    def save(self):
+        if not self.cache_file:
+            return
+        dname = os.path.dirname(self.cache_file)
+        if dname:
+            os.makedirs(dname, exist_ok=True)
+        tmp_fname = self.cache_file + ".tmp"
+        with open(tmp_fname, "w+") as fh:
+            json.dump({"timestamp": self.timestamp, "records": self.records}, fh, indent=2)
+        os.replace(tmp_fname, self.cache_file)
+
+    def add(self, rec):
+        try:
+            rtime = int(rec["time"])
+        except Exception:
+            logger.debug("Record without time: %s" % (rec,))
+            return False
+
+        key = str(rtime)
+        is_new = key not in self.records
+        self.records[key] = rec
+        return is_new
+
+    def sync(self, tok, session=None, api_url=None, **kwargs):
+        """Fetches records newer than the high-water timestamp, returns the number of new records. Blocking."""
+        since = self.timestamp
+        newest = since  # high-water mark moves only after all pages are fetched
+        num_new = 0
+        for page in range(1, self.max_pages + 1):
+            r = get_records(
+                tok,
+                page=page,
+                per_page=self.per_page,
+                timestamp=since or None,
+                session=session,
+                api_url=api_url,
+                **kwargs
+            )
+            r.raise_for_status()
+            recs = extract_records(r.json())
+
+            fresh = [x for x in recs if "time" in x and int(x["time"]) > since]
+            for rec in fresh:
+                num_new += self.add(rec)
+                newest = max(newest, int(rec["time"]))
+
+            # Short page, or the server ignores timestamp filter and returns only old records
+            if len(recs) < self.per_page or not fresh:
+                break
+
+        self.timestamp = newest
+        self.save()
+        logger.info("Synced %d new records, high-water: %s" % (num_new, self.timestamp))
+        return num_new
+
+    def find(self, timex, tolerance=180):
+        """Remote record starting within tolerance seconds from timex"""
+        rec = self.records.get(str(int(timex)))
+        if rec is not None:
+            return rec
+
+        best, best_diff = None, None
+        for key, rec in self.records.items():
+            diff = abs(int(key) - timex)
+            if diff <= tolerance and (best_diff is None or diff < best_diff):
+                best, best_diff = rec, diff
+        return best
+
+    def missing_walks(self, walks, tolerance=180):
+        """
+        Local walks without a matching remote record.
+        walks: iterable of (idx, (cal_acc, timex, dur, dist, steps)), as computed by StatsAnalysis.walk_record
+        """
+        ret = []
+        for idx, rec in walks:
+            timex, steps = rec[1], rec[4]
+            if not steps:
+                continue
+            if self.find(timex, tolerance) is None:
+                ret.append((idx, rec))
+        return ret
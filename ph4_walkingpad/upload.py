@@ -1,19 +1,26 @@
+import asyncio
 import hashlib
 import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
+from ph4_walkingpad.utils import default_data_dir
 
 logger = logging.getLogger(__name__)
 
+API_URL = "https://eu.app.walkingpad.com/user/api/v2"
 
-def upload_record(tok, did, cal, timex, dur, distance, step, **kwargs):
+
+def upload_record(tok, did, cal, timex, dur, distance, step, session=None, api_url=None, **kwargs):
     """
     Uploads record to your account
     tok = your JWT token obtained from the app.
     did = device ID, MAC address ff:ff:ff:ff:ff:ff
     """
-    url = "https://eu.app.walkingpad.com/user/api/v2/record"
+    url = "%s/record" % (api_url or API_URL,)
     cookies = {"user": tok}
     js = {
         "did": did,
@@ -28,15 +35,19 @@ def upload_record(tok, did, cal, timex, dur, distance, step, **kwargs):
     logger.info(
         "Upload record: %s" % (json.dumps(js, indent=2)),
     )
-    return requests.post(url, json=js, cookies=cookies, **kwargs)
+    if session is None:
+        import requests as session
+    return session.post(url, json=js, cookies=cookies, **kwargs)
 
 
-def get_records(tok, page=1, per_page=10000, timestamp=None, **kwargs):
-    url = "https://eu.app.walkingpad.com/user/api/v2/record?page=%d&per_page=%d" % (page, per_page)
+def get_records(tok, page=1, per_page=10000, timestamp=None, session=None, api_url=None, **kwargs):
+    url = "%s/record?page=%d&per_page=%d" % (api_url or API_URL, page, per_page)
     if timestamp:
         url += "&timestamp=%d" % timestamp
     cookies = {"user": tok}
-    return requests.get(url, cookies=cookies, **kwargs)
+    if session is None:
+        import requests as session
+    return session.get(url, cookies=cookies, **kwargs)
 
 
 def login(email, password=None, password_md5=None, **kwargs):
@@ -47,6 +58,197 @@ def login(email, password=None, password_md5=None, **kwargs):
     password_md5 = password_md5 if password_md5 else hashlib.md5(password.encode("utf8")).hexdigest()
     js = {"email": email, "password": password_md5}
 
+    import requests
+
     r = requests.post(url, json=js, **kwargs)
     r.raise_for_status()
     return r.cookies.get_dict()["user"], r
+
+
+def walk_id(did, timex):
+    """Idempotency key of a walk, device + walk start time"""
+    return "%s-%d" % (did or "", int(timex))
+
+
+def default_outbox_file():
+    return os.path.join(default_data_dir(), "outbox.json")
+
+
+class UploadQueue:
+    """
+    Persistent upload outbox. Records are uploaded from a single worker thread using a pooled requests.Session,
+    with retries and exponential backoff. Each walk is uploaded at most once, keyed by walk_id.
+    Walks rejected by the service (4xx other than auth errors) are moved to `failed` and not retried by flush,
+    an explicit upload() sends them again.
+    """
+
+    def __init__(self, outbox_file=None, api_url=None, retries=4, backoff=1.0, backoff_max=30.0, timeout=30.0):
+        self.outbox_file = outbox_file
+        self.api_url = api_url
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.pending = {}  # walk_id -> record
+        self.done = {}  # walk_id -> result
+        self.failed = {}  # walk_id -> record with the error, rejected by the service
+        self.session = None
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+
+    def load(self):
+        if not self.outbox_file or not os.path.exists(self.outbox_file):
+            return self
+        with open(self.outbox_file, "r") as fh:
+            js = json.load(fh)
+        with self.lock:
+            self.pending = js.get("pending", {})
+            self.done = js.get("done", {})
+            self.failed = js.get("failed", {})
+        return self
+
+    def save(self):
+        if not self.outbox_file:
+            return
+        with self.lock:
+            js = {"pending": self.pending, "done": self.done, "failed": self.failed}
+            dname = os.path.dirname(self.outbox_file)
+            if dname:
+                os.makedirs(dname, exist_ok=True)
+            tmp_fname = self.outbox_file + ".tmp"
+            with open(tmp_fname, "w+") as fh:
+                json.dump(js, fh, indent=2)
+            os.replace(tmp_fname, self.outbox_file)
+
+    def get_session(self):
+        if self.session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        return self.session
+
+    def is_known(self, wid):
+        with self.lock:
+            return wid in self.done or wid in self.pending or wid in self.failed
+
+    def enqueue(self, did, cal, timex, dur, distance, step):
+        """Adds record to the outbox, returns walk id or None if the walk is already queued, uploaded or rejected"""
+        wid = walk_id(did, timex)
+        with self.lock:
+            if self.is_known(wid):
+                return None
+            self.pending[wid] = {
+                "did": did,
+                "cal": int(cal),
+                "timex": int(timex),
+                "dur": int(dur),
+                "distance": int(distance),
+                "step": int(step),
+                "queued": time.time(),
+                "attempts": 0,
+            }
+        self.save()
+        return wid
+
+    def upload_one(self, tok, wid):
+        with self.lock:
+            rec = dict(self.pending[wid])
+
+        backoff = self.backoff
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.backoff_max)
+            try:
+                r = upload_record(
+                    tok,
+                    rec["did"],
+                    cal=rec["cal"],
+                    timex=rec["timex"],
+                    dur=rec["dur"],
+                    distance=rec["distance"],
+                    step=rec["step"],
+                    session=self.get_session(),
+                    api_url=self.api_url,
+                    timeout=self.timeout,
+                )
+            except Exception as e:
+                last_error = str(e)
+            else:
+                if r.status_code < 400:
+                    break
+                last_error = "HTTP %s" % (r.status_code,)
+                if r.status_code in (401, 403):
+                    raise IOError("Upload of %s not authorized (%s), login again" % (wid, last_error))
+                if r.status_code < 500 and r.status_code != 429:
+                    self.reject(wid, last_error)
+                    raise IOError("Upload of %s rejected: %s" % (wid, last_error))
+            logger.info("Upload of %s failed (%s), attempt %d" % (wid, last_error, attempt + 1))
+        else:
+            with self.lock:
+                self.pending[wid]["attempts"] += self.retries + 1
+                self.pending[wid]["error"] = last_error
+            raise IOError("Upload of %s failed: %s" % (wid, last_error))
+
+        try:
+            resp = r.json()
+        except Exception:
+            resp = r.text
+
+        with self.lock:
+            self.pending.pop(wid, None)
+            self.done[wid] = {"uploaded": time.time(), "response": resp}
+        return self.done[wid]
+
+    def reject(self, wid, error):
+        """Moves the walk rejected by the service from pending to failed"""
+        with self.lock:
+            rec = self.pending.pop(wid, None)
+            if rec is not None:
+                rec["error"] = error
+                rec["failed"] = time.time()
+                self.failed[wid] = rec
+
+    def flush_sync(self, tok, wids=None):
+        """Uploads pending records, returns {walk_id: result or exception}"""
+        with self.lock:
+            todo = [x for x in (wids or list(self.pending.keys())) if x in self.pending]
+
+        res = {}
+        for wid in todo:
+            try:
+                res[wid] = self.upload_one(tok, wid)
+            except Exception as e:
+                logger.warning("Could not upload %s: %s" % (wid, e))
+                res[wid] = e
+            self.save()
+        return res
+
+    async def flush(self, tok, wids=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.flush_sync, tok, wids)
+
+    async def upload(self, tok, did, cal, timex, dur, distance, step):
+        """Uploads the walk, walks pending from failed attempts or rejected before are sent again"""
+        wid = walk_id(did, timex)
+        with self.lock:
+            if wid in self.done:
+                return wid, self.done[wid]
+            self.failed.pop(wid, None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.enqueue, did, cal, timex, dur, distance, step)
+
+        res = await self.flush(tok, [wid])
+        return wid, res.get(wid)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.session:
+            self.session.close()
+            self.session = None
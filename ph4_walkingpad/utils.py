@@ -1,4 +1,5 @@
 import logging
+import os
 import re
 import sys
 
@@ -14,6 +15,10 @@ def defval(js, key, default=None):
     return js[key] if key in js else default
 
 
+def default_data_dir():
+    return os.path.join(os.path.expanduser("~"), ".ph4-walkingpad")
+
+
 def setup_logging():
     log = logging.getLogger(__name__)
     log.setLevel(logging.DEBUG)
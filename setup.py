@@ -66,14 +66,16 @@ setup(
     ],
     packages=find_packages(),
     include_package_data=True,
+    python_requires=">=3.11",
     install_requires=install_requires,
     extras_require={
         "dev": dev_extras,
         "docs": docs_extras,
+        "analysis": ["numpy"],
     },
     entry_points={
         "console_scripts": [
-            "ph4-walkingpad-ctl = ph4_walkingpad.main:main",
+            "ph4-walkingpad-ctl = ph4_walkingpad.cli:main",
             "ph4-cal = ph4_walkingpad.cal:main",
         ],
     },
@@ -0,0 +1,117 @@
+import json
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.profile import Profile, model_walk
+from ph4_walkingpad.records import ANALYSIS_FIELDS, SegmentRecords
+
+
+def write_walk(fname, start=1600000000, pid=None):
+    # 2 min at 3.0 km/h, 3 min at 5.0 km/h, then stop
+    recs = [{"time": 0, "dist": 0, "steps": 0, "speed": 0, "rec_time": start - 5, "pid": pid}]
+    dist = 0.0
+    for t in range(0, 301, 5):
+        speed = 30 if t < 120 else 50
+        recs.append({"time": t, "dist": int(dist), "steps": t * 2, "speed": speed, "rec_time": start + t, "pid": pid})
+        dist += speed / 36.0 * 5 / 10
+    recs.append({"time": 300, "dist": int(dist), "steps": 600, "speed": 0, "rec_time": start + 305, "pid": pid})
+    with open(fname, "w") as fh:
+        for rec in recs:
+            fh.write(json.dumps(rec) + "\n")
+
+
+def test_rescore(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    write_walk(fname)
+    profiles = [Profile(age=30, male=True, weight=80, height=1.80), Profile(age=50, male=False, weight=60, height=1.65)]
+
+    analysis = StatsAnalysis(profile=profiles[0], stats_file=fname)
+    res = list(analysis.rescore(["walk2", "walk"], profiles))
+    assert len(res) == 1
+    scores = res[0][4]
+    assert set(scores.keys()) == {("walk2", 0), ("walk2", 1), ("walk", 0), ("walk", 1)}
+
+    # Default model matches the live computation
+    margins = next(StatsAnalysis(profile=profiles[0], stats_file=fname).parse_stats())
+    cal, cal_net = StatsAnalysis(profile=profiles[0]).comp_calories(margins)
+    assert abs(scores[("walk2", 0)][0] - sum(cal)) < 1e-6
+    assert abs(scores[("walk2", 0)][1] - sum(cal_net)) < 1e-6
+
+    cal, _ = StatsAnalysis(profile=profiles[1], cal_model=model_walk).comp_calories(margins)
+    assert abs(scores[("walk", 1)][0] - sum(cal)) < 1e-6
+    assert scores[("walk2", 1)][0] < scores[("walk2", 0)][0]
+
+
+def test_projection_opt_in(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    write_walk(fname, pid="alice")
+    with open(fname) as fh:
+        recs = [dict(json.loads(x), ccal=0.5, raw="f8a2") for x in fh]
+    with open(fname, "w") as fh:
+        fh.writelines(json.dumps(x) + "\n" for x in recs)
+
+    full = next(StatsAnalysis(stats_file=fname).parse_stats())
+    assert (full[0]["ccal"], full[0]["raw"], full[0]["pid"]) == (0.5, "f8a2", "alice")
+    projected = next(StatsAnalysis(stats_file=fname, fields=ANALYSIS_FIELDS).parse_stats())
+    assert projected[0].get("ccal") is None
+    assert [x["rec_time"] for x in projected] == [x["rec_time"] for x in full]
+
+
+def test_lazy_details(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    write_walk(fname)
+
+    analysis = StatsAnalysis(stats_file=fname)
+    lazy = next(analysis.parse_stats(collect_details=True))
+    plain_an = StatsAnalysis(stats_file=fname)
+    plain = next(plain_an.analyze_records_margins((dict(x) for x in plain_an.feed_records()), collect_details=True))
+
+    segs = [(x, y) for x, y in zip(lazy, plain) if "_records" in y]
+    assert segs
+    for xl, xp in segs:
+        assert isinstance(xl["_records"], SegmentRecords)
+        assert len(xl["_records"]) == len(xp["_records"])
+        assert [dict(r) for r in xl["_records"]] == xp["_records"]
+
+    analysis.details_cache.clear()
+    analysis.details_cache_size = 1
+    non_empty = [x["_records"] for x, _ in segs if len(x["_records"])]
+    assert len(non_empty) >= 2
+    assert non_empty[0][0] is non_empty[0][0]
+    list(non_empty[1])
+    assert len(analysis.details_cache) == 1
+
+
+def test_merged(tmp_path):
+    # Two persons, one log each, walks interleaved in time
+    fa, fb = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    write_walk(fa, start=1600000000, pid="alice")
+    write_walk(fb, start=1600000100, pid="bob")
+    profiles = []
+    for pid, weight in (("alice", 60), ("bob", 90)):
+        profiles.append(str(tmp_path / (pid + ".json")))
+        with open(profiles[-1], "w") as fh:
+            json.dump({"id": pid, "male": True, "age": 30, "weight": weight, "height": 1.8}, fh)
+
+    analysis = StatsAnalysis()
+    analysis.load_profiles(profiles)
+    merged = list(analysis.merge_records([fa, fb]))
+    assert len(merged) == 2 * 63
+    assert all(x["rec_time"] >= y["rec_time"] for x, y in zip(merged, merged[1:]))
+
+    walks = dict(analysis.parse_stats_merged([fa, fb]))
+    assert set(walks.keys()) == {"alice", "bob"}
+    cal_a = sum(analysis.comp_calories(walks["alice"])[0])
+    cal_b = sum(analysis.comp_calories(walks["bob"])[0])
+    single = StatsAnalysis(profile=analysis.profiles["alice"], stats_file=fa)
+    assert abs(cal_a - sum(single.comp_calories(next(single.parse_stats()))[0])) < 1e-6
+
+    # Per-record profiles apply to a single projected file as well
+    single = StatsAnalysis(stats_file=fb, fields=ANALYSIS_FIELDS)
+    single.load_profiles(profiles)
+    assert abs(cal_b - sum(single.comp_calories(next(single.parse_stats()))[0])) < 1e-6
+    assert abs(cal_b / cal_a - 1.5) < 1e-6
+
+    # No made-up person for records without a profile
+    del analysis.profiles["bob"]
+    assert analysis.comp_calories(walks["bob"]) == ([], [])
+    assert analysis.walk_record(walks["bob"])[0] == 0
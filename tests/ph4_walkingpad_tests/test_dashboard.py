@@ -0,0 +1,118 @@
+import asyncio
+import io
+import re
+
+from blessed import Terminal
+
+from ph4_walkingpad.dashboard import Dashboard, sparkline
+from ph4_walkingpad.pad import WalkingPadCurStatus
+from ph4_walkingpad.runtime import Runtime
+
+ESC_RE = re.compile(r"\x1b(7|8|\[(\d*)(?:;(\d*))?([HKr]))")
+
+
+class Screen:
+    """Minimal VT100 screen: cursor moves, save/restore, erase to end of line, scroll region, line feeds"""
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.rows = [""] * height
+        self.x = self.y = 0
+        self.saved = (0, 0)
+        self.top, self.bottom = 0, height - 1
+
+    def put(self, ch):
+        if ch == "\n":
+            if self.y == self.bottom:
+                del self.rows[self.top]
+                self.rows.insert(self.bottom, "")
+            else:
+                self.y = min(self.y + 1, self.height - 1)
+            self.x = 0
+        elif ch != "\r":
+            row = self.rows[self.y].ljust(self.x)
+            self.rows[self.y] = row[: self.x] + ch + row[self.x + 1 :]
+            self.x += 1
+
+    def feed(self, data):
+        pos = 0
+        while pos < len(data):
+            mt = ESC_RE.match(data, pos)
+            if not mt:
+                self.put(data[pos])
+                pos += 1
+                continue
+            pos = mt.end()
+            cmd, a, b, op = mt.groups()
+            if cmd == "7":
+                self.saved = (self.x, self.y)
+            elif cmd == "8":
+                self.x, self.y = self.saved
+            elif op == "H":
+                self.y, self.x = int(a or 1) - 1, int(b or 1) - 1
+            elif op == "K":
+                self.rows[self.y] = self.rows[self.y][: self.x]
+            elif op == "r":
+                self.top, self.bottom = int(a) - 1, int(b) - 1
+                self.x = self.y = 0
+
+
+def test_sparkline():
+    assert sparkline([]) == ""
+    assert sparkline([0, 3, 6], vmax=6) == " ▄█"
+
+
+def test_dashboard_render():
+    term = Terminal(force_styling=True)
+    out = io.StringIO()
+    screen = Screen(term.width, term.height)
+    dash = Dashboard(term, out=out)
+
+    def render():
+        out.seek(0)
+        out.truncate(0)
+        dash.render()
+        screen.feed(out.getvalue())
+        return out.getvalue()
+
+    dash.update(WalkingPadCurStatus(dist=150, time=600, steps=900, speed=30), [10.0], 2.0, 1.5)
+    render()
+    assert screen.rows[0].startswith("Speed:  3.0 km/h   Distance:   1.50 km")
+    assert screen.y == term.height - 1  # prompt below the panel
+
+    # Shell output scrolls below the panel, the panel stays
+    screen.feed("".join("line %d\n" % i for i in range(2 * term.height)))
+    assert screen.rows[0].startswith("Speed:  3.0 km/h") and screen.rows[4] == "-" * term.width
+    assert screen.rows[-2] == "line %d" % (2 * term.height - 1)
+
+    # Only the changed lines are redrawn
+    dash.update(WalkingPadCurStatus(dist=160, time=600, steps=900, speed=30), [10.0], 2.0, 1.5)
+    assert render().count(term.clear_eol) == 2  # speed line, sparkline
+    assert "1.60 km" in screen.rows[0]
+    assert render() == ""
+
+    # Full repaint after other output
+    screen.rows[1] = "clobbered"
+    dash.invalidate()
+    assert render().count(term.clear_eol) == Dashboard.ROWS
+    assert screen.rows[1].startswith("Calories: segment")
+
+    out.seek(0)
+    out.truncate(0)
+    dash.stop()
+    screen.feed(out.getvalue())
+    assert (screen.top, screen.bottom) == (0, term.height - 1)
+
+
+def test_dashboard_runtime_task():
+    runtime = Runtime()
+    dash = Dashboard(Terminal(force_styling=True), out=io.StringIO(), runtime=runtime)
+
+    async def main():
+        dash.start()
+        await asyncio.sleep(0)
+        assert dash.task in runtime.tasks
+        return dash.task
+
+    task = asyncio.run(runtime.run(main()))
+    assert task.done()  # cancelled on the runtime shutdown
@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+from ph4_walkingpad.devcache import DeviceCache
+from ph4_walkingpad.persist import IOExecutor
+
+
+def test_device_cache(tmp_path):
+    fname = os.path.join(str(tmp_path), "sub", "devices.json")
+    cache = DeviceCache(fname).load()
+    assert cache.last() is None
+
+    cache.update("AA:BB", name="WalkingPad", handles={"fe01": 12, "fe02": 15})
+    cache.update("CC:DD", name="WalkingPad A1")["last_seen"] += 1
+    cache.save()
+
+    cache2 = DeviceCache(fname).load()
+    assert cache2.get("AA:BB")["handles"] == {"fe01": 12, "fe02": 15}
+    assert cache2.last()["address"] == "CC:DD"
+    assert cache2.last(address_prefix="AA")["address"] == "AA:BB"
+
+
+def test_device_cache_io(tmp_path):
+    # Loaded and stored on the I/O thread, as by the shell
+    io = IOExecutor()
+    fname = os.path.join(str(tmp_path), "sub", "devices.json")
+    try:
+        cache = asyncio.run(io.run(DeviceCache(fname).load))
+        cache.update("AA:BB", name="WalkingPad", spacing={"speed": 0.4})
+        io.save_json(cache.path, cache.dump()).result(5)
+    finally:
+        io.shutdown()
+    assert DeviceCache(fname).load().get("AA:BB")["spacing"] == {"speed": 0.4}
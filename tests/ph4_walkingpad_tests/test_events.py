@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.events import (
+    EVENT_CMD,
+    EVENT_CONN,
+    EVENT_UPLOAD,
+    EventLog,
+    LiveView,
+    UploadView,
+    WalksView,
+    replay,
+)
+from ph4_walkingpad.persist import IOExecutor
+
+from .test_analysis import write_walk
+
+KEYS = ("time", "speed", "rec_time", "_segment_time", "_segment_dist", "_segment_steps", "_segment_rtime")
+
+
+def norm(walks):
+    return [[tuple(x.get(k) for k in KEYS) for x in m] for m in walks]
+
+
+def test_walks_view_replay(tmp_path):
+    fname = str(tmp_path / "events.json")
+    for start in (1000, 5000, 9000, 9400):
+        part = str(tmp_path / "part.json")
+        write_walk(part, start)
+        with open(part) as src, open(fname, "a") as fh:
+            fh.write(src.read())
+            fh.write(json.dumps({"ev": EVENT_CMD, "t": start, "cmd": "speed"}) + "\n")
+
+    # Stats file analysis skips the other events, views match it
+    expected = norm(StatsAnalysis(stats_file=fname).parse_stats())
+    assert len(expected) == 4
+
+    walks, live = WalksView(), LiveView()
+    assert replay(fname, [walks, live]) == 4 * 64
+    assert norm(walks.margins()) == expected
+    assert live.num_cmds == 4 and live.last["rec_time"] == 9400 + 305
+
+    # Incremental updates match the replay
+    inc = WalksView()
+    log = EventLog(views=[inc])
+    with open(fname) as fh:
+        for line in fh:
+            js = json.loads(line)
+            if "ev" in js:
+                log.event(js.pop("ev"), **js)
+            else:
+                log.status(js)
+    assert norm(inc.margins()) == expected
+    assert norm(inc.margins(2)) == expected[:2]
+
+
+def test_upload_view(tmp_path):
+    fname = str(tmp_path / "events.json")
+    walks = WalksView()
+    uploads = UploadView(walks, did="d1")
+    log = EventLog(fname, views=[walks, uploads])
+    for start in (1000, 5000):
+        part = str(tmp_path / "part.json")
+        write_walk(part, start)
+        with open(part) as fh:
+            for line in fh:
+                log.status(json.loads(line))
+
+    cands = uploads.candidates()
+    assert len(cands) == 2
+    log.event(EVENT_UPLOAD, wid=cands[0][0])
+    assert [x[0] for x in uploads.candidates()] == [cands[1][0]]
+
+    # Rebuilt from the written log
+    fresh = UploadView(WalksView(), did="d1")
+    replay(fname, [fresh.walks_view, fresh])
+    assert fresh.candidates() == uploads.candidates()
+
+
+def test_event_log_write_failure(tmp_path):
+    fname = str(tmp_path / "events.json")
+    live = LiveView()
+    log = EventLog(fname, views=[live])
+    log.event(EVENT_CONN, state="connected", address=object())  # not serializable
+    assert live.connected
+    log.event(EVENT_CMD, cmd="speed")
+    assert live.num_cmds == 1
+
+    with open(fname) as fh:
+        assert [json.loads(x)["ev"] for x in fh] == [EVENT_CMD]
+
+
+def test_event_log_rebuild(tmp_path):
+    # Events logged while the replay runs on the I/O thread land in the fresh views exactly once
+    fname = str(tmp_path / "events.json")
+    gate = threading.Event()
+
+    class GatedView(LiveView):
+        def on_event(self, ev):
+            gate.wait(5)
+            super().on_event(ev)
+
+    async def scenario():
+        live = LiveView()
+        log = EventLog(fname, io=io, views=[live])
+        for _ in range(3):
+            log.event(EVENT_CMD, cmd="speed")
+
+        fresh = GatedView()
+        task = asyncio.create_task(log.rebuild([fresh]))
+        while log.pending is None:
+            await asyncio.sleep(0.01)
+        log.event(EVENT_CMD, cmd="stop")
+        log.event(EVENT_CMD, cmd="start")
+        assert live.num_cmds == 5 and log.views[fresh.name] is live
+        gate.set()
+
+        assert await task == 3
+        assert log.views[fresh.name] is fresh and log.pending is None
+        assert fresh.num_cmds == 5
+        await io.drain()
+
+    io = IOExecutor()
+    try:
+        asyncio.run(scenario())
+    finally:
+        io.shutdown()
+    with open(fname) as fh:
+        assert len(fh.readlines()) == 5
@@ -0,0 +1,70 @@
+import json
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.events import UploadView, WalksView, replay
+from ph4_walkingpad.history import HistorySync, is_hist
+from ph4_walkingpad.pad import WalkingPad, WalkingPadLastStatus
+
+from .test_analysis import write_walk
+
+
+def last_status(time, dist, steps, rtime):
+    frame = [248, 167] + [0] * 6 + sum((WalkingPad.int2byte(x) for x in (time, dist, steps)), []) + [0, 253]
+    return WalkingPadLastStatus.from_data(bytearray(frame), rtime)
+
+
+def test_history_ingest(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    write_walk(fname, 1000)
+    with open(fname) as fh:
+        last = json.loads(fh.readlines()[-1])  # totals of the local walk
+
+    known = last_status(last["time"], last["dist"], last["steps"], 5000.0)
+    offline = last_status(1800, 250, 2600, 10000.0)
+    offline2 = last_status(600, 100, 900, 10000.0)
+
+    hist = HistorySync(fname, pid="a", dev="AA:BB")
+    assert hist.ingest([known, offline, offline2]) == [offline, offline2]
+    assert hist.ingest([known, offline, offline2]) == []  # deduplicated against the ingested walks
+
+    analysis = StatsAnalysis(stats_file=fname)
+    walks = list(analysis.parse_stats(3))
+    assert [(m[0]["time"], m[0]["dist"], m[0]["steps"]) for m in walks] == [
+        (1800, 250, 2600),
+        (600, 100, 900),
+        (last["time"], last["dist"], last["steps"]),
+    ]
+    assert walks[0][0]["rec_time"] == 10000.0 and walks[1][0]["rec_time"] <= 10000.0 - 1800 - 1
+    assert walks[0][0]["_segment_time"] == 1800
+    assert next(StatsAnalysis(stats_file=fname, fields=None).parse_stats())[0]["hist"]
+
+
+def test_history_partial(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    write_walk(fname, 1000)
+    with open(fname) as fh:
+        recs = [json.loads(x) for x in fh.readlines()[:-1]]  # recording cut off with the belt running
+    with open(fname, "w") as fh:
+        fh.write("".join(json.dumps(x) + "\n" for x in recs))
+    last = recs[-1]
+
+    # Pad totals continue the cut off walk, ended before the reception
+    longer = last_status(last["time"] + 600, last["dist"] + 80, last["steps"] + 900, 5000.0)
+    hist = HistorySync(fname)
+    assert hist.ingest([longer]) == []
+
+    # Too long to have ended before the reception, or another walk recorded meanwhile
+    assert hist.new_records([last_status(last["time"] + 4000, last["dist"] + 80, last["steps"] + 900, 5000.0)])
+    with open(fname, "a") as fh:
+        fh.write(json.dumps({"time": 0, "dist": 0, "steps": 0, "speed": 0, "rec_time": 1500}) + "\n")
+        fh.write(json.dumps({"time": 0, "dist": 0, "steps": 0, "speed": 30, "rec_time": 1505}) + "\n")
+        fh.write(json.dumps({"time": 60, "dist": 5, "steps": 100, "speed": 0, "rec_time": 1565}) + "\n")
+    assert hist.ingest([longer]) == [longer]
+    assert hist.ingest([longer]) == []
+
+    # Ingested walks are left out of uploads unless confirmed
+    walks = WalksView()
+    uploads = UploadView(walks)
+    replay(fname, [walks, uploads])
+    assert sum(map(is_hist, walks.margins())) == 1
+    assert len(uploads.candidates(hist=True)) == len(uploads.candidates()) + 1
@@ -0,0 +1,53 @@
+import asyncio
+
+from ph4_walkingpad.metrics import Metrics, MetricsServer
+
+
+def test_render():
+    mt = Metrics()
+    mt.set_gauge("speed_kmh", 3.5)
+    mt.inc("packets_received_total")
+    mt.inc("packets_received_total")
+    mt.observe("cmd_latency_seconds", 0.25, labels=(("cmd", "speed"),))
+    mt.observe("cmd_latency_seconds", 0.75, labels=(("cmd", "speed"),))
+
+    out = mt.render()
+    assert "# TYPE walkingpad_speed_kmh gauge" in out
+    assert "walkingpad_speed_kmh 3.5" in out
+    assert "walkingpad_packets_received_total 2" in out
+    assert 'walkingpad_cmd_latency_seconds_count{cmd="speed"} 2' in out
+    assert 'walkingpad_cmd_latency_seconds_sum{cmd="speed"} 1.0' in out
+    assert 'walkingpad_cmd_latency_seconds_max{cmd="speed"} 0.75' in out
+
+    # Every sample belongs to a declared family, summaries carry only _count and _sum
+    types = dict(x.split()[2:4] for x in out.splitlines() if x.startswith("# TYPE"))
+    assert types["walkingpad_cmd_latency_seconds_max"] == "gauge"
+    for line in out.splitlines():
+        if line.startswith("#"):
+            continue
+        name = line.split("{")[0].split()[0]
+        family = name if name in types else name.rsplit("_", 1)[0]
+        assert family in types and (name == family or types[family] == "summary"), line
+
+
+def test_server():
+    async def scrape(path):
+        mt = Metrics()
+        mt.set_gauge("steps", 42)
+        srv = await MetricsServer(mt, port=0).start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", srv.port)
+            writer.write(b"GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n" % path)
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+            return data.decode()
+        finally:
+            await srv.stop()
+
+    resp = asyncio.run(scrape(b"/metrics"))
+    assert resp.startswith("HTTP/1.1 200 OK")
+    assert "walkingpad_steps 42" in resp
+
+    resp = asyncio.run(scrape(b"/other"))
+    assert resp.startswith("HTTP/1.1 404")
@@ -0,0 +1,56 @@
+import pytest
+
+from ph4_walkingpad.pacing import PaceGoal, PacingController, net_cal_minute, simulate
+from ph4_walkingpad.pad import Controller, WalkingPad, WalkingPadCurStatus
+from ph4_walkingpad.profile import Profile, model_acsm, model_walk2
+from ph4_walkingpad.sim import SimulatedPad
+
+
+def test_parse_goal():
+    goal = PaceGoal.parse("5km in 60min")
+    assert (goal.kind, goal.value, goal.duration) == ("dist", 5.0, 3600)
+
+    goal = PaceGoal.parse("300kcal in 0:45")
+    assert (goal.kind, goal.value, goal.duration) == ("cal", 300.0, 45 * 60)
+
+    with pytest.raises(ValueError):
+        PaceGoal.parse("fast")
+
+
+def test_distance_goal():
+    res = simulate(PaceGoal.parse("5km in 60min")).result()
+    assert res["progress"] >= 5.0
+    assert res["elapsed"] <= 3600
+    assert res["commands"] <= 5
+
+
+def test_calorie_goal():
+    with pytest.raises(ValueError):
+        PacingController(None, PaceGoal.parse("150kcal in 45min"))  # no made-up person
+
+    ctl = simulate(PaceGoal.parse("150kcal in 45min"), Profile(age=30, male=True, weight=80, height=1.80))
+    res = ctl.result()
+    assert res["progress"] >= 150.0
+    assert res["commands"] <= 5
+    assert all(x["cmd"] is None or 10 <= x["cmd"] <= 60 for x in ctl.trace)
+
+    # Calories follow the selected model
+    profile = Profile(age=30, male=True, weight=80, height=1.80)
+    for model in (model_walk2, model_acsm):
+        pacing = PacingController(SimulatedPad(), PaceGoal.parse("150kcal in 45min"), profile, model=model)
+        pacing.on_status(WalkingPadCurStatus(time=0, speed=40))
+        pacing.on_status(WalkingPadCurStatus(time=60, speed=40))
+        assert pacing.progress() == pytest.approx(net_cal_minute(4.0, profile, model))
+    assert net_cal_minute(4.0, profile, model_walk2) != pytest.approx(net_cal_minute(4.0, profile, model_acsm))
+
+
+def test_speed_limit():
+    ctl = Controller()
+    assert ctl.speed_limit() == 60
+    ctl.prefs[WalkingPad.PREFS_MAX_SPEED] = 40
+    assert PacingController(ctl, PaceGoal.parse("5km in 60min")).max_speed == 40
+
+    # Goal out of reach under the user's cap, commands stay below it
+    pacing = simulate(PaceGoal.parse("5km in 60min"), pad=SimulatedPad(max_speed=40))
+    cmds = [x["cmd"] for x in pacing.trace if x["cmd"] is not None]
+    assert cmds and max(cmds) <= 40
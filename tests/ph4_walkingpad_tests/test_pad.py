@@ -0,0 +1,283 @@
+import asyncio
+import binascii
+import json
+
+import pytest
+
+from ph4_walkingpad.events import EventLog, LiveView
+from ph4_walkingpad.metrics import Metrics
+from ph4_walkingpad.pad import (
+    CommandEncoder,
+    CommandSpacing,
+    Controller,
+    KnownPad,
+    Scanner,
+    WalkingPad,
+    WalkingPadCurStatus,
+)
+
+
+class FakeChar:
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class FakeServices:
+    def __init__(self, chars):
+        self.chars = {x.handle: x for x in chars}
+
+    def get_characteristic(self, specifier):
+        if isinstance(specifier, str):
+            return next((x for x in self.chars.values() if x.uuid == specifier), None)
+        return self.chars.get(specifier)
+
+
+class FakeClient:
+    def __init__(self, chars=()):
+        self.services = FakeServices(chars)
+        self.is_connected = True
+
+
+def test_resolve_cached_chars():
+    ctl = Controller()
+    ctl.client = FakeClient(
+        [FakeChar("0000fe01-0000-1000-8000-00805f9b34fb", 12), FakeChar("0000fe02-0000-1000-8000-00805f9b34fb", 15)]
+    )
+    assert not ctl.resolve_cached_chars()
+
+    ctl.gatt_handles = {"fe01": 12, "fe02": 15}
+    assert ctl.resolve_cached_chars()
+    assert ctl.char_fe01.handle == 12
+    assert ctl.char_fe02.handle == 15
+
+    ctl.gatt_handles = {"fe01": 15, "fe02": 12}
+    assert not ctl.resolve_cached_chars()
+
+
+def test_resolve_chars_fast():
+    ctl = Controller()
+    ctl.client = FakeClient([FakeChar(Controller.UUID_FE01, 12), FakeChar(Controller.UUID_FE02, 15)])
+    assert ctl.resolve_chars_fast()
+    assert (ctl.char_fe01.handle, ctl.char_fe02.handle) == (12, 15)
+
+    ctl.client = FakeClient([FakeChar(Controller.UUID_FE01, 12)])
+    assert not ctl.resolve_chars_fast()
+
+
+def test_reconnect_backoff():
+    ctl = Controller(address="00:11:22:33:44:55")
+    ctl.reconnect_backoff = 0.01
+    attempts = []
+
+    async def run(address=None):
+        attempts.append(address)
+        if len(attempts) < 3:
+            raise ConnectionError("Device not found")
+
+    ctl.run = run
+    assert asyncio.run(ctl.reconnect())
+    assert len(attempts) == 3
+    assert not ctl.reconnecting
+
+
+class FakeDevice:
+    def __init__(self, address, name, rssi=None):
+        self.address = address
+        self.name = name
+        self.rssi = rssi
+
+
+def test_scanner_matches():
+    dev = FakeDevice("AA:BB:CC:00:11:22", "WalkingPad")
+    assert Scanner.matches(dev)
+    assert Scanner.matches(dev, address_prefix="AA:BB")
+    assert not Scanner.matches(dev, address_prefix="AA:BC")
+    assert not Scanner.matches(FakeDevice("AA:BB:CC:00:11:23", "Speaker"))
+    assert Scanner.matches(FakeDevice("AA:BB:CC:00:11:24", "RE"), dev_name=None, matcher=lambda x: x == "RE")
+
+
+def test_scanner_late_name():
+    scanner = Scanner()
+    assert not scanner.add_candidate(FakeDevice("AA:BB", None))  # name arrives later in the scan response
+    assert scanner.add_candidate(FakeDevice("AA:BB", "WalkingPad"))
+    assert not scanner.add_candidate(FakeDevice("AA:BB", "WalkingPad"))
+    assert [x.address for x in scanner.walking_belt_candidates] == ["AA:BB"]
+
+
+def test_scanner_known_pads_ttl():
+    scanner = Scanner()
+    scanner.cache_ttl = 10
+    scanner.update_known(FakeDevice("AA", "WalkingPad", rssi=-80))
+    scanner.update_known(FakeDevice("BB", "WalkingPad A1", rssi=-50))
+    scanner.update_known(FakeDevice("CC", "Speaker", rssi=-40))
+    assert [x.name for x in scanner.get_known_pads()] == ["WalkingPad A1", "WalkingPad"]
+
+    scanner.known_pads["AA"] = KnownPad(name="WalkingPad", rssi=-80, last_seen=0.0)
+    assert [x.name for x in scanner.get_known_pads()] == ["WalkingPad A1"]
+
+
+def test_dispatcher():
+    frame = binascii.unhexlify("f8a2013c0100022a00004f0003d1b4000000e3fd")
+    received = []
+
+    async def work():
+        ctl = Controller()
+        ctl.log_messages_info = False
+        ctl.handler_cur_status = lambda sender, st: received.append(st)
+        ctl.start_dispatcher()
+
+        ctl.notif_handler(None, frame)
+        assert not received  # callback only enqueues
+        await asyncio.sleep(0.01)
+        assert len(received) == 1
+
+        ctl.notif_handler(None, frame)
+        await ctl.stop_dispatcher()  # drains the queue
+        assert len(received) == 2
+
+    asyncio.run(work())
+    assert (received[0].speed, received[0].time, received[0].dist, received[0].steps) == (60, 554, 79, 977)
+    assert received[0].rtime <= received[1].rtime
+
+
+class EchoClient(FakeClient):
+    """Replies to speed commands with a status frame showing the new speed after a delay, ignores others"""
+
+    def __init__(self, ctl, delay=0.02):
+        super().__init__()
+        self.ctl = ctl
+        self.delay = delay
+        self.writes = []
+
+    async def write_gatt_char(self, char, cmd):
+        self.writes.append(bytes(cmd))
+        if cmd[2] == 1:
+            frame = bytearray(binascii.unhexlify("f8a2013c0100022a00004f0003d1b4000000e3fd"))
+            frame[3], frame[14] = cmd[3], cmd[3] * 3
+            asyncio.get_running_loop().call_later(self.delay, self.ctl.notif_handler, None, frame)
+
+
+def test_command_confirmation():
+    async def work():
+        ctl = Controller()
+        ctl.log_messages_info = False
+        ctl.minimal_cmd_space = 0
+        ctl.confirm_poll = 0.05
+        ctl.client = EchoClient(ctl)
+        ctl.char_fe02 = object()
+
+        st = await ctl.change_speed(35, confirm=True)
+        assert st.speed == 35
+        assert await ctl.switch_mode(0, confirm=True, timeout=0.12) is None  # no mode echo
+        assert await ctl.change_speed(40) is None  # no confirmation requested
+
+        # Belt already running, the start is not measured
+        assert await ctl.start_belt(confirm=True) is ctl.last_status
+        stopped = WalkingPadCurStatus(belt_state=0)
+        assert not WalkingPad.confirms(ctl.encoder.start, ctl.last_status, ctl.last_status)
+        assert WalkingPad.confirms(ctl.encoder.start, ctl.last_status, stopped)
+        return ctl
+
+    ctl = asyncio.run(work())
+    speed, mode = ctl.cmd_stats["speed"].summary(), ctl.cmd_stats["mode"].summary()
+    assert speed["count"] == 1 and 0.01 <= speed["median"] < 1.0
+    assert (mode["count"], mode["timeouts"]) == (0, 1)
+    assert "start" not in ctl.cmd_stats
+    assert ctl.client.writes.count(bytes([247, 162, 0, 0, 162, 253])) >= 1  # polled for status
+    assert not ctl.status_waiters
+
+
+def test_send_cmd_raw():
+    enc = CommandEncoder()
+    cmds = (enc.stats, enc.speed(30), enc.mode(1), enc.start, enc.hist[0], b"\xf7\xa7")
+    assert [WalkingPad.cmd_name(x) for x in cmds] == ["ask_stats", "speed", "mode", "start", "hist", "unknown"]
+
+    async def work(ctl):
+        ctl.log_messages_info = False
+        ctl.client = EchoClient(ctl)
+        ctl.char_fe02 = object()
+        await ctl.send_cmd_raw(enc.mode(1))
+
+    ctl = Controller()
+    ctl.metrics = Metrics()
+    asyncio.run(work(ctl))  # no event handler
+    assert ctl.last_cmd_name == "mode"
+    assert ctl.metrics.summaries[("walkingpad_cmd_latency_seconds", (("cmd", "mode"),))][0] == 1
+
+    events = []
+    ctl = Controller()
+    ctl.handler_event = lambda kind, **data: events.append((kind, data))
+    asyncio.run(work(ctl))
+    assert events == [("cmd", {"cmd": "mode", "raw": "f7a20201a5fd"})]
+
+
+def test_command_spacing():
+    sp = CommandSpacing(default=0.69, streak=2)
+    for _ in range(20):
+        sp.confirmed("speed", 0.3)
+    assert sp.get("speed") == 0.3 and sp.get("mode") == 0.69  # not below the confirmation latency
+
+    sp.failed("speed")
+    assert sp.get("speed") == 0.69
+    assert CommandSpacing().load(sp.dump()).get("speed") == 0.69
+
+    # Spacing of the previous command type is waited out, not the elapsed time
+    ctl = Controller()
+    ctl.spacing.load({"speed": 0.2})
+    ctl.last_cmd_name = "speed"
+    assert ctl.cmd_space() == 0.2
+    ctl.minimal_cmd_space = 0.5
+    assert ctl.spacing.default == 0.5
+
+
+def test_command_encoder():
+    enc = CommandEncoder()
+    for speed in range(enc.MAX_SPEED + 1):
+        assert enc.speed(speed) == WalkingPad.fix_crc(bytearray([247, 162, 1, speed, 0xFF, 253]))
+        assert enc.speed(speed) is enc.speed(speed)  # cached
+    assert enc.speed(80) == WalkingPad.fix_crc(bytearray([247, 162, 1, 80, 0xFF, 253]))
+    assert enc.mode(WalkingPad.MODE_MANUAL) == bytes([247, 162, 2, 1, 165, 253])
+    assert enc.stats == bytes([247, 162, 0, 0, 162, 253])
+    assert enc.history(1) == bytes([247, 167, 170, 0, 81, 253])
+    assert enc.pref(WalkingPad.PREFS_MAX_SPEED, [0, 0, 0, 60]) == WalkingPad.fix_crc(
+        bytearray([247, 166, 3, 0, 0, 0, 60, 0, 253])
+    )
+    assert [enc.profile(i) for i in range(len(WalkingPad.PAYLOADS_255))] == [bytes(x) for x in WalkingPad.PAYLOADS_255]
+
+    for frame in (
+        [247, 162, 1, 30, 0, 253],
+        [247, 162, 1, 30, 193],
+        [247, 162, 1, 30, 0, 193, 253],
+        [248, 162, 0, 0, 162, 253],
+    ):
+        with pytest.raises(ValueError):
+            CommandEncoder.validate_frame(bytes(frame))
+
+
+def test_connect_event(tmp_path, monkeypatch):
+    import bleak
+
+    class FakeBleakClient:
+        def __init__(self, address, disconnected_callback=None, **kwargs):
+            self.is_connected = False
+
+        async def connect(self, **kwargs):
+            self.is_connected = True
+            return True
+
+    monkeypatch.setattr(bleak, "BleakClient", FakeBleakClient)
+    fname = str(tmp_path / "events.json")
+    live = LiveView()
+    ctl = Controller(address=FakeDevice("AA:BB:CC:00:11:22", "WalkingPad"))
+    ctl.handler_event = EventLog(fname, views=[live]).event
+
+    # Reconnects go through connect() as well
+    assert asyncio.run(ctl.connect())
+    assert asyncio.run(ctl.connect())
+    ctl.on_disconnected(ctl.client)
+    with open(fname) as fh:
+        evs = [json.loads(x) for x in fh]
+    assert [x["state"] for x in evs] == ["connected", "connected", "disconnected"]
+    assert all(x["address"] == "AA:BB:CC:00:11:22" for x in evs)
+    assert live.address == "AA:BB:CC:00:11:22" and not live.connected
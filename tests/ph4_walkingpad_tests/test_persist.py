@@ -0,0 +1,45 @@
+import asyncio
+import json
+import time
+
+from ph4_walkingpad.persist import IOExecutor
+
+
+async def max_loop_lag(stop, interval=0.001):
+    lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(lag, time.perf_counter() - start - interval)
+    return lag
+
+
+def test_heavy_logging_lag(tmp_path):
+    fname = str(tmp_path / "stats.json")
+    line = json.dumps({"time": 554, "dist": 79, "steps": 977, "speed": 60, "raw": "f8a2" * 10, "pid": "x"}) + "\n"
+    num = 20000
+
+    async def run():
+        io = IOExecutor()
+        stop = asyncio.Event()
+        lag_task = asyncio.ensure_future(max_loop_lag(stop))
+        for i in range(num):
+            io.append(fname, line)
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+
+        profile = str(tmp_path / "profile.json")
+        await asyncio.wrap_future(io.save_json(profile, {"pid": "x"}, backup=True))
+        assert await io.run(lambda: json.load(open(profile))) == {"pid": "x"}
+
+        await io.drain()
+        stop.set()
+        lag = await lag_task
+        io.shutdown()
+        return io, lag
+
+    io, lag = asyncio.run(run())
+    with open(fname) as fh:
+        assert fh.read() == line * num
+    assert io.num_writes < num  # batched
+    assert lag < 0.05
@@ -0,0 +1,61 @@
+from ph4_walkingpad.pad import WalkingPadCurStatus
+from ph4_walkingpad.program import ProgramRunner, build_program, expand_steps
+
+
+def test_build_program():
+    steps = build_program(
+        {
+            "steps": [
+                {"speed": 3.0, "duration": 60},
+                {"ramp": [3.0, 4.0], "duration": 30, "step": 0.5},
+                {"repeat": 2, "steps": [{"speed": 5.0, "duration": 10}, {"speed": 3.5, "duration": 20}]},
+            ]
+        }
+    )
+    assert [(x.start, x.speed) for x in steps] == [
+        (0, 30),
+        (70, 35),
+        (80, 40),
+        (90, 50),
+        (100, 35),
+        (120, 50),
+        (130, 35),
+    ]
+    assert steps[0].duration == 70  # ramp start merged with the same speed
+
+
+def test_ramp_not_divisible():
+    ramp = expand_steps([{"ramp": [3.0, 4.0], "duration": 50, "step": 0.3}])
+    assert ramp == [(10.0, 30), (10.0, 33), (10.0, 36), (10.0, 39), (10.0, 40)]
+    assert [x[1] for x in expand_steps([{"ramp": [5.0, 3.0], "duration": 40, "step": 0.7}])] == [50, 43, 36, 30]
+
+
+class FakeCtler:
+    minimal_cmd_space = 0.69
+    last_cmd_time = None
+
+    def cmd_space(self):
+        return self.minimal_cmd_space
+
+
+def test_runner_timing():
+    now = [1000.0]
+    runner = ProgramRunner(FakeCtler(), build_program([{"speed": 3, "duration": 60}, {"speed": 5, "duration": 60}]))
+    runner.clock = lambda: now[0]
+    assert runner.is_due()  # first step starts right away
+    runner.idx = 1
+
+    runner.on_status(WalkingPadCurStatus(time=100, speed=30, rtime=1000.0))
+    assert runner.belt_time() == 0
+    now[0] = 1059.0
+    assert runner.belt_time() == 59.0
+    assert not runner.is_due()
+    now[0] = 1059.8
+    assert runner.is_due()  # 59.8 s + lead 0.3 s, issued ahead of 60 s
+
+    # Pacing of the controller is compensated
+    now[0] = 1059.5
+    assert not runner.is_due()
+    runner.ctler.last_cmd_time = 1059.4
+    assert runner.lead_time() > 0.8
+    assert runner.is_due()
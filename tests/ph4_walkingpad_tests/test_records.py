@@ -0,0 +1,118 @@
+import json
+import tracemalloc
+
+import pytest
+
+from ph4_walkingpad.analysis import StatsAnalysis
+from ph4_walkingpad.records import (
+    ANALYSIS_FIELDS,
+    SegmentRecords,
+    StatsLineParser,
+    StatusRecord,
+)
+
+LINE = (
+    '{"time": 554, "dist": 79, "steps": 977, "speed": 60, "app_speed": 180, "belt_state": 1, '
+    '"controller_button": 0, "manual_mode": 1, "raw": "f8a2013c0100022a00004f0003d1b4000000e3fd", '
+    '"rec_time": 1615644982.5917802, "pid": "ph4r05", "ccal": 23.343, "ccal_net": 18.616, '
+    '"ccal_sum": 58.267, "ccal_net_sum": 45.644}'
+)
+
+
+def test_fast_path():
+    parser = StatsLineParser()
+    rec = parser.parse(LINE)
+    js = json.loads(LINE)
+    assert rec == {k: js[k] for k in ANALYSIS_FIELDS}
+    assert parser.stats() == {"fast": 1, "fallback": 0, "failed": 0}
+
+
+def test_fallback():
+    parser = StatsLineParser()
+    rec = parser.parse('{"speed": 30, "time": 1, "dist": 2, "steps": 3, "rec_time": 10}')
+    assert rec == {"time": 1, "dist": 2, "steps": 3, "speed": 30, "rec_time": 10}
+    assert parser.parse('{"time": 1, "dist": ') is None
+    assert parser.parse("[1, 2]") is None
+    assert parser.stats() == {"fast": 0, "fallback": 1, "failed": 2}
+
+    # Full records and fields out of the fixed schema
+    assert StatsLineParser(None).parse(LINE) == json.loads(LINE)
+    assert StatsLineParser(("time", "pid")).parse(LINE) == {"time": 554, "pid": "ph4r05"}
+
+
+def test_status_record():
+    rec = StatsLineParser(records=True).parse(LINE)
+    assert isinstance(rec, StatusRecord)
+    assert (rec["time"], rec["speed"], rec.rec_time) == (554, 60, 1615644982.5917802)
+    assert "_records" not in rec and rec.get("_records") is None
+    with pytest.raises(KeyError):
+        rec["_segment_time"]
+
+    rec["_segment_time"] = 10
+    rec["pid"] = "ph4r05"
+    assert "_segment_time" in rec and "pid" in rec
+    assert dict(rec) == {k: json.loads(LINE)[k] for k in ANALYSIS_FIELDS} | {"_segment_time": 10, "pid": "ph4r05"}
+
+    cp = rec.copy()
+    cp["_records"] = [rec.copy()]
+    cp["pid"] = None
+    assert rec["pid"] == "ph4r05" and "_records" not in rec
+    assert json.loads(json.dumps(cp.to_dict()))["_records"][0]["_segment_time"] == 10
+
+    full = StatsLineParser(None, records=True).parse(LINE)
+    assert full.to_dict() == json.loads(LINE)
+
+
+def test_to_dict_empty_segment():
+    rec = StatusRecord.from_dict({"time": 1, "dist": 2, "steps": 3, "speed": 30, "rec_time": 10})
+    rec["_records"] = SegmentRecords(None, 100, 100, 0)
+    js = json.loads(json.dumps(rec.to_dict()))
+    assert js["_records"] == [] and js["time"] == 1
+
+
+def traced(fn, num=1000):
+    """Memory held by num parsed LINE records"""
+    tracemalloc.start()
+    res = [fn(LINE) for _ in range(num)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(res) == num
+    return size
+
+
+def test_load_projection():
+    fields = StatsAnalysis(fields=ANALYSIS_FIELDS).projection()
+    js = json.loads(LINE)
+    lines = [
+        LINE,
+        LINE.replace('"pid": "ph4r05"', '"pid": null, "dev": "AA:BB", "hist": true'),
+        LINE.replace(', "pid": "ph4r05"', ""),  # older records without owners
+        LINE.replace('"pid": "ph4r05"', '"pid": "ph4\\"r05"'),  # escaped string, full parse
+        LINE.replace('"pid": "ph4r05"', '"ccal_x": 1, "pid": "ph4r05"'),  # other order, full parse
+    ]
+    parser = StatsLineParser(fields, records=True)
+    recs = [parser.parse(x) for x in lines]
+    assert parser.stats() == {"fast": 3, "fallback": 2, "failed": 0}
+    for line, rec in zip(lines, recs):
+        expected = {k: json.loads(line).get(k) for k in fields}
+        assert dict(rec) == expected and rec.extra is None
+    assert (recs[1]["dev"], recs[1]["hist"], recs[0]["hist"]) == ("AA:BB", True, None)
+    assert dict(recs[0]) == {k: js[k] for k in ANALYSIS_FIELDS} | {"pid": "ph4r05", "dev": None, "hist": None}
+
+    # Compact records take less memory than the projected dicts
+    assert traced(parser.parse) < 0.9 * traced(lambda x: {k: json.loads(x).get(k) for k in fields})
+
+
+def test_from_dict():
+    js = json.loads(LINE)
+    rec = StatusRecord.from_dict(js, copy=False)
+    assert rec.extra is js and "time" not in js and "raw" in js  # dict taken over, slot fields moved out
+    assert rec.to_dict() == json.loads(LINE)
+    assert traced(StatsLineParser(None, records=True).parse) < traced(json.loads)  # full records
+    assert StatusRecord.from_dict({"time": 5}).to_dict() == {
+        "time": 5,
+        "dist": 0,
+        "steps": 0,
+        "speed": 0,
+        "rec_time": 0.0,
+    }
@@ -0,0 +1,71 @@
+import io
+
+import pytest
+
+from ph4_walkingpad.resample import export_csv, resample
+
+
+def polled_walk(dropout=(40, 70)):
+    """3 km/h for 60 s then 5 km/h for 60 s, polled every 10 s, packets dropped around the speed change"""
+    recs, dist_m = [], 0.0
+    for t in range(121):
+        speed = 30 if t < 60 else 50
+        if t % 10 == 0 and not dropout[0] <= t <= dropout[1]:
+            recs.append(
+                {
+                    "rec_time": 1000.0 + t,
+                    "time": t,
+                    "dist": int(dist_m / 10),
+                    "steps": 2 * t,
+                    "speed": speed,
+                    "pid": "a",
+                }
+            )
+        dist_m += speed / 36.0
+    return recs
+
+
+def test_resample():
+    recs = polled_walk()
+    out = list(resample(recs, 1.0, use_numpy=False))
+    assert [x["rec_time"] for x in out] == [1000.0 + i for i in range(121)]
+    assert out[-1] == recs[-1] and out[0]["time"] == 0 and out[50]["steps"] == 100
+    assert all(x["pid"] == "a" for x in out)
+
+    # Speed change inferred from the distance travelled during the dropout
+    changed = next(x["rec_time"] for x in out if x["speed"] == 50) - 1000
+    assert 55 <= changed <= 65
+
+    # Newest first input, as the analysis reads the stats file
+    rev = list(resample(reversed(recs), 1.0, reverse=True, use_numpy=False))
+    assert [x["rec_time"] for x in rev] == [x["rec_time"] for x in reversed(out)]
+    # Change at a grid point falls to the other side in the reversed direction
+    assert sum(a["speed"] != b["speed"] for a, b in zip(rev, reversed(out))) <= 1
+
+    # Chunked streaming gives the same timeline
+    assert list(resample(recs, 1.0, chunk=3, use_numpy=False)) == out
+
+
+def test_resample_breaks():
+    first = polled_walk(dropout=(0, -1))[:5]
+    second = [dict(x, time=x["time"] - 40, steps=0, dist=0, rec_time=x["rec_time"] + 600) for x in first]
+    out = list(resample(first + second, 5.0, use_numpy=False))
+    assert len(out) == 2 * 9
+    assert out[8] == first[-1] and out[9]["rec_time"] == second[0]["rec_time"]
+
+
+def test_resample_numpy():
+    pytest.importorskip("numpy")
+    recs = polled_walk()
+    py = list(resample(recs, 0.7, use_numpy=False))
+    vec = list(resample(recs, 0.7, use_numpy=True, chunk=5))
+    assert len(py) == len(vec)
+    for a, b in zip(py, vec):
+        assert a.keys() == b.keys() and a["speed"] == b["speed"]
+        assert all(abs(a[k] - b[k]) < 1e-6 for k in ("rec_time", "time", "dist", "steps"))
+
+
+def test_export_csv():
+    fh = io.StringIO()
+    assert export_csv(polled_walk(), fh, 10.0) == 13
+    assert fh.getvalue().splitlines()[0] == "rec_time,time,dist,steps,speed"
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+from ph4_walkingpad.runtime import Runtime
+
+
+def test_runtime():
+    runtime = Runtime()
+    cancelled = []
+
+    async def failing():
+        raise ValueError("command failed")
+
+    async def service():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        assert await runtime.spawn(failing()) is None  # logged, the group keeps running
+        runtime.spawn(service())
+
+        # Submitted from another thread, runs on the runtime loop
+        loops = []
+
+        async def on_loop():
+            loops.append(asyncio.get_running_loop())
+            return 42
+
+        res = []
+        thread = threading.Thread(target=lambda: res.append(runtime.spawn(on_loop()).result(5)))
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.01)
+        assert res == [42] and loops == [asyncio.get_running_loop()]
+        return "done"
+
+    assert asyncio.run(runtime.run(main())) == "done"
+    assert cancelled == [True] and not runtime.tasks
+    assert len(runtime.latencies) == 3
@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from ph4_walkingpad.sync import RecordSync, extract_records
+
+REMOTE = [{"time": 1600000000 + i * 1000, "dur": 600, "step": 900} for i in range(25)]
+
+
+class RecordsHandler(BaseHTTPRequestHandler):
+    requests = []
+    fail_page = None
+
+    def do_GET(self):
+        qs = parse_qs(urlparse(self.path).query)
+        RecordsHandler.requests.append(qs)
+        page, per_page = int(qs["page"][0]), int(qs["per_page"][0])
+        if page == RecordsHandler.fail_page:
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        since = int(qs["timestamp"][0]) if "timestamp" in qs else 0
+
+        recs = sorted([x for x in REMOTE if x["time"] > since], key=lambda x: -x["time"])
+        data = recs[(page - 1) * per_page : page * per_page]
+        resp = json.dumps({"code": 0, "data": {"list": data}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(resp)))
+        self.end_headers()
+        self.wfile.write(resp)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_extract_records():
+    assert extract_records([{"time": 1}]) == [{"time": 1}]
+    assert extract_records({"data": [{"time": 1}]}) == [{"time": 1}]
+    assert extract_records({"data": {"list": [{"time": 1}]}}) == [{"time": 1}]
+    assert extract_records({"code": 1}) == []
+
+
+def serve():
+    server = HTTPServer(("127.0.0.1", 0), RecordsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_address[1]
+
+
+def test_record_sync(tmp_path):
+    server, api_url = serve()
+    cache_file = os.path.join(str(tmp_path), "records.json")
+    RecordsHandler.requests = []
+
+    try:
+        sync = RecordSync(cache_file, per_page=10)
+        assert sync.sync("tok", api_url=api_url) == 25
+        assert len(RecordsHandler.requests) == 3
+        assert sync.timestamp == REMOTE[-1]["time"]
+
+        # Only newer records are fetched on the next run
+        REMOTE.append({"time": 1600100000, "dur": 300, "step": 400})
+        sync2 = RecordSync(cache_file, per_page=10).load()
+        RecordsHandler.requests = []
+        assert sync2.sync("tok", api_url=api_url) == 1
+        assert len(RecordsHandler.requests) == 1
+        assert RecordsHandler.requests[0]["timestamp"] == [str(REMOTE[-2]["time"])]
+
+        walks = [(0, (10, 1600000030, 600, 80, 900)), (1, (10, 1700000000, 600, 80, 900)), (2, (0, 0, 0, 0, 0))]
+        assert [x[0] for x in sync2.missing_walks(walks)] == [1]
+    finally:
+        REMOTE.pop()
+        server.shutdown()
+
+
+def test_record_sync_page_failure(tmp_path):
+    server, api_url = serve()
+    RecordsHandler.requests = []
+    try:
+        sync = RecordSync(os.path.join(str(tmp_path), "records.json"), per_page=10)
+        RecordsHandler.fail_page = 2
+        with pytest.raises(requests.HTTPError):
+            sync.sync("tok", api_url=api_url)
+        assert sync.timestamp == 0  # page 1 holds the newest records, older ones were not fetched
+
+        RecordsHandler.fail_page = None
+        assert sync.sync("tok", api_url=api_url) == 15
+        assert len(sync.records) == 25 and sync.timestamp == REMOTE[-1]["time"]
+    finally:
+        RecordsHandler.fail_page = None
+        server.shutdown()
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ph4_walkingpad.upload import UploadQueue, walk_id
+
+
+class RecordHandler(BaseHTTPRequestHandler):
+    fail_next = 0
+    fail_status = 503
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if RecordHandler.fail_next > 0:
+            RecordHandler.fail_next -= 1
+            self.send_response(RecordHandler.fail_status)
+            self.end_headers()
+            return
+
+        RecordHandler.received.append((self.path, self.headers.get("Cookie"), json.loads(body)))
+        resp = json.dumps({"code": 0}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(resp)))
+        self.end_headers()
+        self.wfile.write(resp)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_upload_queue(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), RecordHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    RecordHandler.fail_next = 2
+    RecordHandler.received = []
+
+    outbox = os.path.join(str(tmp_path), "outbox.json")
+    api_url = "http://127.0.0.1:%d/user/api/v2" % server.server_address[1]
+    queue = UploadQueue(outbox, api_url=api_url, backoff=0.01)
+    try:
+        wid, res = asyncio.run(queue.upload("tok", "ff:ff", cal=100, timex=1600000000, dur=600, distance=80, step=900))
+        assert wid == walk_id("ff:ff", 1600000000)
+        assert res["response"] == {"code": 0}
+        assert len(RecordHandler.received) == 1
+        path, cookie, js = RecordHandler.received[0]
+        assert path == "/user/api/v2/record"
+        assert cookie == "user=tok"
+        assert (js["did"], js["time"], js["step"]) == ("ff:ff", 1600000000, 900)
+
+        # Idempotent, already uploaded walk is not queued again
+        assert queue.enqueue("ff:ff", cal=100, timex=1600000000, dur=600, distance=80, step=900) is None
+        assert queue.enqueue("ff:ff", cal=50, timex=1600001000, dur=300, distance=40, step=450)
+        assert queue.enqueue("ff:ff", cal=60, timex=1600002000, dur=300, distance=40, step=450)
+
+        # Outbox survives restart
+        queue2 = UploadQueue(outbox, api_url=api_url, backoff=0.01).load()
+        assert len(queue2.pending) == 2 and wid in queue2.done
+        res = asyncio.run(queue2.flush("tok"))
+        assert all(not isinstance(x, Exception) for x in res.values())
+        assert not queue2.pending
+        assert len(RecordHandler.received) == 3
+        queue2.close()
+
+    finally:
+        queue.close()
+        server.shutdown()
+
+
+def test_upload_queue_failures(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), RecordHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    RecordHandler.received = []
+
+    outbox = os.path.join(str(tmp_path), "outbox.json")
+    api_url = "http://127.0.0.1:%d/user/api/v2" % server.server_address[1]
+    queue = UploadQueue(outbox, api_url=api_url, retries=1, backoff=0.01)
+    walk = dict(cal=100, timex=1600000000, dur=600, distance=80, step=900)
+    try:
+        # Retries exhausted, the walk stays pending and an explicit upload sends it again
+        RecordHandler.fail_status, RecordHandler.fail_next = 503, 2
+        wid, res = asyncio.run(queue.upload("tok", "ff:ff", **walk))
+        assert isinstance(res, IOError) and wid in queue.pending
+        wid, res = asyncio.run(queue.upload("tok", "ff:ff", **walk))
+        assert res["response"] == {"code": 0} and wid in queue.done
+
+        # Rejected walk is not retried by flush, reported as failed
+        RecordHandler.fail_status, RecordHandler.fail_next = 400, 1
+        wid = queue.enqueue("ff:ff", cal=50, timex=1600001000, dur=300, distance=40, step=450)
+        res = asyncio.run(queue.flush("tok"))
+        assert isinstance(res[wid], IOError)
+        assert not queue.pending and queue.failed[wid]["error"] == "HTTP 400"
+        assert queue.enqueue("ff:ff", cal=50, timex=1600001000, dur=300, distance=40, step=450) is None
+        assert wid in UploadQueue(outbox).load().failed
+        assert len(RecordHandler.received) == 1
+
+    finally:
+        RecordHandler.fail_status = 503
+        queue.close()
+        server.shutdown()